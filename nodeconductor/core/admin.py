@@ -217,10 +217,10 @@ class ExecutorAdminAction(object):
             except ValidationError as e:
                 errors[str(e)].append(instance)
             else:
-                self.executor.execute(instance)
                 successfully_executed.append(instance)
 
         if successfully_executed:
+            self.executor.execute_many(queryset.filter(pk__in=[instance.pk for instance in successfully_executed]))
             message = _('Operation was successfully scheduled for %(count)d instances: %(names)s') % dict(
                 count=len(successfully_executed),
                 names=', '.join([str(i) for i in successfully_executed])
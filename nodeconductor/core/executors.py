@@ -1,3 +1,6 @@
+from celery import group
+from celery.result import ResultSet
+
 from nodeconductor.core import utils, tasks
 
 
@@ -45,6 +48,22 @@ class BaseExecutor(object):
         cls.post_apply(instance, async=async, **kwargs)
         return result
 
+    @classmethod
+    def execute_many(cls, queryset, countdown=2, is_heavy_task=False, chunk_size=100, **kwargs):
+        """ Execute high level-operation for each object of queryset.
+
+        Signatures are published as Celery groups of chunk_size tasks.
+        Returns result set of all groups.
+        """
+        instances = cls.pre_apply_many(queryset, **kwargs)
+        signatures = [cls.get_linked_signature(instance, countdown=countdown,
+                                               is_heavy_task=is_heavy_task, **kwargs)
+                      for instance in instances]
+        results = [group(signatures[index:index + chunk_size]).apply_async()
+                   for index in range(0, len(signatures), chunk_size)]
+        cls.post_apply_many(instances, **kwargs)
+        return ResultSet(results)
+
     @classmethod
     def pre_apply(cls, instance, **kwargs):
         """ Perform synchronous actions before signature apply """
@@ -55,6 +74,40 @@ class BaseExecutor(object):
         """ Perform synchronous actions after signature apply """
         pass
 
+    @classmethod
+    def pre_apply_many(cls, queryset, **kwargs):
+        """ Perform synchronous actions before signatures apply for each object of queryset.
+
+        Returns list of objects that should be executed.
+        Override this method to replace per-object "pre_apply" calls with bulk query.
+        """
+        instances = list(queryset)
+        for instance in instances:
+            cls.pre_apply(instance, **kwargs)
+        return instances
+
+    @classmethod
+    def post_apply_many(cls, instances, **kwargs):
+        """ Perform synchronous actions after signatures apply for each object """
+        for instance in instances:
+            cls.post_apply(instance, **kwargs)
+
+    @classmethod
+    def get_linked_signature(cls, instance, countdown=None, is_heavy_task=False, **kwargs):
+        """ Get signature with success and failure callbacks for asynchronous apply """
+        serialized_instance = utils.serialize_instance(instance)
+
+        signature = cls.get_task_signature(instance, serialized_instance, **kwargs)
+        link = cls.get_success_signature(instance, serialized_instance, **kwargs)
+        link_error = cls.get_failure_signature(instance, serialized_instance, **kwargs)
+
+        options = dict(countdown=countdown, queue=is_heavy_task and 'heavy' or None)
+        if link is not None:
+            options['link'] = link
+        if link_error is not None:
+            options['link_error'] = link_error
+        return signature.set(**options)
+
     @classmethod
     def apply_signature(cls, instance, async=True, countdown=None, is_heavy_task=False, **kwargs):
         """ Serialize input data and apply signature """
@@ -148,12 +201,22 @@ class UpdateExecutor(SuccessExecutorMixin, ErrorExecutorMixin, BaseExecutor):
         instance.schedule_updating()
         instance.save(update_fields=['state'])
 
+    @classmethod
+    def pre_apply_many(cls, queryset, **kwargs):
+        return utils.bulk_state_transition(queryset, 'schedule_updating')
+
     @classmethod
     def execute(cls, instance, async=True, **kwargs):
         if 'updated_fields' not in kwargs:
             raise ExecutorException('updated_fields keyword argument should be defined for UpdateExecutor.')
         super(UpdateExecutor, cls).execute(instance, async=async, **kwargs)
 
+    @classmethod
+    def execute_many(cls, queryset, **kwargs):
+        if 'updated_fields' not in kwargs:
+            raise ExecutorException('updated_fields keyword argument should be defined for UpdateExecutor.')
+        return super(UpdateExecutor, cls).execute_many(queryset, **kwargs)
+
 
 class DeleteExecutor(DeleteExecutorMixin, BaseExecutor):
     """ Default states transition for object deletion.
@@ -168,6 +231,10 @@ class DeleteExecutor(DeleteExecutorMixin, BaseExecutor):
         instance.schedule_deleting()
         instance.save(update_fields=['state'])
 
+    @classmethod
+    def pre_apply_many(cls, queryset, **kwargs):
+        return utils.bulk_state_transition(queryset, 'schedule_deleting')
+
 
 class ActionExecutor(SuccessExecutorMixin, ErrorExecutorMixin, BaseExecutor):
     """ Default states transition for executing action with object.
@@ -0,0 +1,29 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+import prettytable
+
+from nodeconductor.core import task_stats
+
+
+class Command(BaseCommand):
+    help = "Print performance statistics of Celery tasks. Time metrics are measured in milliseconds."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=task_stats.WINDOWS_COUNT,
+                            help='Number of last hours to collect statistics for.')
+        parser.add_argument('--order-by', dest='order_by', default='wall_time',
+                            choices=('count',) + task_stats.METRICS,
+                            help='Metric to sort tasks by (descending).')
+
+    def handle(self, *args, **options):
+        hours = min(max(options['hours'], 1), task_stats.WINDOWS_COUNT)
+        stats = task_stats.get_stats(windows_count=hours)
+        stats.sort(key=lambda row: row[options['order_by']], reverse=True)
+
+        columns = ['Task', 'Count'] + ['Avg %s' % metric.replace('_', ' ') for metric in task_stats.METRICS]
+        table = prettytable.PrettyTable(columns)
+        for row in stats:
+            table.add_row([row['name'], row['count']] +
+                          ['%.1f' % row['avg_' + metric] for metric in task_stats.METRICS])
+        self.stdout.write(table.get_string())
@@ -200,6 +200,10 @@ class User(LoggableMixin, UuidMixin, DescribableMixin, AbstractBaseUser, Permiss
         else:
             return {'user_uuid': [user.uuid]}
 
+    def get_permitted_users_uuids(self):
+        query = models.Q(is_staff=True) | models.Q(is_support=True) | models.Q(pk=self.pk)
+        return User.objects.filter(query).values_list('uuid', flat=True)
+
     def clean(self):
         super(User, self).clean()
         # User email has to be unique or empty
@@ -0,0 +1,170 @@
+""" Performance telemetry of Celery tasks.
+
+Worker measures each task execution and aggregates measurements in cache:
+ - wall and CPU time of execution;
+ - queue latency - time between task publishing and start of execution;
+ - number and duration of database queries issued by task.
+
+Measurements are aggregated per task name in rolling windows of WINDOW seconds.
+Statistics for the last WINDOWS_COUNT windows are available via `get_stats`.
+
+Telemetry is disabled by default, because queries are measured via debug cursor
+that keeps log of all queries of the task in memory.
+"""
+from __future__ import unicode_literals
+
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from nodeconductor.core import utils
+
+logger = logging.getLogger(__name__)
+
+WINDOW = 60 * 60
+WINDOWS_COUNT = 24
+# Upper bounds of wall time histogram buckets in milliseconds, last bucket is unbounded.
+BUCKETS = (10, 100, 1000, 10 * 1000, 60 * 1000, 10 * 60 * 1000)
+METRICS = ('wall_time', 'cpu_time', 'queue_time', 'queries', 'queries_time')
+PUBLISHED_AT_HEADER = 'task_published_at'
+
+_running_tasks = {}
+
+
+def is_enabled():
+    return settings.NODECONDUCTOR.get('TASK_STATS_ENABLED', False)
+
+
+def _get_cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def _get_bucket(wall_time):
+    for bucket in BUCKETS:
+        if wall_time <= bucket:
+            return str(bucket)
+    return 'inf'
+
+
+def _get_window(timestamp=None):
+    timestamp = timestamp or time.time()
+    return int(timestamp) // WINDOW
+
+
+def _get_names_key(window):
+    return 'task_stats:%s:names' % window
+
+
+def _get_key(window, task_name, metric):
+    return 'task_stats:%s:%s:%s' % (window, task_name, metric)
+
+
+def _get_description_key(task_name):
+    return 'task_stats:description:%s' % task_name
+
+
+def _increment(key, delta):
+    cache.add(key, 0, WINDOW * WINDOWS_COUNT)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # key has expired between add and incr
+        pass
+
+
+def start(task_id, published_at=None):
+    """ Remember task start and enable queries logging for default database connection. """
+    _running_tasks[task_id] = {
+        'started_at': time.time(),
+        'cpu_time': _get_cpu_time(),
+        'published_at': published_at,
+        'force_debug_cursor': connection.force_debug_cursor,
+    }
+    connection.queries_log.clear()
+    connection.force_debug_cursor = True
+
+
+def finish(task_id, task_name, description=None):
+    """ Measure finished task and add measurements to statistics of current window. """
+    try:
+        context = _running_tasks.pop(task_id)
+    except KeyError:
+        return
+
+    queries = list(connection.queries_log)
+    connection.queries_log.clear()
+    connection.force_debug_cursor = context['force_debug_cursor']
+
+    finished_at = time.time()
+    measurements = {
+        'wall_time': (finished_at - context['started_at']) * 1000,
+        'cpu_time': (_get_cpu_time() - context['cpu_time']) * 1000,
+        'queue_time': (context['started_at'] - context['published_at']) * 1000 if context['published_at'] else 0,
+        # queries log has limited size, so number of queries is not exact for very heavy tasks
+        'queries': len(queries),
+        'queries_time': sum(float(query['time']) for query in queries) * 1000,
+    }
+    try:
+        record(task_name, measurements, description)
+    except Exception as e:
+        # Telemetry should never break workflow.
+        logger.exception('Cannot record statistics of task %s. Error: %s', task_name, e)
+
+
+def record(task_name, measurements, description=None):
+    window = _get_window()
+    utils.add_to_cache_set(_get_names_key(window), task_name, WINDOW * WINDOWS_COUNT)
+
+    _increment(_get_key(window, task_name, 'count'), 1)
+    _increment(_get_key(window, task_name, 'bucket_' + _get_bucket(measurements['wall_time'])), 1)
+    for metric in METRICS:
+        _increment(_get_key(window, task_name, metric), int(measurements[metric]))
+
+    if description:
+        cache.set(_get_description_key(task_name), description, WINDOW * WINDOWS_COUNT)
+
+
+def get_stats(windows_count=WINDOWS_COUNT):
+    """ Return statistics of tasks for last windows_count windows.
+
+        Time metrics are in milliseconds, averages are per one task execution.
+    """
+    current_window = _get_window()
+    windows = range(current_window - windows_count + 1, current_window + 1)
+    names_by_window = utils.get_cache_sets([_get_names_key(window) for window in windows])
+
+    keys = []
+    for window in windows:
+        for task_name in names_by_window.get(_get_names_key(window), ()):
+            keys.append((window, task_name))
+    buckets = ['bucket_' + str(bucket) for bucket in BUCKETS] + ['bucket_inf']
+    counters = ('count',) + METRICS + tuple(buckets)
+    values = cache.get_many([_get_key(window, task_name, counter)
+                             for window, task_name in keys for counter in counters])
+
+    stats = {}
+    for window, task_name in keys:
+        task_stats = stats.setdefault(task_name, dict.fromkeys(counters, 0))
+        for counter in counters:
+            task_stats[counter] += values.get(_get_key(window, task_name, counter), 0)
+
+    descriptions = cache.get_many([_get_description_key(task_name) for task_name in stats])
+    result = []
+    for task_name, task_stats in sorted(stats.items()):
+        count = task_stats['count'] or 1
+        row = {
+            'name': task_name,
+            'count': task_stats['count'],
+            'description': descriptions.get(_get_description_key(task_name), ''),
+            'histogram': {bucket[len('bucket_'):]: task_stats[bucket] for bucket in buckets},
+        }
+        for metric in METRICS:
+            row[metric] = task_stats[metric]
+            row['avg_' + metric] = task_stats[metric] / float(count)
+        result.append(row)
+    return result
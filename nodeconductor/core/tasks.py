@@ -5,6 +5,7 @@ import hashlib
 import logging
 
 from celery import Task as CeleryTask
+from celery.utils import uuid
 from celery.execute import send_task as send_celery_task
 from celery.worker.job import Request
 from django.core.cache import cache
@@ -114,14 +115,42 @@ class StateTransitionTask(Task):
         return 'Change state of object "%s" using method "%s".' % (instance, transition_method)
 
     def state_transition(self, instance, transition_method, action=None, action_details=None):
+        """ Change instance state with compare-and-swap UPDATE query.
+
+            Returns number of updated rows. Transitions that cannot be expressed
+            as single query are executed via django-fsm method and full instance save.
+        """
         instance_description = '%s instance `%s` (PK: %s)' % (instance.__class__.__name__, instance, instance.pk)
         old_state = instance.human_readable_state
+        fields = {}
+        if action is not None:
+            fields['action'] = action
+        if action_details is not None:
+            fields['action_details'] = action_details
+
+        try:
+            updated = utils.state_transition_update(instance, transition_method, **fields)
+        except ValueError:
+            updated = self._save_state_transition(instance, transition_method, fields)
+
+        if not updated:
+            current_state = instance.__class__.objects.filter(pk=instance.pk).values_list('state', flat=True).first()
+            message = (
+                'Could not change state of %s, using method `%s`. '
+                'Transition is not allowed for current state %s or instance was updated concurrently.' %
+                (instance_description, transition_method, current_state))
+            raise StateChangeError(message)
+
+        logger.info('State of %s changed from %s to %s, with method `%s`',
+                    instance_description, old_state, instance.human_readable_state, transition_method)
+        return updated
+
+    def _save_state_transition(self, instance, transition_method, fields):
+        instance_description = '%s instance `%s` (PK: %s)' % (instance.__class__.__name__, instance, instance.pk)
         try:
             getattr(instance, transition_method)()
-            if action is not None:
-                instance.action = action
-            if action_details is not None:
-                instance.action_details = action_details
+            for name, value in fields.items():
+                setattr(instance, name, value)
             instance.save()
         except IntegrityError:
             message = (
@@ -133,9 +162,7 @@ class StateTransitionTask(Task):
                 'Could not change state of %s, using method `%s`. Current instance state: %s.' %
                 (instance_description, transition_method, instance.human_readable_state))
             six.reraise(StateChangeError, StateChangeError(message))
-        else:
-            logger.info('State of %s changed from %s to %s, with method `%s`',
-                        instance_description, old_state, instance.human_readable_state, transition_method)
+        return 1
 
     def pre_execute(self, instance):
         state_transition = self.kwargs.pop('state_transition', None)
@@ -304,35 +331,56 @@ class BackgroundTask(CeleryTask):
            should log themselves explicitly and make sure that they will not
            spam error messages.
 
-        Implement "is_equal" method to define what tasks are equal and should
-        be executed simultaneously.
+        Uncompleted tasks are tracked in cache: task claims its deduplication key
+        on publish and releases it on success or failure. Key expires after
+        LOCK_LIFETIME seconds so tasks of crashed workers do not block queue forever.
+
+        Override "get_deduplication_key" method to define what tasks are equal and should
+        not be executed simultaneously.
     """
     is_background = True
+    LOCK_LIFETIME = 60 * 60
+
+    def get_deduplication_key(self, *args, **kwargs):
+        """ Return cache key that is equal for tasks that do the same operation. """
+        kwargs = {key: value for key, value in kwargs.items() if key != 'event_context'}
+        hash_input = json.dumps({'name': self.name, 'args': args, 'kwargs': kwargs}, sort_keys=True)
+        # md5 is used for internal caching, not need to care about security
+        return 'background_task:%s' % hashlib.md5(hash_input.encode('utf-8')).hexdigest()  # nosec
 
-    def is_equal(self, other_task, *args, **kwargs):
-        """ Return True if task do the same operation as other_task.
+    def claim(self, task_id, *args, **kwargs):
+        """ Atomically mark task as uncompleted. Return False if equal task is uncompleted already. """
+        key = self.get_deduplication_key(*args, **kwargs)
+        return cache.add(key, task_id, self.LOCK_LIFETIME)
 
-            Note! Other task is represented as serialized celery task - dictionary.
-        """
-        raise NotImplementedError('BackgroundTask should implement "is_equal" method to avoid queue overload.')
-
-    def is_previous_task_processing(self, *args, **kwargs):
-        """ Return True if exist task that is equal to current and is uncompleted """
-        app = self._get_app()
-        inspect = app.control.inspect()
-        active = inspect.active() or {}
-        scheduled = inspect.scheduled() or {}
-        reserved = inspect.reserved() or {}
-        uncompleted = sum(active.values() + scheduled.values() + reserved.values(), [])
-        return any(self.is_equal(task, *args, **kwargs) for task in uncompleted)
+    def release(self, task_id, *args, **kwargs):
+        """ Mark task as completed so equal task could be scheduled again. """
+        key = self.get_deduplication_key(*args, **kwargs)
+        if cache.get(key) == task_id:
+            cache.delete(key)
 
     def apply_async(self, args=None, kwargs=None, **options):
         """ Do not run background task if previous task is uncompleted """
-        if self.is_previous_task_processing(*args, **kwargs):
+        args = args or ()
+        kwargs = kwargs or {}
+        task_id = options.setdefault('task_id', uuid())
+        if not self.claim(task_id, *args, **kwargs):
             message = 'Background task %s was not scheduled, because its predecessor is not completed yet.' % self.name
             logger.info(message)
             return
-        return super(BackgroundTask, self).apply_async(args=args, kwargs=kwargs, **options)
+        try:
+            return super(BackgroundTask, self).apply_async(args=args, kwargs=kwargs, **options)
+        except Exception:
+            self.release(task_id, *args, **kwargs)
+            raise
+
+    def on_success(self, retval, task_id, args, kwargs):
+        self.release(task_id, *args, **kwargs)
+        return super(BackgroundTask, self).on_success(retval, task_id, args, kwargs)
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        self.release(task_id, *args, **kwargs)
+        return super(BackgroundTask, self).on_failure(exc, task_id, args, kwargs, einfo)
 
 
 class PenalizedBackgroundTask(BackgroundTask):
@@ -402,18 +450,22 @@ class PenalizedBackgroundTask(BackgroundTask):
         return super(PenalizedBackgroundTask, self).on_success(retval, task_id, args, kwargs)
 
 
+def get_task_description(task, args, kwargs):
+    """ Return description of task execution or None if task does not provide it """
+    if not isinstance(task, Task):
+        return None
+    try:
+        return task.get_description(*args, **kwargs)
+    except NotImplementedError:
+        pass
+    except Exception as e:
+        # Logging should never break workflow.
+        logger.exception('Cannot get description for task %s. Error: %s' % (task.__class__.__name__, e))
+
+
 def log_celery_task(request):
     """ Add description to celery log output """
-    task = request.task
-    description = None
-    if isinstance(task, Task):
-        try:
-            description = task.get_description(*request.args, **request.kwargs)
-        except NotImplementedError:
-            pass
-        except Exception as e:
-            # Logging should never break workflow.
-            logger.exception('Cannot get description for task %s. Error: %s' % (task.__class__.__name__, e))
+    description = get_task_description(request.task, request.args, request.kwargs)
 
     return '{0.name}[{0.id}]{1}{2}{3}'.format(
         request,
@@ -0,0 +1,65 @@
+from __future__ import unicode_literals
+
+from django.core.cache import cache
+from django.test import override_settings
+import mock
+from rest_framework import status, test
+
+from nodeconductor.core import task_stats
+from nodeconductor.server import celery as celery_config
+from nodeconductor.structure.tests.factories import UserFactory
+
+
+class TaskStatsTest(test.APITransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.url = 'http://testserver/api/task-stats/'
+
+    def test_measurements_are_aggregated_by_task_name(self):
+        measurements = dict(wall_time=50, cpu_time=20, queue_time=1000, queries=10, queries_time=5)
+        task_stats.record('nodeconductor.test', measurements, description='Test task.')
+        task_stats.record('nodeconductor.test', dict(measurements, wall_time=150))
+
+        stats = task_stats.get_stats()
+
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0]['count'], 2)
+        self.assertEqual(stats[0]['avg_wall_time'], 100)
+        self.assertEqual(stats[0]['queries'], 20)
+        self.assertEqual(stats[0]['histogram']['100'], 1)
+        self.assertEqual(stats[0]['histogram']['1000'], 1)
+        self.assertEqual(stats[0]['description'], 'Test task.')
+
+    def test_task_execution_is_measured(self):
+        task_stats.start('task-id')
+        UserFactory()
+        task_stats.finish('task-id', 'nodeconductor.test')
+
+        stats = task_stats.get_stats()
+        self.assertEqual(stats[0]['count'], 1)
+        self.assertGreater(stats[0]['queries'], 0)
+
+    @override_settings(NODECONDUCTOR={'TASK_STATS_ENABLED': True})
+    def test_publish_time_is_passed_in_message_headers(self):
+        body = {'kwargs': {}}
+        headers = {}
+        celery_config.pass_publish_time(body=body, headers=headers)
+
+        self.assertEqual(body['kwargs'], {})
+        task = mock.Mock()
+        task.request.headers = headers
+        with mock.patch('nodeconductor.core.task_stats.start') as start:
+            celery_config.start_task_stats(task_id='task-id', task=task)
+        start.assert_called_once_with('task-id', headers[task_stats.PUBLISHED_AT_HEADER])
+
+    def test_staff_can_access_task_stats(self):
+        self.client.force_authenticate(user=UserFactory(is_staff=True))
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_user_cannot_access_task_stats(self):
+        self.client.force_authenticate(user=UserFactory())
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
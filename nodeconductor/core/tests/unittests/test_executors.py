@@ -0,0 +1,44 @@
+from __future__ import unicode_literals
+
+from celery import group
+from django.test import TestCase
+import mock
+
+from nodeconductor.core import executors, tasks
+from nodeconductor.structure.tests import factories, models
+
+
+class TestDeleteExecutor(executors.DeleteExecutor):
+
+    @classmethod
+    def get_task_signature(cls, instance, serialized_instance, **kwargs):
+        return tasks.EmptyTask().si()
+
+
+@mock.patch.object(group, 'apply_async')
+class ExecuteManyTest(TestCase):
+
+    def setUp(self):
+        States = models.TestNewInstance.States
+        self.stable_instances = factories.TestNewInstanceFactory.create_batch(size=3, state=States.OK)
+        self.creating_instance = factories.TestNewInstanceFactory(state=States.CREATING)
+        self.queryset = models.TestNewInstance.objects.all()
+
+    def test_objects_are_scheduled_for_deletion(self, apply_async):
+        TestDeleteExecutor.execute_many(self.queryset)
+
+        for instance in self.stable_instances:
+            instance.refresh_from_db()
+            self.assertEqual(instance.state, models.TestNewInstance.States.DELETION_SCHEDULED)
+
+    def test_objects_that_cannot_perform_transition_are_skipped(self, apply_async):
+        TestDeleteExecutor.execute_many(self.queryset)
+
+        self.creating_instance.refresh_from_db()
+        self.assertEqual(self.creating_instance.state, models.TestNewInstance.States.CREATING)
+
+    def test_signatures_are_published_in_chunks(self, apply_async):
+        result = TestDeleteExecutor.execute_many(self.queryset, chunk_size=2)
+
+        self.assertEqual(apply_async.call_count, 2)
+        self.assertEqual(len(result.results), 2)
@@ -0,0 +1,132 @@
+from __future__ import unicode_literals
+
+from celery import Task as CeleryTask
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import signals
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django_fsm import signals as fsm_signals
+import mock
+
+from nodeconductor.core import tasks
+from nodeconductor.structure.tests import factories, models
+
+
+class PullTask(tasks.BackgroundTask):
+    name = 'nodeconductor.core.tests.pull'
+
+    def run(self, serialized_instance):
+        pass
+
+
+@mock.patch.object(CeleryTask, 'apply_async')
+class BackgroundTaskTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.task = PullTask()
+
+    def test_equal_task_is_not_scheduled_if_predecessor_is_not_completed(self, apply_async):
+        self.task.apply_async(args=('structure.instance:1',))
+        self.task.apply_async(args=('structure.instance:1',))
+
+        self.assertEqual(apply_async.call_count, 1)
+
+    def test_tasks_with_different_arguments_are_scheduled(self, apply_async):
+        self.task.apply_async(args=('structure.instance:1',))
+        self.task.apply_async(args=('structure.instance:2',))
+
+        self.assertEqual(apply_async.call_count, 2)
+
+    def test_task_is_scheduled_again_when_predecessor_succeeds(self, apply_async):
+        self.task.apply_async(args=('structure.instance:1',))
+        task_id = apply_async.call_args[1]['task_id']
+        self.task.on_success(None, task_id, ['structure.instance:1'], {})
+        self.task.apply_async(args=('structure.instance:1',))
+
+        self.assertEqual(apply_async.call_count, 2)
+
+    def test_task_is_scheduled_again_when_predecessor_fails(self, apply_async):
+        self.task.apply_async(args=('structure.instance:1',))
+        task_id = apply_async.call_args[1]['task_id']
+        self.task.on_failure(Exception(), task_id, ['structure.instance:1'], {}, None)
+        self.task.apply_async(args=('structure.instance:1',))
+
+        self.assertEqual(apply_async.call_count, 2)
+
+    def test_event_context_does_not_affect_deduplication(self, apply_async):
+        self.task.apply_async(args=('structure.instance:1',))
+        task_id = apply_async.call_args[1]['task_id']
+        self.task.on_success(None, task_id, ['structure.instance:1'], {'event_context': {'user_uuid': 'abc'}})
+        self.task.apply_async(args=('structure.instance:1',))
+
+        self.assertEqual(apply_async.call_count, 2)
+
+
+class StateTransitionTaskTest(TestCase):
+
+    def setUp(self):
+        self.States = models.TestNewInstance.States
+        self.instance = factories.TestNewInstanceFactory(state=self.States.OK)
+
+    def test_state_is_changed_if_transition_is_allowed_in_database(self):
+        updated = tasks.StateTransitionTask().state_transition(self.instance, 'schedule_updating')
+
+        self.assertEqual(updated, 1)
+        self.assertEqual(self.instance.state, self.States.UPDATE_SCHEDULED)
+        self.instance.refresh_from_db()
+        self.assertEqual(self.instance.state, self.States.UPDATE_SCHEDULED)
+
+    def test_concurrent_state_change_is_not_overridden(self):
+        type(self.instance).objects.filter(pk=self.instance.pk).update(state=self.States.DELETING)
+
+        with self.assertRaises(tasks.StateChangeError):
+            tasks.StateTransitionTask().state_transition(self.instance, 'schedule_updating')
+
+        self.instance.refresh_from_db()
+        self.assertEqual(self.instance.state, self.States.DELETING)
+
+    def test_transition_is_done_with_single_update_query(self):
+        with CaptureQueriesContext(connection) as context:
+            tasks.StateTransitionTask().state_transition(self.instance, 'schedule_updating')
+
+        table = models.TestNewInstance._meta.db_table
+        queries = [query['sql'] for query in context.captured_queries if table in query['sql']]
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0].startswith('UPDATE'))
+
+    def test_post_save_handlers_see_changed_state(self):
+        changes = []
+
+        def handler(sender, instance, **kwargs):
+            changes.append(instance.tracker.has_changed('state'))
+
+        signals.post_save.connect(handler, sender=models.TestNewInstance)
+        try:
+            tasks.StateTransitionTask().state_transition(self.instance, 'schedule_updating')
+        finally:
+            signals.post_save.disconnect(handler, sender=models.TestNewInstance)
+
+        self.assertEqual(changes, [True])
+        self.assertFalse(self.instance.tracker.has_changed('state'))
+
+    def test_pre_transition_is_not_sent_if_transition_is_not_allowed_in_database(self):
+        type(self.instance).objects.filter(pk=self.instance.pk).update(state=self.States.DELETING)
+        handler = mock.Mock()
+        fsm_signals.pre_transition.connect(handler, sender=models.TestNewInstance)
+        try:
+            with self.assertRaises(tasks.StateChangeError):
+                tasks.StateTransitionTask().state_transition(self.instance, 'schedule_updating')
+        finally:
+            fsm_signals.pre_transition.disconnect(handler, sender=models.TestNewInstance)
+
+        self.assertFalse(handler.called)
+
+    def test_modified_field_is_updated(self):
+        modified = self.instance.modified
+
+        tasks.StateTransitionTask().state_transition(self.instance, 'schedule_updating')
+
+        self.instance.refresh_from_db()
+        self.assertGreater(self.instance.modified, modified)
@@ -2,6 +2,11 @@ from __future__ import unicode_literals
 
 import unittest
 
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TransactionTestCase
+import mock
+
 from nodeconductor.core import utils
 
 
@@ -37,3 +42,54 @@ class TestFormatTimeAndValueToSegmentList(unittest.TestCase):
         expected_second_segment_value = sum([value for _, value in second_segment_time_value_list])
         self.assertEqual(first_segment['value'], expected_first_segment_value)
         self.assertEqual(second_segment['value'], expected_second_segment_value)
+
+
+class CommitHookDataTest(TransactionTestCase):
+
+    def setUp(self):
+        self.handler = mock.Mock()
+
+    def get_data(self):
+        return utils.get_commit_hook_data('test', self.handler)
+
+    def test_data_of_transaction_is_handled_once_on_commit(self):
+        with transaction.atomic():
+            self.get_data()['a'] = 1
+            self.get_data()['b'] = 2
+            self.assertFalse(self.handler.called)
+
+        self.handler.assert_called_once_with({'a': 1, 'b': 2})
+
+    def test_data_is_dropped_on_rollback(self):
+        try:
+            with transaction.atomic():
+                self.get_data()['a'] = 1
+                raise ValueError()
+        except ValueError:
+            pass
+
+        with transaction.atomic():
+            self.get_data()['b'] = 2
+
+        self.handler.assert_called_once_with({'b': 2})
+
+    def test_savepoint_is_not_outermost_atomic_block(self):
+        self.assertFalse(utils.is_in_outermost_atomic_block())
+        with transaction.atomic():
+            self.assertTrue(utils.is_in_outermost_atomic_block())
+            with transaction.atomic(savepoint=False):
+                self.assertTrue(utils.is_in_outermost_atomic_block())
+            with transaction.atomic():
+                self.assertFalse(utils.is_in_outermost_atomic_block())
+
+
+class CacheSetTest(unittest.TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_values_are_added_without_duplicates(self):
+        for value in ('a', 'b', 'a'):
+            utils.add_to_cache_set('test_set', value, 60)
+
+        self.assertEqual(utils.get_cache_sets(['test_set', 'empty_set']), {'test_set': {'a', 'b'}, 'empty_set': set()})
@@ -1,22 +1,31 @@
 import calendar
 import datetime
+import hashlib
 import importlib
 import re
 
 import os
+import threading
 import time
+import weakref
 
 from collections import OrderedDict
 from operator import itemgetter
 
 from django.apps import apps
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.management import call_command
+from django.db import router, transaction
+from django.db.models import signals
 from django.http import QueryDict
 from django.urls import resolve
 from django.utils import timezone
 from django.utils.crypto import get_random_string
 from django.utils.encoding import force_text
+from django_fsm import signals as fsm_signals
+from model_utils.fields import AutoLastModifiedField
+from model_utils.tracker import FieldInstanceTracker
 
 
 def sort_dict(unsorted_dict):
@@ -203,3 +212,201 @@ def camel_case_to_underscore(name):
 
 def silent_call(name, *args, **options):
     call_command(name, stdout=open(os.devnull, 'w'), *args, **options)
+
+
+def get_transition_states(model, transition_method):
+    """ Return state field name, source states and target state of django-fsm transition.
+
+        Source states are None if transition is allowed from any state.
+        Transitions with conditions or with different targets for different sources
+        cannot be described this way - ValueError is raised for them.
+    """
+    meta = getattr(model, transition_method)._django_fsm
+    transitions = meta.transitions.values()
+    targets = set(transition.target for transition in transitions)
+    if len(targets) != 1 or any(transition.conditions for transition in transitions):
+        raise ValueError('Transition %s of model %s is too complex to be executed in bulk.' %
+                         (transition_method, model.__name__))
+    target = targets.pop()
+
+    sources = set(meta.transitions.keys())
+    if '*' in sources:
+        sources = None
+    elif '+' in sources:
+        sources = set(state for state, _ in meta.field.choices if state != target)
+    return meta.field.name, sources, target
+
+
+def bulk_state_transition(queryset, transition_method, **fields):
+    """ Execute django-fsm transition for all objects of queryset with single UPDATE query.
+
+        Objects that cannot perform transition are skipped.
+        Additional fields values could be passed as keyword arguments.
+        Signals are sent for each object as if transition method was called and object was saved.
+        Returns list of transited objects.
+    """
+    model = queryset.model
+    field_name, sources, target = get_transition_states(model, transition_method)
+    if sources is not None:
+        queryset = queryset.filter(**{field_name + '__in': sources})
+    fields[field_name] = target
+    _set_auto_now_fields(model, fields)
+
+    with transaction.atomic():
+        instances = list(queryset.select_for_update())
+        if not instances:
+            return []
+        sources = [getattr(instance, field_name) for instance in instances]
+        for instance, source in zip(instances, sources):
+            _send_pre_transition(instance, transition_method, source, target)
+        model._default_manager.filter(pk__in=[instance.pk for instance in instances]).update(
+            **_get_concrete_fields(model, fields))
+
+    for instance, source in zip(instances, sources):
+        _finish_transition(instance, transition_method, source, target, fields)
+    return instances
+
+
+def state_transition_update(instance, transition_method, **fields):
+    """ Execute django-fsm transition for object with single compare-and-swap UPDATE query.
+
+        Query changes object only if its state in database allows transition,
+        so concurrent transitions cannot override each other. Signals are sent
+        only if transition has happened, inside the same transaction as the query.
+        Source state is the only source of transition or state of object in memory.
+        Additional fields values could be passed as keyword arguments.
+        Returns number of updated rows: 1 if transition succeeded, 0 otherwise.
+    """
+    model = instance.__class__
+    field_name, sources, target = get_transition_states(model, transition_method)
+    queryset = model._default_manager.filter(pk=instance.pk)
+    if sources is not None:
+        queryset = queryset.filter(**{field_name + '__in': sources})
+    source = next(iter(sources)) if sources is not None and len(sources) == 1 else getattr(instance, field_name)
+    fields[field_name] = target
+    _set_auto_now_fields(model, fields)
+
+    with transaction.atomic():
+        updated = queryset.update(**_get_concrete_fields(model, fields))
+        if updated:
+            _send_pre_transition(instance, transition_method, source, target)
+    if updated:
+        _finish_transition(instance, transition_method, source, target, fields)
+    return updated
+
+
+def _get_concrete_fields(model, fields):
+    names = set(field.name for field in model._meta.concrete_fields)
+    return {name: value for name, value in fields.items() if name in names}
+
+
+def _set_auto_now_fields(model, fields):
+    """ Update auto_now and model_utils modified fields as save() does """
+    now = timezone.now()
+    for field in model._meta.concrete_fields:
+        if getattr(field, 'auto_now', False) or isinstance(field, AutoLastModifiedField):
+            fields.setdefault(field.name, now)
+
+
+def _send_pre_transition(instance, transition_method, source, target):
+    fsm_signals.pre_transition.send(
+        sender=instance.__class__, instance=instance, name=transition_method, source=source, target=target)
+
+
+def _finish_transition(instance, transition_method, source, target, fields):
+    """ Update object in memory and send signals as if transition method was called and object was saved """
+    model = instance.__class__
+    for name, value in fields.items():
+        setattr(instance, name, value)
+    update_fields = frozenset(_get_concrete_fields(model, fields))
+
+    fsm_signals.post_transition.send(
+        sender=model, instance=instance, name=transition_method, source=source, target=target)
+    signals.post_save.send(
+        sender=model, instance=instance, created=False, update_fields=update_fields,
+        raw=False, using=router.db_for_write(model, instance=instance))
+
+    # reset model_utils trackers after post_save the same way as they are reset by save(update_fields=...),
+    # so post_save handlers see changed fields
+    for value in vars(instance).values():
+        if isinstance(value, FieldInstanceTracker):
+            value.set_saved_fields(fields=[name for name in update_fields if name in value.fields])
+
+
+class _CommitHook(object):
+    """ Transaction commit callback that passes collected data to handler """
+
+    def __init__(self, handler, data):
+        self.handler = handler
+        self.data = data
+        self.called = False
+
+    def __call__(self):
+        self.called = True
+        self.handler(self.data)
+
+
+# Commit hooks of current transaction for each thread: {database alias: {key: weak reference to hook}}
+_commit_hooks = threading.local()
+
+
+def is_in_outermost_atomic_block(using=None):
+    """ Return True if code is executed inside transaction, but not inside savepoint """
+    connection = transaction.get_connection(using)
+    # atomic blocks that do not create savepoints are marked by None
+    return connection.in_atomic_block and all(sid is None for sid in connection.savepoint_ids)
+
+
+def get_commit_hook_data(key, handler, factory=dict, create=True):
+    """ Return data of current transaction that is passed to handler once on commit.
+
+        Handler is registered with transaction.on_commit on the first call in transaction,
+        later calls with the same key return the same data, so changes collected during
+        transaction are handled together. Data should be changed only in the outermost
+        atomic block (see is_in_outermost_atomic_block): rollback of savepoint drops commit
+        hooks registered inside it. Hook and its data are dropped on transaction rollback.
+        None is returned if data does not exist and create is False.
+    """
+    hooks = _commit_hooks.__dict__.setdefault(transaction.get_connection().alias, {})
+    # only connection holds reference to registered hook
+    hook = hooks[key]() if key in hooks else None
+    if hook is None or hook.called:
+        if not create:
+            return None
+        hook = _CommitHook(handler, factory())
+        hooks[key] = weakref.ref(hook)
+        transaction.on_commit(hook)
+    return hook.data
+
+
+def add_to_cache_set(key, value, timeout):
+    """ Add value to set stored in cache using atomic cache operations only.
+
+        Concurrent processes do not override values added by each other, as it happens
+        with read and write of the whole set. Set is stored as counter of values and
+        key for each value. Values should be pickleable, set is read by get_cache_sets.
+    """
+    value_hash = hashlib.md5(force_text(value).encode('utf-8')).hexdigest()  # nosec
+    if not cache.add('%s:value:%s' % (key, value_hash), True, timeout):
+        return
+    cache.add(key + ':count', 0, timeout)
+    try:
+        index = cache.incr(key + ':count')
+    except ValueError:
+        # counter has expired between add and incr
+        cache.delete('%s:value:%s' % (key, value_hash))
+        return
+    cache.set('%s:%s' % (key, index), value, timeout)
+
+
+def get_cache_sets(keys):
+    """ Return {key: set of values} for sets stored in cache by add_to_cache_set """
+    counts = cache.get_many([key + ':count' for key in keys])
+    items = [(key, '%s:%s' % (key, index))
+             for key in keys for index in range(1, counts.get(key + ':count', 0) + 1)]
+    values = cache.get_many([item_key for _, item_key in items])
+    result = {key: set() for key in keys}
+    for key, item_key in items:
+        if item_key in values:
+            result[key].add(values[item_key])
+    return result
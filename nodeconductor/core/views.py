@@ -15,7 +15,7 @@ from rest_framework.views import APIView
 from rest_framework.views import exception_handler as rf_exception_handler
 
 from nodeconductor import __version__
-from nodeconductor.core import permissions
+from nodeconductor.core import permissions, task_stats
 from nodeconductor.core.exceptions import IncorrectStateException
 from nodeconductor.core.serializers import AuthTokenSerializer
 from nodeconductor.logging.loggers import event_logger
@@ -179,6 +179,22 @@ def version_detail(request):
     return Response({'version': __version__})
 
 
+@api_view(['GET'])
+@permission_classes((rf_permissions.IsAdminUser, ))
+def task_stats_list(request):
+    """Retrieve performance statistics of background tasks, aggregated by task name.
+
+    Time metrics are measured in milliseconds. Statistics are collected for the last 24 hours by default,
+    use query parameter "hours" to change this period.
+    """
+    try:
+        hours = int(request.query_params.get('hours', task_stats.WINDOWS_COUNT))
+    except ValueError:
+        raise exceptions.ValidationError(_('Hours should be integer.'))
+
+    return Response(task_stats.get_stats(windows_count=min(max(hours, 1), task_stats.WINDOWS_COUNT)))
+
+
 # noinspection PyProtectedMember
 def exception_handler(exc, context):
     if isinstance(exc, ProtectedError):
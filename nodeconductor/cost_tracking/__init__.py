@@ -44,6 +44,10 @@ class CostTrackingStrategy(object):
         tracking for particular resource.
     """
     resource_class = NotImplemented
+    # Names of resource fields and quotas that configuration depends on.
+    # If they are not defined configuration is recalculated on each resource and quota save.
+    configuration_fields = None
+    configuration_quotas = None
 
     @classmethod
     def get_configuration(cls, resource):
@@ -140,3 +144,15 @@ class CostTrackingRegister(object):
         """ Get all possible consumable items for given resource class """
         strategy = cls._get_strategy(resource_class)
         return strategy.get_consumable_items()
+
+    @classmethod
+    def get_configuration_fields(cls, resource_class):
+        """ Get names of resource fields that affect configuration, None if they are unknown """
+        strategy = cls._get_strategy(resource_class)
+        return strategy.configuration_fields
+
+    @classmethod
+    def get_configuration_quotas(cls, resource_class):
+        """ Get names of resource quotas that affect configuration, None if they are unknown """
+        strategy = cls._get_strategy(resource_class)
+        return strategy.configuration_quotas
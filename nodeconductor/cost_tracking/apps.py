@@ -34,3 +34,33 @@ class CostTrackingConfig(AppConfig):
             sender=quotas_models.Quota,
             dispatch_uid='nodeconductor.cost_tracking.handlers.resource_quota_update',
         )
+
+        signals.m2m_changed.connect(
+            handlers.update_price_estimate_closure,
+            sender=PriceEstimate.parents.through,
+            dispatch_uid='nodeconductor.cost_tracking.handlers.update_price_estimate_closure',
+        )
+
+        signals.pre_delete.connect(
+            handlers.store_price_estimate_descendants,
+            sender=PriceEstimate,
+            dispatch_uid='nodeconductor.cost_tracking.handlers.store_price_estimate_descendants',
+        )
+
+        signals.post_delete.connect(
+            handlers.rebuild_price_estimate_descendants_closure,
+            sender=PriceEstimate,
+            dispatch_uid='nodeconductor.cost_tracking.handlers.rebuild_price_estimate_descendants_closure',
+        )
+
+        for model_name in ('DefaultPriceListItem', 'PriceListItem'):
+            signals.post_save.connect(
+                handlers.invalidate_price_list_cache,
+                sender=self.get_model(model_name),
+                dispatch_uid='nodeconductor.cost_tracking.invalidate_price_list_cache_post_save_%s' % model_name,
+            )
+            signals.post_delete.connect(
+                handlers.invalidate_price_list_cache,
+                sender=self.get_model(model_name),
+                dispatch_uid='nodeconductor.cost_tracking.invalidate_price_list_cache_post_delete_%s' % model_name,
+            )
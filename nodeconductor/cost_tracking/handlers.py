@@ -1,9 +1,14 @@
 from __future__ import unicode_literals
 
 import logging
+from collections import defaultdict
 
 from celery import current_task
 from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import FieldError
+from django.db import transaction
 from django.utils import timezone
 
 from nodeconductor.core import utils as core_utils
@@ -66,29 +71,90 @@ def _is_in_celery_task():
 def resource_update(sender, instance, created=False, **kwargs):
     """ Update resource consumption details and price estimate if its configuration has changed.
         Create estimates for previous months if resource was created not in current month.
+
+        Handler returns early if none of fields that affect resource configuration has changed.
     """
     resource = instance
     try:
-        new_configuration = CostTrackingRegister.get_configuration(resource)
+        configuration_fields = CostTrackingRegister.get_configuration_fields(resource.__class__)
     except ResourceNotRegisteredError:
         return
-    models.PriceEstimate.update_resource_estimate(
-        resource, new_configuration, raise_exception=not _is_in_celery_task())
-    # Try to create historical price estimates
-    if created:
-        _create_historical_estimates(resource, new_configuration)
+    if not created and not _has_changed(resource, configuration_fields):
+        return
+    _schedule_resource_estimate_update(resource, created)
 
 
-def resource_quota_update(sender, instance, **kwargs):
+def resource_quota_update(sender, instance, created=False, **kwargs):
     """ Update resource consumption details and price estimate if its configuration has changed """
     quota = instance
-    resource = quota.scope
+    if quota.content_type_id is None:
+        return
+    resource_class = ContentType.objects.get_for_id(quota.content_type_id).model_class()
+    if resource_class is None:
+        return
     try:
-        new_configuration = CostTrackingRegister.get_configuration(resource)
+        configuration_quotas = CostTrackingRegister.get_configuration_quotas(resource_class)
     except ResourceNotRegisteredError:
         return
-    models.PriceEstimate.update_resource_estimate(
-        resource, new_configuration, raise_exception=not _is_in_celery_task())
+    if configuration_quotas is not None and quota.name not in configuration_quotas:
+        return
+    if not created and not _has_changed(quota, ('usage', 'limit')):
+        return
+    resource = quota.scope
+    if resource is not None:
+        _schedule_resource_estimate_update(resource)
+
+
+def _has_changed(instance, fields):
+    """ Return True if any of given fields has changed, changes of unknown or untracked fields are assumed """
+    tracker = getattr(instance, 'tracker', None)
+    if fields is None or tracker is None:
+        return True
+    try:
+        return any(tracker.has_changed(field) for field in fields)
+    except FieldError:
+        return True
+
+
+def _schedule_resource_estimate_update(resource, created=False):
+    """ Update resource estimate on commit of current transaction, once for each resource.
+
+        Estimates of resources changed inside savepoints are updated immediately,
+        so they are rolled back together with savepoint.
+    """
+    if not (settings.NODECONDUCTOR.get('COALESCE_PRICE_ESTIMATES_UPDATES', True) and
+            core_utils.is_in_outermost_atomic_block()):
+        _update_resource_estimate(resource, created)
+        return
+    updates = core_utils.get_commit_hook_data(__name__ + '.estimates_updates', _update_pending_estimates)
+    key = (resource.__class__, resource.pk)
+    updates[key] = updates.get(key, False) or created
+
+
+def _update_pending_estimates(updates):
+    """ Update estimates of resources on transaction commit, updates format: {(model, pk): is created} """
+    resources_ids = defaultdict(dict)
+    for (model, pk), created in updates.items():
+        resources_ids[model][pk] = created
+    for model, ids in resources_ids.items():
+        # resources that were deleted or not created because of rollback are skipped
+        for resource in model.objects.filter(pk__in=ids.keys()):
+            # Transaction is already committed, so error can not roll it back.
+            # It is logged to keep updating other resources and running other commit hooks.
+            try:
+                _update_resource_estimate(resource, ids[resource.pk], raise_exception=False)
+            except Exception as e:
+                logger.exception('Cannot update price estimate of resource %s. Error: %s', resource, e)
+
+
+def _update_resource_estimate(resource, created, raise_exception=None):
+    if raise_exception is None:
+        raise_exception = not _is_in_celery_task()
+    new_configuration = CostTrackingRegister.get_configuration(resource)
+    models.PriceEstimate.update_resource_estimate(resource, new_configuration, raise_exception=raise_exception)
+    # Try to create historical price estimates
+    if created:
+        _create_historical_estimates(resource, new_configuration)
 
 
 def _create_historical_estimates(resource, configuration):
@@ -101,3 +167,52 @@ def _create_historical_estimates(resource, configuration):
     while month_start > resource.created:
         month_start -= relativedelta(months=1)
         models.PriceEstimate.create_historical(resource, configuration, max(month_start, resource.created))
+
+
+def invalidate_price_list_cache(sender, instance, **kwargs):
+    """ Expire cached prices of resources if default or service price list item was changed """
+    if isinstance(instance, models.DefaultPriceListItem):
+        args = (instance.resource_content_type_id,)
+    else:
+        try:
+            default_item = instance.default_price_list_item
+        except models.DefaultPriceListItem.DoesNotExist:
+            # default item is deleted too, its handler expires all prices of resource type
+            return
+        args = (default_item.resource_content_type_id, instance.content_type_id, instance.object_id)
+
+    models.invalidate_price_list_cache(*args)
+    # concurrent request could cache old prices before transaction is committed
+    transaction.on_commit(lambda: models.invalidate_price_list_cache(*args))
+
+
+def update_price_estimate_closure(sender, instance, action, reverse, pk_set, **kwargs):
+    """ Keep price estimates closure table in sync with parents links """
+    closure = models.PriceEstimateClosure.objects
+    if action == 'post_add':
+        for pk in pk_set:
+            descendant_id, ancestor_id = (pk, instance.pk) if reverse else (instance.pk, pk)
+            closure.link(descendant_id, ancestor_id)
+    elif action == 'pre_clear' and reverse:
+        # children are not known after clear
+        instance._closure_affected_ids = list(instance.get_children().values_list('pk', flat=True))
+    elif action in ('post_remove', 'post_clear'):
+        if reverse:
+            children_ids = pk_set if action == 'post_remove' else instance.__dict__.pop('_closure_affected_ids', [])
+        else:
+            children_ids = [instance.pk]
+        affected_ids = set(children_ids) | set(
+            closure.filter(ancestor_id__in=children_ids).values_list('descendant_id', flat=True))
+        closure.rebuild(affected_ids)
+
+
+def store_price_estimate_descendants(sender, instance, **kwargs):
+    instance._closure_affected_ids = list(
+        models.PriceEstimateClosure.objects.filter(ancestor=instance).values_list('descendant_id', flat=True))
+
+
+def rebuild_price_estimate_descendants_closure(sender, instance, **kwargs):
+    """ Descendants of deleted price estimate could lose some of ancestors """
+    affected_ids = instance.__dict__.pop('_closure_affected_ids', [])
+    if affected_ids:
+        models.PriceEstimateClosure.objects.rebuild(affected_ids)
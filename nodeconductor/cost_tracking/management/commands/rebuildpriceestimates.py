@@ -1,25 +1,152 @@
-from django.core.management.base import BaseCommand
-from django.db import transaction
+from multiprocessing import Pool
+
+from celery import chord
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Q
 from django.utils import timezone
 
-from nodeconductor.core import utils as core_utils
-from nodeconductor.cost_tracking import models, CostTrackingRegister, tasks
+from nodeconductor.cost_tracking import CostTrackingRegister, models, tasks
+from nodeconductor.structure import models as structure_models
+
+
+def _rebuild_shard(shard):
+    return tasks.rebuild_resources_estimates(*shard)
 
 
 class Command(BaseCommand):
+    """ Rebuild price estimates of current month.
+
+        Resources are split to shards by primary key ranges. Shards are processed
+        by local worker processes or by celery workers, each shard commits resources
+        estimates in small batches. Consumed price and totals of ancestors are recalculated
+        once after all shards are finished, so shards do not update common ancestors concurrently.
+
+        Estimates are rebuilt in place: until all shards are finished current month estimates
+        of rebuilt resources are missing or incomplete. Regular recalculation of estimates is
+        suspended for this time, so it does not create estimates concurrently with shards.
+    """
     help = ("Delete all price estimates that are related to current month and "
-            "create new ones based on current consumption.")
+            "create new ones based on current consumption. Estimates are incomplete until rebuild is finished.")
+    DELETE_CHUNK_SIZE = 500
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scope', dest='customer_uuid',
+                            help='UUID of customer. Rebuild price estimates of given customer only.')
+        parser.add_argument('--shard-size', dest='shard_size', type=int, default=1000,
+                            help='Number of resources in one shard.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of processes that rebuild shards in parallel.')
+        parser.add_argument('--celery', action='store_true', default=False,
+                            help='Send shards to celery workers instead of processing them locally.')
 
     def handle(self, *args, **options):
+        customer = self.get_customer(options['customer_uuid'])
+        if not cache.add(tasks.REBUILD_IN_PROGRESS_KEY, True, tasks.REBUILD_IN_PROGRESS_TIMEOUT):
+            raise CommandError('Price estimates are already being rebuilt.')
+
+        try:
+            self.delete_estimates(customer)
+            shards = self.get_shards(customer, max(options['shard_size'], 1))
+        except Exception:
+            cache.delete(tasks.REBUILD_IN_PROGRESS_KEY)
+            raise
+
+        if options['celery']:
+            # finish_estimates_rebuild removes rebuild key, if any of shards fails
+            # key expires after REBUILD_IN_PROGRESS_TIMEOUT.
+            header = [tasks.rebuild_resources_estimates.si(*shard) for shard in shards]
+            chord(header)(tasks.finish_estimates_rebuild.si())
+            self.stdout.write('%s shards were sent to celery workers.' % len(shards))
+            return
+
+        try:
+            self.stdout.write('Rebuilding %s shards' % len(shards))
+            count = sum(self.run_shards(shards, max(options['workers'], 1)))
+            self.stdout.write('...done, %s resources price estimates were created' % count)
+        finally:
+            self.stdout.write('Recalculating ancestors consumed price and totals')
+            tasks.finish_estimates_rebuild()
+            self.stdout.write('...done')
+
+    def get_customer(self, customer_uuid):
+        if customer_uuid is None:
+            return None
+        try:
+            return structure_models.Customer.objects.get(uuid=customer_uuid)
+        except (structure_models.Customer.DoesNotExist, ValueError):
+            raise CommandError('Customer with UUID "%s" does not exist.' % customer_uuid)
+
+    def get_current_estimates(self):
         today = timezone.now()
-        with transaction.atomic():
-            # Delete current month price estimates
-            models.PriceEstimate.objects.filter(month=today.month, year=today.year).delete()
-            # Create new estimates for resources and ancestors
+        return models.PriceEstimate.objects.filter(month=today.month, year=today.year)
+
+    def get_resources(self, resource_model, customer):
+        resources = resource_model.objects.all()
+        if customer is not None:
+            resources = resources.filter(customer=customer)
+        return resources
+
+    def delete_estimates(self, customer):
+        """ Delete current month estimates of customer and all its descendants in chunks.
+
+            Totals of deleted resources estimates are subtracted from ancestors that are
+            not deleted, for example from shared service settings, in the same transaction
+            with deletion of chunk.
+        """
+        self.stdout.write('Deleting current month price estimates')
+        estimates = self.get_current_estimates()
+        if customer is None:
+            estimates_ids = list(estimates.values_list('pk', flat=True))
+        else:
+            customer_estimates = estimates.filter(
+                content_type=ContentType.objects.get_for_model(customer), object_id=customer.pk)
+            resources_query = Q()
             for resource_model in CostTrackingRegister.registered_resources:
-                for resource in resource_model.objects.all():
-                    configuration = CostTrackingRegister.get_configuration(resource)
-                    date = max(core_utils.month_start(today), resource.created)
-                    models.PriceEstimate.create_historical(resource, configuration, date)
-            # recalculate consumed estimate
-            tasks.recalculate_estimate()
+                resources_query |= Q(content_type=ContentType.objects.get_for_model(resource_model),
+                                     object_id__in=self.get_resources(resource_model, customer).values('pk'))
+            estimates_ids = set(customer_estimates.values_list('pk', flat=True))
+            estimates_ids |= set(models.PriceEstimateClosure.objects.filter(
+                ancestor__in=customer_estimates).values_list('descendant_id', flat=True))
+            estimates_ids |= set(estimates.filter(resources_query).values_list('pk', flat=True))
+            estimates_ids = sorted(estimates_ids)
+
+        for index in range(0, len(estimates_ids), self.DELETE_CHUNK_SIZE):
+            chunk = estimates_ids[index:index + self.DELETE_CHUNK_SIZE]
+            with transaction.atomic():
+                if customer is not None:
+                    for estimate in estimates.filter(pk__in=chunk, consumption_details__isnull=False):
+                        estimate.update_ancestors_total(diff=-estimate.total)
+                # Hierarchy is deleted entirely, so closure rows are removed in advance
+                # to avoid closure rebuild on deletion of each estimate.
+                models.PriceEstimateClosure.objects.filter(
+                    Q(ancestor_id__in=chunk) | Q(descendant_id__in=chunk)).delete()
+                models.PriceEstimate.objects.filter(pk__in=chunk).delete()
+        self.stdout.write('...done, %s price estimates were deleted' % len(estimates_ids))
+
+    def get_shards(self, customer, shard_size):
+        """ Return list of shards: (resource model label, min pk, max pk, customer UUID) """
+        customer_uuid = customer.uuid.hex if customer is not None else None
+        shards = []
+        for resource_model in CostTrackingRegister.registered_resources:
+            resources = self.get_resources(resource_model, customer)
+            resources_ids = list(resources.order_by('pk').values_list('pk', flat=True))
+            for index in range(0, len(resources_ids), shard_size):
+                shard_ids = resources_ids[index:index + shard_size]
+                shards.append((resource_model._meta.label, shard_ids[0], shard_ids[-1], customer_uuid))
+        return shards
+
+    def run_shards(self, shards, workers):
+        if workers == 1 or len(shards) < 2:
+            return [_rebuild_shard(shard) for shard in shards]
+
+        # forked processes should not share parent database connections
+        connections.close_all()
+        pool = Pool(min(workers, len(shards)))
+        try:
+            return pool.map(_rebuild_shard, shards)
+        finally:
+            pool.close()
+            pool.join()
@@ -1,14 +1,13 @@
 import datetime
+from collections import defaultdict
 
-from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models as django_models
-from django.db.models import Q
 from django.utils import timezone
 
 from nodeconductor.core import utils as core_utils
 from nodeconductor.core.managers import GenericKeyMixin
-from nodeconductor.structure.managers import filter_queryset_for_user
+from nodeconductor.structure.managers import get_generic_query_for_user
 from nodeconductor.structure.models import Service
 
 
@@ -22,13 +21,7 @@ class UserFilterMixin(object):
         if user.is_staff or user.is_support:
             return queryset
 
-        query = Q()
-        for model in self.get_available_models():
-            user_object_ids = filter_queryset_for_user(model.objects.all(), user).values_list('id', flat=True)
-            content_type_id = ContentType.objects.get_for_model(model).id
-            query |= Q(object_id__in=list(user_object_ids), content_type_id=content_type_id)
-
-        return queryset.filter(query)
+        return queryset.filter(get_generic_query_for_user(user, self.get_available_models()))
 
     def get_available_models(self):
         """ Return list of models that are acceptable """
@@ -76,6 +69,55 @@ class ConsumptionDetailsQuerySet(django_models.QuerySet):
 ConsumptionDetailsManager = django_models.Manager.from_queryset(ConsumptionDetailsQuerySet)
 
 
+class PriceEstimateClosureManager(django_models.Manager):
+
+    def link(self, descendant_id, ancestor_id):
+        """ Add rows for new parent link: each ancestor of parent becomes ancestor of each descendant of child """
+        ancestors = {ancestor_id: 1}
+        for row_ancestor_id, depth in self.filter(descendant_id=ancestor_id).values_list('ancestor_id', 'depth'):
+            ancestors[row_ancestor_id] = depth + 1
+        descendants = {descendant_id: 0}
+        for row_descendant_id, depth in self.filter(ancestor_id=descendant_id).values_list('descendant_id', 'depth'):
+            descendants[row_descendant_id] = depth
+
+        depths = {(a_id, d_id): a_depth + d_depth
+                  for a_id, a_depth in ancestors.items() for d_id, d_depth in descendants.items()}
+        existing = self.filter(ancestor_id__in=ancestors.keys(), descendant_id__in=descendants.keys())
+        for pk, a_id, d_id, depth in existing.values_list('pk', 'ancestor_id', 'descendant_id', 'depth'):
+            new_depth = depths.pop((a_id, d_id))
+            if new_depth < depth:
+                self.filter(pk=pk).update(depth=new_depth)
+        self.bulk_create([self.model(ancestor_id=a_id, descendant_id=d_id, depth=depth)
+                          for (a_id, d_id), depth in depths.items()])
+
+    def rebuild(self, descendants_ids):
+        """ Recalculate ancestors of given price estimates based on parents links """
+        from nodeconductor.cost_tracking.models import PriceEstimate
+
+        descendants_ids = set(descendants_ids)
+        self.filter(descendant_id__in=descendants_ids).delete()
+        links = PriceEstimate.parents.through.objects
+        depths = {}
+        current = {(descendant_id, descendant_id) for descendant_id in descendants_ids}
+        depth = 0
+        # breadth-first search stores the shortest path to each ancestor
+        while current:
+            depth += 1
+            parents = defaultdict(list)
+            nodes = links.filter(from_priceestimate_id__in={node_id for node_id, _ in current})
+            for child_id, parent_id in nodes.values_list('from_priceestimate_id', 'to_priceestimate_id'):
+                parents[child_id].append(parent_id)
+            following = set()
+            for node_id, descendant_id in current:
+                for parent_id in parents[node_id]:
+                    if (parent_id, descendant_id) not in depths:
+                        depths[(parent_id, descendant_id)] = depth
+                        following.add((parent_id, descendant_id))
+            current = following
+        self.bulk_create([self.model(ancestor_id=a_id, descendant_id=d_id, depth=depth)
+                          for (a_id, d_id), depth in depths.items()])
+
+
 class PriceListItemManager(GenericKeyMixin, UserFilterMixin, django_models.Manager):
 
     def get_available_models(self):
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def init_price_estimate_closure(apps, schema_editor):
+    PriceEstimate = apps.get_model('cost_tracking', 'PriceEstimate')
+    PriceEstimateClosure = apps.get_model('cost_tracking', 'PriceEstimateClosure')
+    parents = defaultdict(list)
+    links = PriceEstimate.parents.through.objects.values_list('from_priceestimate_id', 'to_priceestimate_id')
+    for child_id, parent_id in links.iterator():
+        parents[child_id].append(parent_id)
+
+    closure = []
+    for descendant_id in list(parents.keys()):
+        depths = {}
+        current = [descendant_id]
+        depth = 0
+        while current:
+            depth += 1
+            following = []
+            for node_id in current:
+                for parent_id in parents[node_id]:
+                    if parent_id not in depths:
+                        depths[parent_id] = depth
+                        following.append(parent_id)
+            current = following
+        closure.extend(PriceEstimateClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=depth)
+                       for ancestor_id, depth in depths.items())
+    PriceEstimateClosure.objects.bulk_create(closure, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cost_tracking', '0026_remove_limit_threshold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceEstimateClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='cost_tracking.PriceEstimate')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='cost_tracking.PriceEstimate')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='priceestimateclosure',
+            unique_together=set([('ancestor', 'descendant')]),
+        ),
+        migrations.RunPython(init_price_estimate_closure),
+    ]
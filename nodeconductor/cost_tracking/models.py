@@ -2,13 +2,15 @@ from __future__ import unicode_literals
 
 import datetime
 import logging
+import uuid
 
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models, transaction
-from django.db.models import Q
+from django.db.models import F, Q
 from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.lru_cache import lru_cache
@@ -83,6 +85,16 @@ class PriceEstimate(LoggableMixin, core_models.UuidMixin, core_models.Descendant
     def get_children(self):  # For DescendantMixin
         return self.children.all()
 
+    def get_ancestors(self):
+        """ Get all unique ancestors with one query, the closest ones go first """
+        links = PriceEstimateClosure.objects.filter(descendant=self).select_related('ancestor').order_by('depth')
+        return [link.ancestor for link in links]
+
+    def get_descendants(self):
+        """ Get all unique descendants with one query, the closest ones go first """
+        links = PriceEstimateClosure.objects.filter(ancestor=self).select_related('descendant').order_by('depth')
+        return [link.descendant for link in links]
+
     def get_log_fields(self):  # For LoggableMixin
         return 'uuid', 'scope', 'total', 'consumed'
 
@@ -95,7 +107,10 @@ class PriceEstimate(LoggableMixin, core_models.UuidMixin, core_models.Descendant
         return PriceEstimate.objects.get(scope=self.scope, month=month, year=year)
 
     def create_ancestors(self):
-        """ Create price estimates for scope ancestors if they do not exist """
+        """ Create price estimates for scope ancestors if they do not exist.
+
+            Closure table is updated by parents m2m_changed handler.
+        """
         if not isinstance(self.scope, core_models.DescendantMixin):
             return
         scope_parents = self.scope.get_parents()
@@ -132,9 +147,8 @@ class PriceEstimate(LoggableMixin, core_models.UuidMixin, core_models.Descendant
                 self.update_ancestors_total(diff, raise_exception=raise_exception)
 
     def update_ancestors_total(self, diff, raise_exception=False):
-        for ancestor in self.get_ancestors():
-            ancestor.total += diff
-            ancestor.save(update_fields=['total'])
+        """ Add diff to totals of all ancestors with one query """
+        PriceEstimate.objects.filter(descendant_links__descendant=self).update(total=F('total') + diff)
 
     def update_consumed(self):
         """ Re-calculate price of resource until now. Does not update ancestors. """
@@ -143,7 +157,7 @@ class PriceEstimate(LoggableMixin, core_models.UuidMixin, core_models.Descendant
         self.save(update_fields=['consumed'])
 
     @classmethod
-    def create_historical(cls, resource, configuration, date):
+    def create_historical(cls, resource, configuration, date, update_ancestors=True):
         """ Create price estimate and consumption details backdating.
 
             Method assumes that resource had given configuration from given date
@@ -159,15 +173,22 @@ class PriceEstimate(LoggableMixin, core_models.UuidMixin, core_models.Descendant
             last_update_time=date,
         )
         details.save()
-        price_estimate.update_total()
+        price_estimate.update_total(update_ancestors=update_ancestors)
         return price_estimate
 
     def _get_price(self, consumed):
         """ Calculate price estimate for scope depends on consumed data and price list items.
             Map each consumable to price list item and multiply price its price by time of usage.
         """
-        price_list_items = PriceListItem.get_for_resource(self.scope)
-        consumables_prices = {(item.item_type, item.key): item.minute_rate for item in price_list_items}
+        consumables_prices = PriceListItem.get_consumables_prices_for_resource(self.scope)
+        return self.calculate_price(consumed, consumables_prices)
+
+    @staticmethod
+    def calculate_price(consumed, consumables_prices):
+        """ Multiply usage of each consumable by its minute rate.
+
+            consumables_prices format: {(item_type, key): minute_rate}.
+        """
         total = 0
         for consumable_item, usage in consumed.items():
             try:
@@ -197,12 +218,10 @@ class PriceEstimate(LoggableMixin, core_models.UuidMixin, core_models.Descendant
 
     def collect_children(self):
         """
-        Recursively collect children estimates. Returns generator.
+        Collect all children estimates. Returns generator.
         """
-        for child in self.children.filter():
-            yield child
-            for grandchild in child.collect_children():
-                yield grandchild
+        for descendant in self.get_descendants():
+            yield descendant
 
     @staticmethod
     def update_resource_estimate(resource, new_configuration, raise_exception=False):
@@ -217,6 +236,23 @@ class PriceEstimate(LoggableMixin, core_models.UuidMixin, core_models.Descendant
         return price_estimate
 
 
+class PriceEstimateClosure(models.Model):
+    """ Closure table of price estimates hierarchy.
+
+        Stores link between estimate and each of its ancestors, depth is a length
+        of the shortest path from descendant to ancestor. Allows to get all ancestors
+        or descendants of estimate with one query.
+    """
+    ancestor = models.ForeignKey(PriceEstimate, related_name='descendant_links')
+    descendant = models.ForeignKey(PriceEstimate, related_name='ancestor_links')
+    depth = models.PositiveSmallIntegerField()
+
+    objects = managers.PriceEstimateClosureManager()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+
+
 class ConsumptionDetailUpdateError(Exception):
     pass
 
@@ -470,3 +506,87 @@ class PriceListItem(core_models.UuidMixin, AbstractPriceListItem):
             default_price_list_item__in=default_items, service=service).select_related('default_price_list_item'))
         rewrited_defaults = set([i.default_price_list_item for i in items])
         return items | (default_items - rewrited_defaults)
+
+    @classmethod
+    def get_consumables_prices_for_resource(cls, resource):
+        """ Get minute rates of consumables that should be used for resource: {(item_type, key): minute_rate} """
+        service = resource.service_project_link.service
+        return cls.get_consumables_prices(ContentType.objects.get_for_model(resource), [service])[service.pk]
+
+    @classmethod
+    def get_consumables_prices(cls, resource_content_type, services):
+        """ Get minute rates of consumables of resources with given type for each service.
+
+            Return dictionary {service id: {(item_type, key): minute_rate}}.
+            Service price list item overrides default price list item of the same consumable.
+            Prices are cached until price list items of resource type or service are changed.
+        """
+        if not services:
+            return {}
+        service_content_type = ContentType.objects.get_for_model(next(iter(services)))
+        version = _get_price_list_version(resource_content_type.id)
+        keys = {service.pk: _get_price_list_cache_key(resource_content_type.id, version, service_content_type.id,
+                                                      service.pk)
+                for service in services}
+        cached = cache.get_many(keys.values())
+        prices = {service_id: cached[key] for service_id, key in keys.items() if key in cached}
+
+        missing_services_ids = [service_id for service_id in keys if service_id not in prices]
+        if missing_services_ids:
+            calculated = cls._calculate_consumables_prices(
+                resource_content_type, service_content_type, missing_services_ids)
+            cache.set_many({keys[service_id]: calculated[service_id] for service_id in missing_services_ids},
+                           PRICE_LIST_CACHE_TIMEOUT)
+            prices.update(calculated)
+        return prices
+
+    @staticmethod
+    def _calculate_consumables_prices(resource_content_type, service_content_type, services_ids):
+        default_items = list(DefaultPriceListItem.objects.filter(resource_content_type=resource_content_type))
+        default_prices = {(item.item_type, item.key): item.minute_rate for item in default_items}
+        prices = {service_id: dict(default_prices) for service_id in services_ids}
+        if not default_items:
+            return prices
+
+        items = PriceListItem.objects.filter(
+            default_price_list_item__in=default_items,
+            content_type=service_content_type,
+            object_id__in=services_ids,
+        ).select_related('default_price_list_item')
+        for item in items:
+            prices[item.object_id][(item.item_type, item.key)] = item.minute_rate
+        return prices
+
+
+PRICE_LIST_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def _get_price_list_version_key(resource_content_type_id):
+    return 'cost_tracking:price_list_version:%s' % resource_content_type_id
+
+
+def _get_price_list_version(resource_content_type_id):
+    key = _get_price_list_version_key(resource_content_type_id)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(key, version, None)
+    return version
+
+
+def _get_price_list_cache_key(resource_content_type_id, version, service_content_type_id, service_id):
+    return 'cost_tracking:price_list:%s:%s:%s:%s' % (
+        resource_content_type_id, version, service_content_type_id, service_id)
+
+
+def invalidate_price_list_cache(resource_content_type_id, service_content_type_id=None, service_id=None):
+    """ Expire cached prices of resources with given type.
+
+        If service is defined only prices of this service are expired.
+    """
+    if service_id is None:
+        cache.set(_get_price_list_version_key(resource_content_type_id), uuid.uuid4().hex, None)
+    else:
+        version = _get_price_list_version(resource_content_type_id)
+        cache.delete(_get_price_list_cache_key(
+            resource_content_type_id, version, service_content_type_id, service_id))
@@ -1,8 +1,29 @@
+import logging
+from collections import defaultdict
+
 from celery import shared_task
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Q, Sum, Value, When
+from django.utils import timezone
 
+from nodeconductor.core import utils as core_utils
 from nodeconductor.cost_tracking import CostTrackingRegister, models
 from nodeconductor.structure import models as structure_models
 
+logger = logging.getLogger(__name__)
+
+RESOURCES_CHUNK_SIZE = 500
+# Each updated estimate adds 3 parameters to UPDATE query, keep them below SQLite limit.
+UPDATE_CHUNK_SIZE = 300
+# Resources estimates that are created by rebuild shard in one transaction.
+REBUILD_BATCH_SIZE = 50
+# Key is set while rebuildpriceestimates command replaces estimates of current month.
+REBUILD_IN_PROGRESS_KEY = 'cost_tracking:rebuild_in_progress'
+REBUILD_IN_PROGRESS_TIMEOUT = 6 * 60 * 60
+
 
 @shared_task(name='nodeconductor.cost_tracking.recalculate_estimate')
 def recalculate_estimate(recalculate_total=False):
@@ -12,21 +33,121 @@ def recalculate_estimate(recalculate_total=False):
         request, so we store cached price each hour.
         If recalculate_total is True - task also recalculates total estimate
         for current month.
+
+        Resources are processed in chunks: price estimates, consumption details
+        and price lists of chunk are loaded with a few queries and changed values
+        are written with bulk updates. Ancestors are updated at once after all resources
+        using price estimates closure table.
     """
+    if cache.get(REBUILD_IN_PROGRESS_KEY):
+        # Rebuild shards create estimates of current month, they should not be created concurrently.
+        logger.info('Price estimates are not recalculated because they are being rebuilt.')
+        return
     # Celery does not import server.urls and does not discover cost tracking modules.
     # So they should be discovered implicitly.
     CostTrackingRegister.autodiscover()
+    now = timezone.now()
     # Step 1. Recalculate resources estimates.
+    resources_total_diffs = {}  # {resource estimate id: total change}
     for resource_model in CostTrackingRegister.registered_resources:
-        for resource in resource_model.objects.all():
-            _update_resource_consumed(resource, recalculate_total=recalculate_total)
+        resources_ids = list(resource_model.objects.order_by('pk').values_list('pk', flat=True))
+        for index in range(0, len(resources_ids), RESOURCES_CHUNK_SIZE):
+            resources_total_diffs.update(_update_resources_consumed(
+                resource_model, resources_ids[index:index + RESOURCES_CHUNK_SIZE], now, recalculate_total))
     # Step 2. Move from down to top and recalculate consumed estimate for each
     #         object based on its children.
-    ancestors_models = [m for m in models.PriceEstimate.get_estimated_models()
-                        if not issubclass(m, structure_models.ResourceMixin)]
-    for model in ancestors_models:
-        for ancestor in model.objects.all():
-            _update_ancestor_consumed(ancestor)
+    _update_ancestors(now, resources_total_diffs)
+
+
+@shared_task(name='nodeconductor.cost_tracking.rebuild_resources_estimates')
+def rebuild_resources_estimates(resource_model_label, min_pk, max_pk, customer_uuid=None):
+    """ Create current month price estimates for resources with primary keys in given range.
+
+        Shard of rebuildpriceestimates command. Resources are processed in small batches,
+        each batch is committed separately. Shards do not update consumed price and totals
+        of ancestors, so shards that are executed in parallel do not lock common ancestors.
+        Ancestors should be recalculated once after all shards with finish_estimates_rebuild.
+    """
+    CostTrackingRegister.autodiscover()
+    resource_model = apps.get_model(resource_model_label)
+    month_start = core_utils.month_start(timezone.now())
+    resources = resource_model.objects.filter(pk__gte=min_pk, pk__lte=max_pk)
+    if customer_uuid is not None:
+        resources = resources.filter(customer__uuid=customer_uuid)
+    resources_ids = list(resources.order_by('pk').values_list('pk', flat=True))
+    for index in range(0, len(resources_ids), REBUILD_BATCH_SIZE):
+        batch = resource_model.objects.filter(pk__in=resources_ids[index:index + REBUILD_BATCH_SIZE]).order_by('pk')
+        with transaction.atomic():
+            for resource in batch:
+                configuration = CostTrackingRegister.get_configuration(resource)
+                date = max(month_start, resource.created)
+                price_estimate = models.PriceEstimate.create_historical(
+                    resource, configuration, date, update_ancestors=False)
+                price_estimate.update_consumed()
+    return len(resources_ids)
+
+
+@shared_task(name='nodeconductor.cost_tracking.recalculate_ancestors_consumed')
+def recalculate_ancestors_consumed(recalculate_total=False):
+    """ Sum consumed price of resources for each current month ancestor estimate.
+
+        If recalculate_total is True totals of ancestors are recalculated too.
+    """
+    _update_ancestors(timezone.now(), {}, recalculate_total=recalculate_total)
+
+
+@shared_task(name='nodeconductor.cost_tracking.finish_estimates_rebuild')
+def finish_estimates_rebuild():
+    """ Recalculate ancestors of rebuilt resources estimates and allow regular recalculation """
+    try:
+        recalculate_ancestors_consumed(recalculate_total=True)
+    finally:
+        cache.delete(REBUILD_IN_PROGRESS_KEY)
+
+
+def _update_resources_consumed(resource_model, resources_ids, now, recalculate_total):
+    """ Recalculate estimates of resources chunk.
+
+        Return change of resources estimates totals that were not propagated to ancestors yet.
+    """
+    content_type = ContentType.objects.get_for_model(resource_model)
+    resources = list(resource_model.objects.filter(pk__in=resources_ids)
+                     .select_related('service_project_link__service'))
+    estimates = models.PriceEstimate.objects.filter(
+        content_type=content_type, object_id__in=resources_ids, year=now.year, month=now.month)
+    estimates = {estimate.object_id: estimate for estimate in estimates.select_related('consumption_details')}
+    services = {resource.service_project_link.service for resource in resources}
+    prices = models.PriceListItem.get_consumables_prices(content_type, services)
+
+    total_diffs = {}
+    new_consumed, new_totals = {}, {}
+    for resource in resources:
+        price_estimate = estimates.get(resource.pk)
+        if price_estimate is None:
+            # New estimate and its ancestors are created and updated one by one.
+            _update_resource_consumed(resource, recalculate_total)
+            continue
+        try:
+            details = price_estimate.consumption_details
+        except models.ConsumptionDetails.DoesNotExist:
+            logger.error('Cannot update consumed for price estimate %s that does not have consumption details.',
+                         price_estimate.pk)
+            continue
+
+        service_prices = prices[resource.service_project_link.service.pk]
+        consumed = models.PriceEstimate.calculate_price(details.consumed_until_now, service_prices)
+        if consumed != price_estimate.consumed:
+            new_consumed[price_estimate.pk] = consumed
+        if recalculate_total:
+            total = models.PriceEstimate.calculate_price(details.consumed_in_month, service_prices)
+            if total != price_estimate.total:
+                new_totals[price_estimate.pk] = total
+                total_diffs[price_estimate.pk] = total - price_estimate.total
+
+    with transaction.atomic():
+        _bulk_update('consumed', new_consumed)
+        _bulk_update('total', new_totals)
+    return total_diffs
 
 
 def _update_resource_consumed(resource, recalculate_total):
@@ -40,9 +161,91 @@ def _update_resource_consumed(resource, recalculate_total):
     price_estimate.update_consumed()
 
 
-def _update_ancestor_consumed(ancestor):
-    price_estimate, _ = models.PriceEstimate.objects.get_or_create_current(scope=ancestor)
-    resource_descendants = [descendant for descendant in price_estimate.get_descendants()
-                            if isinstance(descendant.scope, structure_models.ResourceMixin)]
-    price_estimate.consumed = sum([descendant.consumed for descendant in resource_descendants])
-    price_estimate.save(update_fields=['consumed'])
+def _update_ancestors(now, resources_total_diffs, recalculate_total=False):
+    """ Sum consumed price of resources for each ancestor and add change of resources totals to ancestors.
+
+        If recalculate_total is True ancestors totals are set to sum of their resources totals instead.
+    """
+    ancestors_models = [m for m in models.PriceEstimate.get_estimated_models()
+                        if not issubclass(m, structure_models.ResourceMixin)]
+    for model in ancestors_models:
+        _create_missing_estimates(model, now)
+
+    # consumed price of deleted resources is not included
+    resources_query = Q()
+    for resource_model in structure_models.ResourceMixin.get_all_models():
+        resources_query |= Q(descendant__content_type=ContentType.objects.get_for_model(resource_model),
+                             descendant__object_id__in=resource_model.objects.values('pk'))
+    ancestors_consumed = dict(
+        models.PriceEstimateClosure.objects
+        .filter(resources_query, ancestor__year=now.year, ancestor__month=now.month)
+        .order_by()
+        .values('ancestor_id')
+        .annotate(consumed=Sum('descendant__consumed'))
+        .values_list('ancestor_id', 'consumed')
+    )
+
+    if recalculate_total:
+        # estimates of deleted resources are kept with consumption details and are included into totals
+        ancestors_totals = dict(
+            models.PriceEstimateClosure.objects
+            .filter(descendant__consumption_details__isnull=False, ancestor__year=now.year, ancestor__month=now.month)
+            .order_by()
+            .values('ancestor_id')
+            .annotate(total=Sum('descendant__total'))
+            .values_list('ancestor_id', 'total')
+        )
+
+    new_consumed, new_totals = {}, {}
+    current_estimates = models.PriceEstimate.objects.filter(year=now.year, month=now.month)
+    for model in ancestors_models:
+        estimates = current_estimates.filter(
+            content_type=ContentType.objects.get_for_model(model), object_id__in=model.objects.values('pk'))
+        for estimate_id, consumed, total in estimates.values_list('pk', 'consumed', 'total'):
+            if ancestors_consumed.get(estimate_id, 0) != consumed:
+                new_consumed[estimate_id] = ancestors_consumed.get(estimate_id, 0)
+            if recalculate_total and ancestors_totals.get(estimate_id, 0) != total:
+                new_totals[estimate_id] = ancestors_totals.get(estimate_id, 0)
+
+    if recalculate_total:
+        with transaction.atomic():
+            _bulk_update('consumed', new_consumed)
+            _bulk_update('total', new_totals)
+        return
+
+    ancestors_total_diffs = defaultdict(float)
+    changed_ids = list(resources_total_diffs.keys())
+    for index in range(0, len(changed_ids), UPDATE_CHUNK_SIZE):
+        links = models.PriceEstimateClosure.objects.filter(
+            descendant_id__in=changed_ids[index:index + UPDATE_CHUNK_SIZE])
+        for ancestor_id, descendant_id in links.values_list('ancestor_id', 'descendant_id'):
+            ancestors_total_diffs[ancestor_id] += resources_total_diffs[descendant_id]
+
+    with transaction.atomic():
+        _bulk_update('consumed', new_consumed)
+        _bulk_update('total', {pk: diff for pk, diff in ancestors_total_diffs.items() if diff}, increment=True)
+
+
+def _create_missing_estimates(model, now):
+    content_type = ContentType.objects.get_for_model(model)
+    existing_scopes = models.PriceEstimate.objects.filter(
+        content_type=content_type, year=now.year, month=now.month).values('object_id')
+    models.PriceEstimate.objects.bulk_create([
+        models.PriceEstimate(content_type=content_type, object_id=scope_id, year=now.year, month=now.month)
+        for scope_id in model.objects.exclude(pk__in=existing_scopes).values_list('pk', flat=True)
+    ])
+
+
+def _bulk_update(field_name, values, increment=False):
+    """ Write values of price estimates field with one query per chunk.
+
+        values format: {price estimate id: value}. If increment is True values are
+        added to current field values.
+    """
+    values = list(values.items())
+    for index in range(0, len(values), UPDATE_CHUNK_SIZE):
+        chunk = values[index:index + UPDATE_CHUNK_SIZE]
+        new_value = Case(*[When(pk=pk, then=Value(value)) for pk, value in chunk], output_field=FloatField())
+        if increment:
+            new_value = F(field_name) + new_value
+        models.PriceEstimate.objects.filter(pk__in=[pk for pk, _ in chunk]).update(**{field_name: new_value})
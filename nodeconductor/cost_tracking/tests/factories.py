@@ -91,6 +91,8 @@ class PriceListItemFactory(AbstractPriceListItemFactory):
 
 class TestNewInstanceCostTrackingStrategy(CostTrackingStrategy):
     resource_class = test_models.TestNewInstance
+    configuration_fields = ('state', 'runtime_state', 'disk', 'ram', 'cores', 'flavor_name')
+    configuration_quotas = (test_models.TestNewInstance.Quotas.test_quota.name,)
 
     class Types(object):
         STORAGE = 'storage'
@@ -0,0 +1,119 @@
+import datetime
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils.six import StringIO
+from freezegun import freeze_time
+import mock
+
+from nodeconductor.cost_tracking import models, tasks, CostTrackingRegister
+from nodeconductor.cost_tracking.tests import factories
+from nodeconductor.structure.tests import factories as structure_factories
+from nodeconductor.structure.tests.models import TestNewInstance, TestServiceProjectLink
+
+
+class RebuildPriceEstimatesTest(TestCase):
+
+    def setUp(self):
+        resource_content_type = ContentType.objects.get_for_model(TestNewInstance)
+        self.price_list_item = models.DefaultPriceListItem.objects.create(
+            item_type='storage', key='1 MB', resource_content_type=resource_content_type, value=2)
+        self.registered_resources = CostTrackingRegister.registered_resources.copy()
+        CostTrackingRegister.register_strategy(factories.TestNewInstanceCostTrackingStrategy)
+        self.start_time = datetime.datetime(2016, 8, 8, 11, 0)
+        self.calculation_time = datetime.datetime(2016, 8, 8, 15, 0)
+        self.settings = structure_factories.ServiceSettingsFactory(shared=True)
+        with freeze_time(self.start_time):
+            self.resource = self.create_resource(disk=20 * 1024)
+            self.other_resource = self.create_resource(disk=10 * 1024)
+        self.customer = self.resource.service_project_link.project.customer
+        self.other_customer = self.other_resource.service_project_link.project.customer
+
+    def tearDown(self):
+        CostTrackingRegister.registered_resources = self.registered_resources
+
+    def create_resource(self, disk):
+        project = structure_factories.ProjectFactory()
+        # services and links of shared settings are created for each new customer and project
+        spl = TestServiceProjectLink.objects.get(service__settings=self.settings, project=project)
+        return structure_factories.TestNewInstanceFactory(service_project_link=spl, disk=disk)
+
+    def rebuild(self, **options):
+        with freeze_time(self.calculation_time):
+            call_command('rebuildpriceestimates', stdout=StringIO(), **options)
+
+    def get_estimate(self, scope):
+        return models.PriceEstimate.objects.get(scope=scope, month=8, year=2016)
+
+    def get_expected_consumed(self, resource):
+        working_minutes = (self.calculation_time - self.start_time).total_seconds() / 60
+        return working_minutes * self.price_list_item.minute_rate * resource.disk
+
+    def test_estimates_are_rebuilt_for_all_resources(self):
+        self.rebuild(shard_size=1)
+
+        for resource, customer in ((self.resource, self.customer), (self.other_resource, self.other_customer)):
+            expected = self.get_expected_consumed(resource)
+            self.assertAlmostEqual(self.get_estimate(resource).consumed, expected)
+            self.assertAlmostEqual(self.get_estimate(customer).consumed, expected)
+            self.assertAlmostEqual(self.get_estimate(customer).total, self.get_estimate(resource).total)
+        expected = self.get_expected_consumed(self.resource) + self.get_expected_consumed(self.other_resource)
+        self.assertAlmostEqual(self.get_estimate(self.settings).consumed, expected)
+
+    def test_wrong_totals_are_fixed(self):
+        self.rebuild()
+        expected_totals = {estimate.pk: estimate.total for estimate in models.PriceEstimate.objects.all()}
+        models.PriceEstimate.objects.update(total=0)
+
+        self.rebuild(shard_size=1)
+
+        new_totals = sorted(estimate.total for estimate in models.PriceEstimate.objects.all())
+        self.assertEqual(new_totals, sorted(expected_totals.values()))
+
+    def test_only_estimates_of_given_customer_are_rebuilt(self):
+        self.rebuild()
+        other_estimate = self.get_estimate(self.other_resource)
+        customer_estimate = self.get_estimate(self.resource)
+        settings_total = self.get_estimate(self.settings).total
+
+        self.rebuild(customer_uuid=self.customer.uuid.hex)
+
+        self.assertTrue(models.PriceEstimate.objects.filter(pk=other_estimate.pk).exists())
+        self.assertFalse(models.PriceEstimate.objects.filter(pk=customer_estimate.pk).exists())
+        # totals of shared service settings are not duplicated
+        self.assertAlmostEqual(self.get_estimate(self.settings).total, settings_total)
+        self.assertAlmostEqual(self.get_estimate(self.customer).total, self.get_estimate(self.resource).total)
+
+    def test_shards_do_not_update_ancestors_totals(self):
+        with mock.patch('nodeconductor.cost_tracking.models.PriceEstimate.update_ancestors_total') as update:
+            self.rebuild(shard_size=1)
+
+        self.assertFalse(update.called)
+        self.assertAlmostEqual(self.get_estimate(self.customer).total, self.get_estimate(self.resource).total)
+        self.assertAlmostEqual(self.get_estimate(self.settings).total, sum(
+            self.get_estimate(resource).total for resource in (self.resource, self.other_resource)))
+
+    def test_rebuild_is_not_started_if_it_is_in_progress(self):
+        cache.set(tasks.REBUILD_IN_PROGRESS_KEY, True)
+        try:
+            with self.assertRaises(CommandError):
+                self.rebuild()
+        finally:
+            cache.delete(tasks.REBUILD_IN_PROGRESS_KEY)
+
+    def test_regular_recalculation_is_suspended_during_rebuild(self):
+        cache.set(tasks.REBUILD_IN_PROGRESS_KEY, True)
+        try:
+            with mock.patch('nodeconductor.cost_tracking.tasks._update_ancestors') as update_ancestors:
+                tasks.recalculate_estimate()
+        finally:
+            cache.delete(tasks.REBUILD_IN_PROGRESS_KEY)
+
+        self.assertFalse(update_ancestors.called)
+
+    def test_error_is_raised_for_unknown_scope(self):
+        with self.assertRaises(CommandError):
+            self.rebuild(customer_uuid='abc')
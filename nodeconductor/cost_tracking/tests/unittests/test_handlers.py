@@ -1,9 +1,12 @@
 import datetime
 
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
 from django.test import TransactionTestCase
 from django.utils import timezone
 from freezegun import freeze_time
+import mock
 
 from nodeconductor.cost_tracking import CostTrackingRegister, models, ConsumableItem, tasks
 from nodeconductor.cost_tracking.tests import factories
@@ -168,6 +171,68 @@ class ResourceQuotaUpdateTest(TransactionTestCase):
         self.assertEqual(consumption_details.configuration[quota_item], 5)
 
 
+@mock.patch('nodeconductor.cost_tracking.models.PriceEstimate.update_resource_estimate')
+class ResourceUpdateDebounceTest(TransactionTestCase):
+
+    def setUp(self):
+        CostTrackingRegister.register_strategy(factories.TestNewInstanceCostTrackingStrategy)
+        self.resource = structure_factories.TestNewInstanceFactory(disk=1024)
+        nodeconductor_settings = settings.NODECONDUCTOR.copy()
+        nodeconductor_settings['COALESCE_PRICE_ESTIMATES_UPDATES'] = True
+        self.settings_override = self.settings(NODECONDUCTOR=nodeconductor_settings)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+
+    def test_estimate_is_not_updated_if_configuration_fields_are_not_changed(self, update_resource_estimate):
+        self.resource.name = 'new name'
+        self.resource.save()
+
+        self.assertFalse(update_resource_estimate.called)
+
+    def test_estimate_is_not_updated_on_change_of_other_quota(self, update_resource_estimate):
+        self.resource.quotas.create(name='other_quota', usage=1)
+
+        self.assertFalse(update_resource_estimate.called)
+
+    def test_estimate_is_updated_once_on_transaction_commit(self, update_resource_estimate):
+        with transaction.atomic():
+            for disk in (2048, 4096):
+                self.resource.disk = disk
+                self.resource.save()
+            self.resource.set_quota_usage(TestNewInstance.Quotas.test_quota, 5)
+            self.assertFalse(update_resource_estimate.called)
+
+        self.assertEqual(update_resource_estimate.call_count, 1)
+        resource, configuration = update_resource_estimate.call_args[0]
+        self.assertEqual(configuration[ConsumableItem('storage', '1 MB')], 4096)
+        self.assertEqual(configuration[ConsumableItem('quotas', 'test_quota')], 5)
+
+    def test_estimate_is_not_updated_if_transaction_is_rolled_back(self, update_resource_estimate):
+        try:
+            with transaction.atomic():
+                self.resource.disk = 2048
+                self.resource.save()
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertFalse(update_resource_estimate.called)
+
+    def test_estimate_update_error_does_not_break_other_commit_hooks(self, update_resource_estimate):
+        update_resource_estimate.side_effect = ValueError()
+        other_hook = mock.Mock()
+
+        with transaction.atomic():
+            self.resource.disk = 2048
+            self.resource.save()
+            transaction.on_commit(other_hook)
+
+        self.assertEqual(update_resource_estimate.call_count, 1)
+        self.assertTrue(other_hook.called)
+
+
 class ScopeDeleteTest(TransactionTestCase):
 
     def setUp(self):
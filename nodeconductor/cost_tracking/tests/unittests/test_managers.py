@@ -1,8 +1,18 @@
-from django.test import TransactionTestCase
+from __future__ import print_function
+
+import os
+import time
+import unittest
+
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase, TransactionTestCase
 from freezegun import freeze_time
 
 from nodeconductor.cost_tracking import models, ConsumableItem
 from nodeconductor.cost_tracking.tests import factories
+from nodeconductor.quotas import models as quotas_models, utils as quotas_utils
+from nodeconductor.structure.tests import (factories as structure_factories, fixtures as structure_fixtures,
+                                           models as structure_test_models)
 
 
 class ConsumptionDetailsManagerTest(TransactionTestCase):
@@ -22,3 +32,92 @@ class ConsumptionDetailsManagerTest(TransactionTestCase):
             )
             next_consumption_details = models.ConsumptionDetails.objects.create(price_estimate=next_price_estimate)
         self.assertDictEqual(next_consumption_details.configuration, configuration)
+
+
+class BaseUserFilterTest(TestCase):
+
+    def setUp(self):
+        self.fixture = structure_fixtures.ServiceFixture()
+        self.user = self.fixture.owner
+
+    def create_resources(self, count):
+        for _ in range(count):
+            resource = structure_factories.TestNewInstanceFactory(
+                service_project_link=self.fixture.service_project_link)
+            factories.PriceEstimateFactory(scope=resource)
+
+
+class UserFilterTest(BaseUserFilterTest):
+    """ Filtering by user permissions should not depend on number of visible objects """
+
+    def get_subqueries_count(self, manager):
+        """ Filter objects with one query and return number of subqueries in it """
+        manager.filtered_for_user(self.user)  # fill content types cache
+        with self.assertNumQueries(1) as context:
+            list(manager.filtered_for_user(self.user))
+        return context.captured_queries[0]['sql'].upper().count('SELECT') - 1
+
+    def test_price_estimates_are_filtered_with_subquery_for_each_scope_model(self):
+        self.create_resources(1)
+        subqueries_count = self.get_subqueries_count(models.PriceEstimate.objects)
+
+        self.create_resources(20)
+
+        self.assertGreaterEqual(subqueries_count, len(models.PriceEstimate.get_estimated_models()))
+        self.assertEqual(self.get_subqueries_count(models.PriceEstimate.objects), subqueries_count)
+        resources_estimates = models.PriceEstimate.objects.filtered_for_user(self.user).filter(
+            content_type=ContentType.objects.get_for_model(structure_test_models.TestNewInstance))
+        self.assertEqual(resources_estimates.count(), 21)
+
+    def test_quotas_are_filtered_with_subquery_for_each_scope_model(self):
+        self.create_resources(1)
+        subqueries_count = self.get_subqueries_count(quotas_models.Quota.objects)
+
+        self.create_resources(20)
+
+        self.assertGreaterEqual(subqueries_count, len(quotas_utils.get_models_with_quotas()))
+        self.assertEqual(self.get_subqueries_count(quotas_models.Quota.objects), subqueries_count)
+
+    def test_user_does_not_see_price_estimates_of_other_customers(self):
+        other_estimate = factories.PriceEstimateFactory(scope=structure_factories.TestNewInstanceFactory())
+
+        estimates = models.PriceEstimate.objects.filtered_for_user(self.user)
+
+        self.assertNotIn(other_estimate, estimates)
+
+
+@unittest.skipUnless(os.environ.get('NODECONDUCTOR_BENCHMARK'), 'NODECONDUCTOR_BENCHMARK is not set.')
+class UserFilterBenchmark(BaseUserFilterTest):
+    """ Measure time of page of objects filtered for user as number of user resources grows.
+
+        Run with:
+        NODECONDUCTOR_BENCHMARK=1 nodeconductor test nodeconductor.cost_tracking.tests.unittests.test_managers
+    """
+    RESOURCES_COUNTS = (10, 100, 1000)
+    REPEATS = 21
+    PAGE_SIZE = 10
+
+    def measure(self, manager):
+        timings = []
+        for _ in range(self.REPEATS):
+            start = time.time()
+            list(manager.filtered_for_user(self.user)[:self.PAGE_SIZE])
+            timings.append(time.time() - start)
+        return sorted(timings)[self.REPEATS // 2]
+
+    def test_query_time_does_not_grow_with_number_of_resources(self):
+        managers = (('price estimates', models.PriceEstimate.objects), ('quotas', quotas_models.Quota.objects))
+        timings = {name: [] for name, _ in managers}
+        created = 0
+        for count in self.RESOURCES_COUNTS:
+            self.create_resources(count - created)
+            created = count
+            for name, manager in managers:
+                timings[name].append(self.measure(manager))
+
+        for name, _ in managers:
+            print('\nMedian time of %s page, ms: %s' % (name, ', '.join(
+                '%s resources - %.2f' % (count, timing * 1000)
+                for count, timing in zip(self.RESOURCES_COUNTS, timings[name]))))
+            # query time grew linearly when visible ids were embedded to query
+            self.assertLess(timings[name][-1], timings[name][0] * 5)
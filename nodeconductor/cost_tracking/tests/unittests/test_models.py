@@ -96,6 +96,27 @@ class PriceListItemTest(TransactionTestCase):
         expected = {default_item1, item}
         self.assertSetEqual(models.PriceListItem.get_for_resource(resource), expected)
 
+    def test_consumables_prices_are_cached_until_price_list_item_is_changed(self):
+        resource = structure_factories.TestNewInstanceFactory()
+        resource_content_type = ContentType.objects.get_for_model(resource)
+        default_item = models.DefaultPriceListItem.objects.create(
+            resource_content_type=resource_content_type, item_type='storage', key='1 GB', value=60)
+        models.PriceListItem.get_consumables_prices_for_resource(resource)
+
+        with self.assertNumQueries(0):
+            prices = models.PriceListItem.get_consumables_prices_for_resource(resource)
+        self.assertEqual(prices, {('storage', '1 GB'): 1})
+
+        item = models.PriceListItem.objects.create(
+            default_price_list_item=default_item, service=resource.service_project_link.service, value=120)
+        self.assertEqual(models.PriceListItem.get_consumables_prices_for_resource(resource), {('storage', '1 GB'): 2})
+
+        item.delete()
+        default_item.value = 30
+        default_item.save()
+        self.assertEqual(models.PriceListItem.get_consumables_prices_for_resource(resource),
+                         {('storage', '1 GB'): 0.5})
+
 
 class DefaultPriceListItemTest(TransactionTestCase):
 
@@ -108,3 +129,56 @@ class DefaultPriceListItemTest(TransactionTestCase):
         actual = models.DefaultPriceListItem.get_consumable_items_pretty_names(
             price_list_item.resource_content_type, [consumable_item])
         self.assertDictEqual(actual, expected)
+
+
+class PriceEstimateClosureTest(TransactionTestCase):
+
+    def setUp(self):
+        self.customer, self.project, self.spl, self.resource = [
+            factories.PriceEstimateFactory(month=8, year=2016) for _ in range(4)]
+        self.project.parents.add(self.customer)
+        self.spl.parents.add(self.project)
+        self.resource.parents.add(self.spl)
+
+    def test_ancestors_are_returned_with_one_query(self):
+        with self.assertNumQueries(1):
+            ancestors = self.resource.get_ancestors()
+        self.assertEqual(ancestors, [self.spl, self.project, self.customer])
+
+    def test_descendants_are_returned_with_one_query(self):
+        with self.assertNumQueries(1):
+            descendants = self.customer.get_descendants()
+        self.assertEqual(descendants, [self.project, self.spl, self.resource])
+
+    def test_children_added_to_parent_become_its_descendants(self):
+        other_resource = factories.PriceEstimateFactory(month=8, year=2016)
+        self.spl.children.add(other_resource)
+
+        self.assertEqual(other_resource.get_ancestors(), [self.spl, self.project, self.customer])
+
+    def test_shortest_path_is_used_as_depth(self):
+        self.spl.parents.add(self.customer)
+
+        depth = models.PriceEstimateClosure.objects.get(ancestor=self.customer, descendant=self.resource).depth
+        self.assertEqual(depth, 2)
+
+    def test_descendants_lose_ancestors_after_parent_removal(self):
+        self.spl.parents.remove(self.project)
+
+        self.assertEqual(self.resource.get_ancestors(), [self.spl])
+        self.assertEqual(self.customer.get_descendants(), [self.project])
+
+    def test_descendants_lose_ancestors_after_estimate_deletion(self):
+        self.project.delete()
+
+        self.assertEqual(self.resource.get_ancestors(), [self.spl])
+
+    def test_ancestors_total_is_updated_with_one_statement(self):
+        totals = {estimate.pk: estimate.total for estimate in (self.customer, self.project, self.spl)}
+
+        # transaction start and update
+        with self.assertNumQueries(2):
+            self.resource.update_ancestors_total(diff=5)
+
+        for estimate in (self.customer, self.project, self.spl):
+            self.assertEqual(models.PriceEstimate.objects.get(pk=estimate.pk).total, totals[estimate.pk] + 5)
@@ -1,7 +1,9 @@
 import datetime
 
 from django.contrib.contenttypes.models import ContentType
+from django.db import connection
 from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from freezegun import freeze_time
 
 from nodeconductor.cost_tracking import models, CostTrackingRegister, tasks
@@ -76,3 +78,48 @@ class RecalculateEstimateTest(TransactionTestCase):
             message = 'Price estimate "consumed" is calculated wrongly for "%s". Real value: %s, expected: %s.' % (
                 price_estimate.scope, price_estimate.consumed, expected_consumed)
             self.assertAlmostEqual(price_estimate.consumed, expected_consumed, msg=message)
+
+    def test_total_is_recalculated_for_resource_and_ancestors(self):
+        calculation_time = datetime.datetime(2016, 8, 8, 15, 0)
+        with freeze_time(calculation_time):
+            tasks.recalculate_estimate()
+            self.price_list_item.value = 4
+            self.price_list_item.save()
+            tasks.recalculate_estimate(recalculate_total=True)
+            price_estimates = [models.PriceEstimate.objects.get_current(scope=scope) for scope in
+                               (self.resource, self.spl, self.project, self.customer)]
+
+        month_end = datetime.datetime(2016, 8, 31, 23, 59, 59)
+        working_minutes = int((month_end - self.start_time).total_seconds() / 60)
+        expected_total = working_minutes * self.price_list_item.minute_rate * self.resource.disk
+        for price_estimate in price_estimates:
+            self.assertAlmostEqual(price_estimate.total, expected_total)
+
+    def test_service_price_list_item_overrides_default_one(self):
+        service_item = factories.PriceListItemFactory(
+            service=self.service, default_price_list_item=self.price_list_item, value=3)
+
+        calculation_time = datetime.datetime(2016, 8, 8, 15, 0)
+        with freeze_time(calculation_time):
+            tasks.recalculate_estimate()
+            price_estimate = models.PriceEstimate.objects.get_current(scope=self.resource)
+
+        working_minutes = (calculation_time - self.start_time).total_seconds() / 60
+        expected = working_minutes * service_item.minute_rate * self.resource.disk
+        self.assertAlmostEqual(price_estimate.consumed, expected)
+
+    def test_number_of_queries_does_not_depend_on_resources_count(self):
+        def get_queries_count():
+            with freeze_time(datetime.datetime(2016, 8, 8, 15, 0)):
+                tasks.recalculate_estimate()  # create estimates of new resources
+                with CaptureQueriesContext(connection) as context:
+                    tasks.recalculate_estimate(recalculate_total=True)
+            return len(context.captured_queries)
+
+        small_count = get_queries_count()
+        with freeze_time(self.start_time):
+            for _ in range(5):
+                structure_factories.TestNewInstanceFactory(disk=1024, service_project_link=self.spl)
+        large_count = get_queries_count()
+
+        self.assertEqual(small_count, large_count)
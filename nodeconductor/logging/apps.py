@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 
 from django.apps import AppConfig
+from django.conf import settings
 from django.db.models import signals
 
 
@@ -9,7 +10,7 @@ class EventsConfig(AppConfig):
     verbose_name = 'Logging'
 
     def ready(self):
-        from nodeconductor.logging import handlers, utils
+        from nodeconductor.logging import handlers, models, utils
 
         for index, model in enumerate(utils.get_loggable_models()):
             signals.post_delete.connect(
@@ -17,3 +18,31 @@ class EventsConfig(AppConfig):
                 sender=model,
                 dispatch_uid='nodeconductor.logging.handlers.remove_{}_{}_related_alerts'.format(model.__name__, index),
             )
+
+            signals.post_save.connect(
+                handlers.invalidate_permitted_objects_uuids_on_create,
+                sender=model,
+                dispatch_uid='nodeconductor.logging.handlers.invalidate_permitted_objects_uuids_on_{}_{}_create'.format(
+                    model.__name__, index),
+            )
+
+        signals.post_save.connect(
+            handlers.invalidate_user_permitted_objects_uuids,
+            sender=settings.AUTH_USER_MODEL,
+            dispatch_uid='nodeconductor.logging.handlers.invalidate_user_permitted_objects_uuids',
+        )
+
+        for index, model in enumerate(models.BaseHook.get_all_models() + [models.SystemNotification]):
+            signals.post_save.connect(
+                handlers.invalidate_hooks_index,
+                sender=model,
+                dispatch_uid='nodeconductor.logging.handlers.invalidate_hooks_index_on_{}_{}_save'.format(
+                    model.__name__, index),
+            )
+
+            signals.post_delete.connect(
+                handlers.invalidate_hooks_index,
+                sender=model,
+                dispatch_uid='nodeconductor.logging.handlers.invalidate_hooks_index_on_{}_{}_delete'.format(
+                    model.__name__, index),
+            )
@@ -0,0 +1,313 @@
+""" Outbound HTTP delivery of hook notifications.
+
+Delivery engine keeps connection pool for each destination and sends requests
+from bounded thread pool, so one slow endpoint does not block delivery to others:
+ - each destination (scheme and host) has its own requests session, so
+   connections are reused and number of parallel requests to host is limited;
+ - requests have timeouts, failed requests are retried with exponential backoff;
+ - circuit breaker temporarily disables hooks that fail consecutively;
+ - delivery latency and failures are aggregated per host in cache,
+   statistics are available via `get_stats`.
+"""
+from __future__ import unicode_literals
+
+import logging
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils.six.moves.urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+from nodeconductor.core import utils as core_utils
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    # Timeout of one request in seconds
+    'TIMEOUT': 10,
+    # Number of retries after failed request
+    'RETRIES': 3,
+    # Retry N is issued after BACKOFF_FACTOR * 2 ** (N - 1) seconds
+    'BACKOFF_FACTOR': 0.5,
+    # Number of threads that deliver notifications concurrently
+    'MAX_WORKERS': 10,
+    # Number of concurrent requests to one host
+    'MAX_REQUESTS_PER_HOST': 4,
+    # Hook is disabled for CIRCUIT_BREAKER_TIMEOUT seconds after
+    # CIRCUIT_BREAKER_THRESHOLD consecutive failed deliveries
+    'CIRCUIT_BREAKER_THRESHOLD': 5,
+    'CIRCUIT_BREAKER_TIMEOUT': 5 * 60,
+}
+# Requests with these response status codes are retried
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+WINDOW = 60 * 60
+WINDOWS_COUNT = 24
+METRICS = ('count', 'failed', 'retries', 'rejected', 'latency')
+
+
+class DeliveryError(Exception):
+    pass
+
+
+class CircuitOpenError(DeliveryError):
+    pass
+
+
+def get_settings():
+    return dict(DEFAULT_SETTINGS, **settings.NODECONDUCTOR.get('HOOK_DELIVERY', {}))
+
+
+def _get_window(timestamp=None):
+    timestamp = timestamp or time.time()
+    return int(timestamp) // WINDOW
+
+
+def _get_hosts_key(window):
+    return 'hook_delivery:%s:hosts' % window
+
+
+def _get_key(window, host, metric):
+    return 'hook_delivery:%s:%s:%s' % (window, host, metric)
+
+
+def _increment(key, delta, timeout):
+    cache.add(key, 0, timeout)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # key has expired between add and incr
+        pass
+
+
+def record(host, **measurements):
+    """ Add measurements of delivery to given host to statistics of current window """
+    try:
+        window = _get_window()
+        core_utils.add_to_cache_set(_get_hosts_key(window), host, WINDOW * WINDOWS_COUNT)
+        for metric, value in measurements.items():
+            _increment(_get_key(window, host, metric), int(value), WINDOW * WINDOWS_COUNT)
+    except Exception as e:
+        # Telemetry should never break delivery.
+        logger.exception('Cannot record statistics of delivery to %s. Error: %s', host, e)
+
+
+def get_stats(windows_count=WINDOWS_COUNT):
+    """ Return delivery statistics per host for last windows_count windows.
+
+        Latency is measured in milliseconds, average latency is per one request.
+    """
+    current_window = _get_window()
+    windows = range(current_window - windows_count + 1, current_window + 1)
+    hosts_by_window = core_utils.get_cache_sets([_get_hosts_key(window) for window in windows])
+
+    keys = []
+    for window in windows:
+        for host in hosts_by_window.get(_get_hosts_key(window), ()):
+            keys.append((window, host))
+    values = cache.get_many([_get_key(window, host, metric) for window, host in keys for metric in METRICS])
+
+    stats = {}
+    for window, host in keys:
+        host_stats = stats.setdefault(host, dict.fromkeys(METRICS, 0))
+        for metric in METRICS:
+            host_stats[metric] += values.get(_get_key(window, host, metric), 0)
+
+    result = []
+    for host, host_stats in sorted(stats.items()):
+        requests_count = host_stats['count'] + host_stats['retries']
+        row = dict(host_stats, host=host)
+        row['avg_latency'] = host_stats['latency'] / float(requests_count or 1)
+        result.append(row)
+    return result
+
+
+class CircuitBreaker(object):
+    """ Track consecutive failures of hooks in cache shared by all workers.
+
+        After threshold failures in a row circuit is opened and hook deliveries
+        are rejected until timeout expires.
+    """
+
+    def __init__(self, threshold, timeout):
+        self.threshold = threshold
+        self.timeout = timeout
+
+    def _get_failures_key(self, key):
+        return 'hook_delivery:failures:%s' % key
+
+    def _get_open_key(self, key):
+        return 'hook_delivery:open:%s' % key
+
+    def is_open(self, key):
+        return cache.get(self._get_open_key(key)) is not None
+
+    def record_success(self, key):
+        cache.delete(self._get_failures_key(key))
+
+    def record_failure(self, key):
+        failures_key = self._get_failures_key(key)
+        cache.add(failures_key, 0, self.timeout)
+        try:
+            failures = cache.incr(failures_key)
+        except ValueError:
+            return
+        if failures >= self.threshold:
+            logger.warning('Deliveries of hook %s are suspended for %s seconds after %s failures.',
+                           key, self.timeout, failures)
+            cache.set(self._get_open_key(key), True, self.timeout)
+            cache.delete(failures_key)
+
+
+class DeliveryEngine(object):
+    """ Deliver HTTP requests via pooled sessions and bounded thread pool """
+
+    def __init__(self, **options):
+        conf = get_settings()
+        conf.update(options)
+        self.timeout = conf['TIMEOUT']
+        self.retries = conf['RETRIES']
+        self.backoff_factor = conf['BACKOFF_FACTOR']
+        self.max_workers = conf['MAX_WORKERS']
+        self.max_requests_per_host = conf['MAX_REQUESTS_PER_HOST']
+        self.circuit_breaker = CircuitBreaker(conf['CIRCUIT_BREAKER_THRESHOLD'], conf['CIRCUIT_BREAKER_TIMEOUT'])
+
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Sessions and threads can not be shared with forked processes, for example with celery workers.
+        self._pid = os.getpid()
+        self._sessions = {}
+        self._semaphores = {}
+        self._pool = None
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
+    def get_session(self, destination):
+        """ Return session with connection pool for given destination, for example https://example.com """
+        self._check_pid()
+        with self._lock:
+            if destination not in self._sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_requests_per_host)
+                session.mount(destination, adapter)
+                self._sessions[destination] = session
+                self._semaphores[destination] = threading.BoundedSemaphore(self.max_requests_per_host)
+            return self._sessions[destination]
+
+    def post(self, url, key=None, **kwargs):
+        """ Issue POST request against URL, retry request on connection and server errors.
+
+            Key identifies receiver for circuit breaker, for example, hook.
+            DeliveryError is raised if request has not succeeded after all retries.
+        """
+        parsed_url = urlparse(url)
+        host = parsed_url.netloc
+        destination = '%s://%s' % (parsed_url.scheme, host)
+
+        if key is not None and self.circuit_breaker.is_open(key):
+            record(host, rejected=1)
+            raise CircuitOpenError('Deliveries of %s are suspended.' % key)
+
+        session = self.get_session(destination)
+        semaphore = self._semaphores[destination]
+        kwargs.setdefault('timeout', self.timeout)
+        latency = 0
+        error = None
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff_factor * 2 ** (attempt - 1))
+
+            started_at = time.time()
+            try:
+                with semaphore:
+                    response = session.post(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+                retry = True
+            except requests.RequestException as e:
+                error = e
+                retry = False
+            else:
+                if response.status_code < 400:
+                    error = None
+                    break
+                error = DeliveryError('Request has failed with status code %s.' % response.status_code)
+                retry = response.status_code in RETRY_STATUS_CODES
+            finally:
+                latency += (time.time() - started_at) * 1000
+
+            logger.info('Delivery to %s has failed (attempt %s). Error: %s', url, attempt + 1, error)
+            if not retry:
+                break
+
+        record(host, count=1, failed=int(error is not None), retries=attempt, latency=latency)
+
+        if error is not None:
+            if key is not None:
+                self.circuit_breaker.record_failure(key)
+            raise DeliveryError('Delivery to %s has failed. Error: %s' % (url, error))
+
+        if key is not None:
+            self.circuit_breaker.record_success(key)
+        logger.debug('Request to %s has been delivered in %.1f ms.', url, latency)
+        return response
+
+    def run(self, callables):
+        """ Run callables concurrently in thread pool and wait until all of them are finished.
+
+            Errors are logged, so one failed delivery does not affect others
+            and does not fail the caller, for example, Celery task.
+        """
+        if self.max_workers < 2 or len(callables) < 2:
+            for func in callables:
+                self._run_safely(func)
+            return
+
+        self._check_pid()
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.max_workers)
+            pool = self._pool
+        pool.map(self._run_in_pool_thread, callables)
+
+    def _run_in_pool_thread(self, func):
+        try:
+            self._run_safely(func)
+        finally:
+            # Django opens separate database connections in each thread, for example to load hook user.
+            connections.close_all()
+
+    def _run_safely(self, func):
+        try:
+            func()
+        except CircuitOpenError as e:
+            logger.info(e)
+        except Exception as e:
+            logger.exception('Delivery has failed. Error: %s', e)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """ Return delivery engine of current process """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = DeliveryEngine()
+    return _engine
@@ -1,6 +1,8 @@
 from django.contrib.contenttypes import models as ct_models
+from django.db import transaction
 
 from nodeconductor.logging import models
+from nodeconductor.logging.loggers import invalidate_permitted_objects_uuids, invalidate_users_permitted_objects_uuids
 
 
 def remove_related_alerts(sender, instance, **kwargs):
@@ -8,3 +10,41 @@ def remove_related_alerts(sender, instance, **kwargs):
     for alert in models.Alert.objects.filter(
             object_id=instance.id, content_type=content_type, closed__isnull=True).iterator():
         alert.close()
+
+
+def invalidate_hooks_index(sender, instance, **kwargs):
+    """ Rebuild hooks routing index after change of hook or system notification """
+    models.invalidate_hooks_index()
+    # concurrent event could rebuild index from old data before transaction is committed
+    transaction.on_commit(models.invalidate_hooks_index)
+
+
+def invalidate_permitted_objects_uuids_on_create(sender, instance, created=False, **kwargs):
+    """ Expire permitted objects UUIDs of users that can see created loggable object.
+
+        Deletion is not handled, UUID of deleted object does not give access to other objects.
+    """
+    if not created:
+        return
+    users_uuids = instance.get_permitted_users_uuids()
+    if users_uuids is None:
+        invalidate_permitted_objects_uuids()
+        transaction.on_commit(invalidate_permitted_objects_uuids)
+        return
+    users_uuids = [user_uuid.hex for user_uuid in users_uuids]
+    invalidate_users_permitted_objects_uuids(users_uuids)
+    transaction.on_commit(lambda: invalidate_users_permitted_objects_uuids(users_uuids))
+
+
+def invalidate_user_permitted_objects_uuids(sender, instance, created=False, update_fields=None, **kwargs):
+    """ Expire permitted objects UUIDs of user and hooks index on user update, for example on staff flag change.
+
+        Hooks index is expired too, because it stores hooks together with their users.
+    """
+    if created or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    user_uuid = instance.uuid.hex
+    invalidate_permitted_objects_uuids(user_uuid)
+    models.invalidate_hooks_index()
+    transaction.on_commit(lambda: invalidate_permitted_objects_uuids(user_uuid))
+    transaction.on_commit(models.invalidate_hooks_index)
@@ -3,6 +3,12 @@
 import json
 import datetime
 import logging
+import logging.handlers
+import os
+import Queue
+import socket
+import threading
+import time
 
 from celery import current_app
 
@@ -88,31 +94,435 @@ class RequireNotBackgroundTask(logging.Filter):
         return not is_background
 
 
-class TCPEventHandler(logging.handlers.SocketHandler, object):
+def are_threads_enabled():
+    """ Check if threads started by application are run.
 
-    def __init__(self, host='localhost', port=5959):
+        uWSGI does not run them unless enable-threads or threads option is set.
+    """
+    try:
+        import uwsgi
+    except ImportError:
+        return True
+    options = getattr(uwsgi, 'opt', {})
+    for option in ('enable-threads', 'threads'):
+        value = options.get(option)
+        if isinstance(value, list):
+            value = value[-1]
+        if value is True or str(value).lower() not in ('none', '', '0', 'false', 'no', 'off'):
+            return True
+    return False
+
+
+class BackgroundSendMixin(object):
+    """ Send formatted records from background thread.
+
+        Records are formatted in caller thread and put to bounded in-memory queue,
+        so logging never blocks on network. Background thread drains the queue
+        in batches of up to batch_size records or batch_bytes bytes, waiting up to
+        flush_interval seconds for batch to fill. Failed batch is retried with
+        exponential backoff, meanwhile new records are accumulated in the queue.
+
+        If the queue is full, records are handled according to overflow policy:
+        'drop' - records are dropped; 'disk' - records are appended to overflow_file
+        and resent after connection to log server is restored.
+
+        If threads are not enabled, for example in uWSGI without enable-threads
+        option, records are sent directly from caller thread.
+
+        Handler should implement `format_line` and `send_lines` methods.
+    """
+    OVERFLOW_DROP = 'drop'
+    OVERFLOW_DISK = 'disk'
+    # Delay in seconds before retry of failed batch and between checks of overflow file
+    RETRY_INTERVAL = 1
+    MAX_RETRY_INTERVAL = 60
+    # Time in seconds to wait on close for delivery of queued records
+    CLOSE_TIMEOUT = 5
+
+    def setup_queue(self, queue_size=10000, batch_size=100, batch_bytes=None, flush_interval=0,
+                    overflow=OVERFLOW_DROP, overflow_file=None):
+        if overflow not in (self.OVERFLOW_DROP, self.OVERFLOW_DISK):
+            raise ValueError('Overflow policy should be either "%s" or "%s".' % (self.OVERFLOW_DROP, self.OVERFLOW_DISK))
+        if overflow == self.OVERFLOW_DISK and not overflow_file:
+            raise ValueError('Overflow file is required for "%s" overflow policy.' % self.OVERFLOW_DISK)
+
+        self.queue_size = int(queue_size)
+        self.batch_size = int(batch_size)
+        self.batch_bytes = int(batch_bytes) if batch_bytes else None
+        self.flush_interval = float(flush_interval)
+        self.overflow = overflow
+        self.overflow_file = overflow_file
+        self.sent = 0
+        self.dropped = 0
+        self.overflowed = 0
+
+        self.queue = None
+        self._pid = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._overflow_lock = threading.Lock()
+
+    def format_line(self, record):
+        """ Return formatted record that is sent to log server """
+        raise NotImplementedError()
+
+    def send_lines(self, lines):
+        """ Send lines to log server and return lines that should be retried """
+        raise NotImplementedError()
+
+    def reset_connection(self):
+        """ Forget connection that was inherited from parent process """
+        pass
+
+    def emit(self, record):
+        try:
+            line = self.format_line(record)
+        except Exception:
+            self.handleError(record)
+            return
+
+        if self._pid != os.getpid():
+            self._start()
+        if self._thread is None:
+            self._send_directly(line)
+            return
+        try:
+            self.queue.put_nowait(line)
+        except Queue.Full:
+            self._handle_overflow([line])
+
+    def get_stats(self):
+        return {
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'overflowed': self.overflowed,
+            'queued': self.queue.qsize() if self.queue is not None else 0,
+        }
+
+    def close(self):
+        if self._pid == os.getpid() and self._thread is not None:
+            self._stop_event.set()
+            self._thread.join(self.CLOSE_TIMEOUT)
+        super(BackgroundSendMixin, self).close()
+
+    def _start(self):
+        """ Start background thread in current process, threads do not survive fork of worker processes """
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = Queue.Queue(self.queue_size)
+            self.reset_connection()
+            self._stop_event = threading.Event()
+            self._thread = None
+            if are_threads_enabled():
+                self._thread = threading.Thread(target=self._run, name=self.__class__.__name__)
+                self._thread.daemon = True
+                self._thread.start()
+            self._pid = os.getpid()
+
+    def _send_directly(self, line):
+        """ Send record without background thread, handler lock is already acquired by logging.Handler.handle """
+        retry = self.send_lines([line])
+        if retry:
+            self._handle_overflow(retry)
+        else:
+            self._resend_overflow()
+
+    def _run(self):
+        batch = []
+        failures = 0
+        while True:
+            stopping = self._stop_event.is_set()
+            batch = self._collect_batch(batch, wait=not batch and not stopping)
+
+            if not batch:
+                if stopping:
+                    return
+                self._resend_overflow()
+                continue
+
+            batch = self.send_lines(batch)
+            if not batch:
+                failures = 0
+            elif stopping:
+                while True:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except Queue.Empty:
+                        break
+                self._handle_overflow(batch)
+                return
+            else:
+                # batch is kept until log server is available, new records are accumulated in queue
+                self._stop_event.wait(min(self.RETRY_INTERVAL * 2 ** failures, self.MAX_RETRY_INTERVAL))
+                failures += 1
+
+    def _collect_batch(self, batch, wait):
+        """ Add records from queue to batch until batch is full or flush interval is over """
+        size = sum(len(line) for line in batch)
+        deadline = None
+        while len(batch) < self.batch_size and not (self.batch_bytes and size >= self.batch_bytes):
+            if batch and deadline is None:
+                deadline = time.time() + self.flush_interval
+            timeout = min(deadline - time.time(), self.RETRY_INTERVAL) if batch else self.RETRY_INTERVAL
+            # waiting is interrupted periodically to check if handler is closed
+            block = wait and timeout > 0 and not self._stop_event.is_set()
+            try:
+                line = self.queue.get(block, timeout) if block else self.queue.get_nowait()
+            except Queue.Empty:
+                if block and batch:
+                    continue
+                break
+            batch.append(line)
+            size += len(line)
+        return batch
+
+    def _handle_overflow(self, lines):
+        if self.overflow == self.OVERFLOW_DISK and self._write_overflow_file(lines):
+            self._increment('overflowed', len(lines))
+        else:
+            self._increment('dropped', len(lines))
+
+    def _write_overflow_file(self, lines):
+        try:
+            with self._overflow_lock, open(self.overflow_file, 'ab') as overflow_file:
+                overflow_file.writelines(lines)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def _read_overflow_file(self):
+        # overflow file is moved away, so emitting threads can append new records
+        resend_file = self.overflow_file + '.resend'
+        with self._overflow_lock:
+            try:
+                os.rename(self.overflow_file, resend_file)
+            except OSError:
+                return []
+        with open(resend_file, 'rb') as overflow_file:
+            lines = self.split_overflow_file(overflow_file)
+        os.remove(resend_file)
+        return lines
+
+    def split_overflow_file(self, overflow_file):
+        return overflow_file.readlines()
+
+    def _resend_overflow(self):
+        if self.overflow != self.OVERFLOW_DISK or not os.path.exists(self.overflow_file):
+            return
+        lines = self._read_overflow_file()
+        for index in range(0, len(lines), self.batch_size):
+            retry = self.send_lines(lines[index:index + self.batch_size])
+            if retry:
+                rest = retry + lines[index + self.batch_size:]
+                if not self._write_overflow_file(rest):
+                    self._increment('dropped', len(rest))
+                return
+
+    def _increment(self, counter, count):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + count)
+
+
+class TCPEventHandler(BackgroundSendMixin, logging.handlers.SocketHandler):
+    """ Send records to log server over persistent TCP connection from background thread """
+
+    def __init__(self, host='localhost', port=5959, **kwargs):
         super(TCPEventHandler, self).__init__(host, int(port))
         self.formatter = EventFormatter()
+        self.setup_queue(**kwargs)
 
     def makePickle(self, record):
         return self.formatter.format(record) + b'\n'
 
+    def format_line(self, record):
+        return self.makePickle(record)
+
+    def reset_connection(self):
+        self.sock = None
+        self.retryTime = None
+
+    def send_lines(self, lines):
+        if self.sock is None:
+            # socket creation respects exponential backoff of SocketHandler
+            self.createSocket()
+        if self.sock is None:
+            return lines
+        try:
+            self.sock.sendall(b''.join(lines))
+        except socket.error:
+            self.sock.close()
+            self.sock = None
+            return lines
+        self._increment('sent', len(lines))
+        return []
+
+
+class ElasticsearchEventHandler(BackgroundSendMixin, logging.Handler):
+    """ Index records directly to Elasticsearch using bulk API.
+
+        Connection parameters are taken from NODECONDUCTOR['ELASTICSEARCH'] setting.
+        Records are indexed to daily indexes, for example logstash-2017.07.25,
+        the same way as they are indexed by logstash, so they are found by events API.
+        Batch is retried if Elasticsearch is not available or rejects requests,
+        documents that are rejected because of bulk queue overflow are retried too.
+    """
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+    def __init__(self, index_prefix='logstash', doc_type='waldur-event',
+                 batch_size=500, batch_bytes=5 * 1024 * 1024, flush_interval=1, **kwargs):
+        super(ElasticsearchEventHandler, self).__init__()
+        self.formatter = EventFormatter()
+        self.index_prefix = index_prefix
+        self.doc_type = doc_type
+        self.client = None
+        self.setup_queue(batch_size=batch_size, batch_bytes=batch_bytes, flush_interval=flush_interval, **kwargs)
+
+    def get_index(self, record):
+        return '%s-%s' % (self.index_prefix, datetime.datetime.utcfromtimestamp(record.created).strftime('%Y.%m.%d'))
+
+    def format_line(self, record):
+        """ Return bulk API action and document separated by new line """
+        action = {'index': {'_index': self.get_index(record), '_type': self.doc_type}}
+        return json.dumps(action) + b'\n' + self.formatter.format(record) + b'\n'
+
+    def split_overflow_file(self, overflow_file):
+        """ Return action and document pairs, lines of truncated records are dropped.
+
+            Pair is accepted only if both lines are parsed, so one truncated line
+            does not break pairing of the following records.
+        """
+        lines = overflow_file.readlines()
+        records = []
+        skipped = 0
+        index = 0
+        while index < len(lines):
+            action = self._parse_line(lines[index])
+            document = self._parse_line(lines[index + 1]) if index + 1 < len(lines) else None
+            if action is not None and action.keys() == ['index'] and document is not None and 'index' not in document:
+                records.append(lines[index] + lines[index + 1])
+                index += 2
+            else:
+                skipped += 1
+                index += 1
+        # usually both lines of truncated record are skipped
+        self._increment('dropped', (skipped + 1) // 2)
+        return records
+
+    def _parse_line(self, line):
+        if not line.endswith(b'\n'):
+            return None
+        try:
+            value = json.loads(line)
+        except ValueError:
+            return None
+        return value if isinstance(value, dict) else None
+
+    def reset_connection(self):
+        self.client = None
+
+    def send_lines(self, lines):
+        from elasticsearch import TransportError
+        from nodeconductor.logging.elasticsearch_client import ElasticsearchClient, ElasticsearchClientError
+
+        try:
+            if self.client is None:
+                self.client = ElasticsearchClient().client
+            response = self.client.bulk(body=b''.join(lines))
+        except ElasticsearchClientError:
+            return lines
+        except TransportError as e:
+            # Connection errors have status code 'N/A'
+            if not isinstance(e.status_code, int) or e.status_code in self.RETRY_STATUS_CODES:
+                return lines
+            self._increment('dropped', len(lines))
+            return []
+
+        retry = []
+        failed = 0
+        if response.get('errors'):
+            for line, item in zip(lines, response['items']):
+                status_code = item.values()[0].get('status', 200)
+                if status_code in self.RETRY_STATUS_CODES:
+                    retry.append(line)
+                elif status_code >= 300:
+                    failed += 1
+        self._increment('sent', len(lines) - len(retry) - failed)
+        self._increment('dropped', failed)
+        return retry
+
+
+class HookHandler(logging.handlers.BufferingHandler, object):
+    """ Send events to hooks processing in background.
+
+        If batch_size is greater than 1 events are buffered in process and sent as one
+        process_events_batch task when batch is full or flush_interval seconds passed
+        since the first buffered event. Buffer is flushed on close, that is on process exit,
+        including exit of Celery worker process. If threads are not enabled, timer cannot
+        run, so events are sent one by one.
+    """
+
+    def __init__(self, batch_size=1, flush_interval=2):
+        super(HookHandler, self).__init__(int(batch_size))
+        self.flush_interval = float(flush_interval)
+        self.timer = None
+        self._pid = os.getpid()
 
-class HookHandler(logging.Handler):
     def emit(self, record):
         # Check that record contains event
-        if hasattr(record, 'event_type') and hasattr(record, 'event_context'):
-
-            # Convert record to plain dictionary
-            event = {
-                'timestamp': record.created,
-                'levelname': record.levelname,
-                'message': record.getMessage(),
-                'type': record.event_type,
-                'context': record.event_context
-            }
-            # XXX: This import provides circular dependencies between core and
-            #      logging applications.
-            from nodeconductor.core.tasks import send_task
-            # Perform hook processing in background thread
-            send_task('logging', 'process_event')(event)
+        if not hasattr(record, 'event_type') or not hasattr(record, 'event_context'):
+            return
+
+        # Convert record to plain dictionary
+        event = {
+            'timestamp': record.created,
+            'levelname': record.levelname,
+            'message': record.getMessage(),
+            'type': record.event_type,
+            'context': record.event_context
+        }
+        if self.capacity <= 1 or not are_threads_enabled():
+            self.send_task('process_event', event)
+            return
+
+        # handler lock is already acquired by logging.Handler.handle
+        self._check_pid()
+        self.buffer.append(event)
+        if self.shouldFlush(record):
+            self.flush()
+        elif self.timer is None:
+            self.timer = threading.Timer(self.flush_interval, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        self.acquire()
+        try:
+            self._check_pid()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            events, self.buffer = self.buffer, []
+        finally:
+            self.release()
+        if events:
+            self.send_task('process_events_batch', events)
+
+    def _check_pid(self):
+        """ Forget buffer and timer inherited from parent process, timer thread does not survive fork.
+
+            Buffered events are sent by parent process. Handler lock should be acquired.
+        """
+        if self._pid != os.getpid():
+            self.buffer = []
+            self.timer = None
+            self._pid = os.getpid()
+
+    def send_task(self, task_name, *args):
+        # XXX: This import provides circular dependencies between core and
+        #      logging applications.
+        from nodeconductor.core.tasks import send_task
+        # Perform hook processing in background thread
+        send_task('logging', task_name)(*args)
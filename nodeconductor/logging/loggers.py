@@ -10,6 +10,7 @@ from collections import defaultdict
 
 from django.apps import apps
 from django.contrib.contenttypes import models as ct_models
+from django.core.cache import cache
 from django.db import transaction, IntegrityError
 from django.utils import six
 
@@ -325,6 +326,13 @@ class LoggableMixin(object):
     def get_log_fields(self):
         return ('uuid', 'name')
 
+    def get_permitted_users_uuids(self):
+        """ Return UUIDs of users whose permitted objects include object or None if they are not known """
+        if type(self).get_permitted_objects_uuids.__func__ is LoggableMixin.get_permitted_objects_uuids.__func__:
+            # objects of model are not included to permitted objects
+            return []
+        return None
+
     def filter_by_logged_object(self):
         """
         Return query dictionary to search current object in ElasticSearch.
@@ -411,6 +419,20 @@ class EventLoggerRegistry(BaseLoggerRegistry):
                 permitted_objects_uuids[field] = [uuid.hex for uuid in uuids]
         return permitted_objects_uuids
 
+    def get_cached_permitted_objects_uuids(self, user):
+        """ Return permitted objects UUIDs as sets: {field: set of UUIDs}.
+
+            Result is cached until roles of user are changed or
+            loggable object that is visible to user is created.
+        """
+        cache_key = _get_permitted_objects_uuids_cache_key(user)
+        permitted_objects_uuids = cache.get(cache_key)
+        if permitted_objects_uuids is None:
+            permitted_objects_uuids = {field: set(uuids) for field, uuids
+                                       in self.get_permitted_objects_uuids(user).items()}
+            cache.set(cache_key, permitted_objects_uuids, PERMITTED_OBJECTS_UUIDS_CACHE_TIMEOUT)
+        return permitted_objects_uuids
+
 
 class AlertLoggerRegistry(BaseLoggerRegistry):
 
@@ -418,6 +440,37 @@ class AlertLoggerRegistry(BaseLoggerRegistry):
         return [l for l in self.__dict__.values() if isinstance(l, AlertLogger)]
 
 
+PERMITTED_OBJECTS_UUIDS_CACHE_TIMEOUT = 60 * 60
+
+
+def _get_permitted_objects_uuids_version_key(user_uuid=None):
+    if user_uuid is None:
+        return 'logging:permitted_objects_uuids_version'
+    return 'logging:permitted_objects_uuids_version:%s' % user_uuid
+
+
+def _get_permitted_objects_uuids_cache_key(user):
+    """ Cache key depends on global and user versions, so it changes after invalidation """
+    version_keys = [_get_permitted_objects_uuids_version_key(), _get_permitted_objects_uuids_version_key(user.uuid.hex)]
+    versions = cache.get_many(version_keys)
+    missing_versions = {key: uuid.uuid4().hex for key in version_keys if key not in versions}
+    if missing_versions:
+        cache.set_many(missing_versions, timeout=None)
+        versions.update(missing_versions)
+    return 'logging:permitted_objects_uuids:%s:%s' % (user.uuid.hex, ':'.join(versions[key] for key in version_keys))
+
+
+def invalidate_permitted_objects_uuids(user_uuid=None):
+    """ Expire cached permitted objects UUIDs of given user or of all users if user is not specified """
+    cache.set(_get_permitted_objects_uuids_version_key(user_uuid), uuid.uuid4().hex, timeout=None)
+
+
+def invalidate_users_permitted_objects_uuids(users_uuids):
+    """ Expire cached permitted objects UUIDs of given users """
+    versions = {_get_permitted_objects_uuids_version_key(user_uuid): uuid.uuid4().hex for user_uuid in users_uuids}
+    cache.set_many(versions, timeout=None)
+
+
 def get_valid_events():
     return event_logger.get_all_types()
 
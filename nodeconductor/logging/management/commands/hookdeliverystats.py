@@ -0,0 +1,24 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+import prettytable
+
+from nodeconductor.logging import delivery
+
+
+class Command(BaseCommand):
+    help = "Print statistics of hooks HTTP delivery per host. Latency is measured in milliseconds."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=delivery.WINDOWS_COUNT,
+                            help='Number of last hours to collect statistics for.')
+
+    def handle(self, *args, **options):
+        hours = min(max(options['hours'], 1), delivery.WINDOWS_COUNT)
+        stats = delivery.get_stats(windows_count=hours)
+
+        table = prettytable.PrettyTable(['Host', 'Deliveries', 'Failed', 'Retries', 'Rejected', 'Avg latency'])
+        for row in stats:
+            table.add_row([row['host'], row['count'], row['failed'], row['retries'], row['rejected'],
+                           '%.1f' % row['avg_latency']])
+        self.stdout.write(table.get_string())
@@ -1,6 +1,5 @@
 from django.contrib.contenttypes import models as ct_models
 from django.db import models
-from django.db.models import Q
 
 
 # XXX: This manager are very similar with quotas manager
@@ -13,15 +12,9 @@ class AlertManager(models.Manager):
             queryset = self.get_queryset()
         # XXX: This circular dependency will be removed then filter_queryset_for_user
         # will be moved to model manager method
-        from nodeconductor.structure.managers import filter_queryset_for_user
+        from nodeconductor.structure.managers import get_generic_query_for_user
 
-        query = Q()
-        for model in utils.get_loggable_models():
-            user_object_ids = filter_queryset_for_user(model.objects.all(), user).values_list('id', flat=True)
-            content_type_id = ct_models.ContentType.objects.get_for_model(model).id
-            query |= Q(object_id__in=user_object_ids, content_type_id=content_type_id)
-
-        return queryset.filter(query)
+        return queryset.filter(get_generic_query_for_user(user, utils.get_loggable_models()))
 
     def for_objects(self, qs):
         kwargs = dict(
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logging', '0010_add_event_groups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailhook',
+            name='batch_events',
+            field=models.BooleanField(default=False, help_text='Deliver events of one batch together if hook supports batched payloads.'),
+        ),
+        migrations.AddField(
+            model_name='pushhook',
+            name='batch_events',
+            field=models.BooleanField(default=False, help_text='Deliver events of one batch together if hook supports batched payloads.'),
+        ),
+        migrations.AddField(
+            model_name='webhook',
+            name='batch_events',
+            field=models.BooleanField(default=False, help_text='Deliver events of one batch together if hook supports batched payloads.'),
+        ),
+    ]
@@ -2,23 +2,24 @@ from __future__ import unicode_literals
 
 import uuid
 import logging
+from collections import defaultdict
 
 from django.apps import apps
 from django.conf import settings
 from django.contrib.contenttypes import fields as ct_fields
 from django.contrib.contenttypes import models as ct_models
 from django.core import validators
+from django.core.cache import cache
 from django.core.mail import send_mail
 from django.db import models
 from django.template.loader import render_to_string
 from django.utils.lru_cache import lru_cache
 from django.utils import timezone
 from model_utils.models import TimeStampedModel
-import requests
 
 from nodeconductor.core.fields import JSONField, UUIDField
 from nodeconductor.core.utils import timestamp_to_datetime
-from nodeconductor.logging import managers
+from nodeconductor.logging import delivery, managers
 
 
 logger = logging.getLogger(__name__)
@@ -130,6 +131,8 @@ class BaseHook(EventTypesMixin, UuidMixin, TimeStampedModel):
 
     # This timestamp would be updated periodically when event is sent via this hook
     last_published = models.DateTimeField(default=timezone.now)
+    batch_events = models.BooleanField(
+        default=False, help_text='Deliver events of one batch together if hook supports batched payloads.')
 
     @property
     def all_event_types(self):
@@ -142,10 +145,49 @@ class BaseHook(EventTypesMixin, UuidMixin, TimeStampedModel):
         else:
             return self_types | set(base_types.event_types)
 
+    def process_batch(self, events):
+        """ Process events that were delivered in one batch.
+
+            Hooks that support batched payloads override this method.
+        """
+        for event in events:
+            self.process(event)
+
+    @property
+    def delivery_key(self):
+        """ Identifier of hook for delivery circuit breaker """
+        return '%s:%s' % (self._meta.model_name, self.uuid.hex)
+
     @classmethod
     def get_active_hooks(cls):
         return [obj for hook in cls.__subclasses__() for obj in hook.objects.filter(is_active=True)]
 
+    @classmethod
+    def get_hooks_for_event_type(cls, event_type):
+        """ Return active hooks that are subscribed to given event type.
+
+            Hooks are looked up in routing index that is kept in process memory
+            and rebuilt only after change of hooks or system notifications.
+        """
+        version = _get_hooks_index_version()
+        if _hooks_index['version'] != version:
+            _hooks_index['hooks'] = cls._build_hooks_index()
+            _hooks_index['version'] = version
+        return _hooks_index['hooks'].get(event_type, [])
+
+    @classmethod
+    def _build_hooks_index(cls):
+        """ Map each event type to active hooks with one query per hook model """
+        system_event_types = {notification.hook_content_type_id: set(notification.event_types)
+                              for notification in SystemNotification.objects.all()}
+        index = defaultdict(list)
+        for model in cls.__subclasses__():
+            content_type = ct_models.ContentType.objects.get_for_model(model)
+            for hook in model.objects.filter(is_active=True).select_related('user'):
+                for event_type in set(hook.event_types) | system_event_types.get(content_type.id, set()):
+                    index[event_type].append(hook)
+        return dict(index)
+
     @classmethod
     @lru_cache(maxsize=1)
     def get_all_models(cls):
@@ -175,11 +217,22 @@ class WebHook(BaseHook):
 
         # encode event as JSON
         if self.content_type == WebHook.ContentTypeChoices.JSON:
-            requests.post(self.destination_url, json=event, verify=settings.VERIFY_WEBHOOK_REQUESTS)
+            self._post(json=event)
 
         # encode event as form
         elif self.content_type == WebHook.ContentTypeChoices.FORM:
-            requests.post(self.destination_url, data=event, verify=settings.VERIFY_WEBHOOK_REQUESTS)
+            self._post(data=event)
+
+    def process_batch(self, events):
+        """ Submit events as JSON array, form encoded events are submitted one by one """
+        if not self.batch_events or self.content_type != WebHook.ContentTypeChoices.JSON:
+            return super(WebHook, self).process_batch(events)
+        logger.debug('Submitting web hook to URL %s, batch of %s events', self.destination_url, len(events))
+        self._post(json=events)
+
+    def _post(self, **kwargs):
+        delivery.get_engine().post(
+            self.destination_url, key=self.delivery_key, verify=settings.VERIFY_WEBHOOK_REQUESTS, **kwargs)
 
 
 class PushHook(BaseHook):
@@ -239,20 +292,49 @@ class PushHook(BaseHook):
         if self.type == self.Type.IOS:
             payload['content-available'] = '1'
         logger.debug('Submitting GCM push notification with headers %s, payload: %s' % (headers, payload))
-        requests.post(endpoint, json=payload, headers=headers)
+        delivery.get_engine().post(endpoint, key=self.delivery_key, json=payload, headers=headers)
 
 
 class EmailHook(BaseHook):
     email = models.EmailField(max_length=75)
 
     def process(self, event):
+        self._send_events([event])
+
+    def process_batch(self, events):
+        """ Send one digest with all events of batch """
+        if not self.batch_events:
+            return super(EmailHook, self).process_batch(events)
+        self._send_events(events)
+
+    def _send_events(self, events):
         subject = 'Notifications from NodeConductor'
-        event['timestamp'] = timestamp_to_datetime(event['timestamp'])
-        text_message = event['message']
-        html_message = render_to_string('logging/email.html', {'events': [event]})
-        logger.debug('Submitting email hook to %s, payload: %s', self.email, event)
+        # events are shared between hooks, so they should not be modified
+        events = [dict(event, timestamp=timestamp_to_datetime(event['timestamp'])) for event in events]
+        text_message = '\n'.join(event['message'] for event in events)
+        html_message = render_to_string('logging/email.html', {'events': events})
+        logger.debug('Submitting email hook to %s, payload: %s', self.email, events)
         send_mail(subject, text_message, settings.DEFAULT_FROM_EMAIL, [self.email], html_message=html_message)
 
 
 class SystemNotification(EventTypesMixin, models.Model):
     hook_content_type = models.OneToOneField(ct_models.ContentType, related_name='+')
+
+
+HOOKS_INDEX_VERSION_KEY = 'logging:hooks_index_version'
+
+# Routing index of current process: {'version': index version, 'hooks': {event type: [hooks]}}
+_hooks_index = {'version': None, 'hooks': {}}
+
+
+def _get_hooks_index_version():
+    version = cache.get(HOOKS_INDEX_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(HOOKS_INDEX_VERSION_KEY, version, timeout=None)
+    return version
+
+
+def invalidate_hooks_index():
+    """ Force all processes to rebuild hooks routing index on next event """
+    cache.set(HOOKS_INDEX_VERSION_KEY, uuid.uuid4().hex, timeout=None)
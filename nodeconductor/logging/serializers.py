@@ -58,7 +58,7 @@ class BaseHookSerializer(serializers.HyperlinkedModelSerializer):
         fields = (
             'url', 'uuid', 'is_active', 'author_uuid',
             'event_types', 'event_groups', 'created', 'modified',
-            'hook_type'
+            'hook_type', 'batch_events'
         )
 
         extra_kwargs = {
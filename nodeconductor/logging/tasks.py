@@ -1,9 +1,12 @@
+import functools
 import logging
+from collections import OrderedDict
 
 from celery import shared_task
 from django.conf import settings
 from django.utils import timezone
 
+from nodeconductor.logging import delivery
 from nodeconductor.logging.loggers import alert_logger, event_logger
 from nodeconductor.logging.models import BaseHook, Alert, AlertThresholdMixin
 
@@ -13,16 +16,31 @@ logger = logging.getLogger(__name__)
 
 @shared_task(name='nodeconductor.logging.process_event')
 def process_event(event):
-    for hook in BaseHook.get_active_hooks():
-        if check_event(event, hook):
-            hook.process(event)
+    hooks = [hook for hook in BaseHook.get_hooks_for_event_type(event['type']) if check_event(event, hook)]
+    # hooks are processed concurrently, so slow receiver does not delay others
+    delivery.get_engine().run([functools.partial(hook.process, event) for hook in hooks])
+
+
+@shared_task(name='nodeconductor.logging.process_events_batch')
+def process_events_batch(events):
+    """ Process events that were buffered by hook handler.
+
+        Events are grouped by hook, so hooks that support batched payloads
+        deliver all their events of batch at once.
+    """
+    hooks_events = OrderedDict()
+    for event in events:
+        for hook in BaseHook.get_hooks_for_event_type(event['type']):
+            if check_event(event, hook):
+                hooks_events.setdefault(hook, []).append(event)
+    delivery.get_engine().run([functools.partial(hook.process_batch, hook_events)
+                               for hook, hook_events in hooks_events.items()])
 
 
 def check_event(event, hook):
-    # Check that event matches with hook
-    if event['type'] not in hook.all_event_types:
-        return False
-    for key, uuids in event_logger.get_permitted_objects_uuids(hook.user).items():
+    # Check that hook user has access to event objects.
+    # Hooks are already filtered by event type using routing index.
+    for key, uuids in event_logger.get_cached_permitted_objects_uuids(hook.user).items():
         if key in event['context'] and event['context'][key] in uuids:
             return True
     return False
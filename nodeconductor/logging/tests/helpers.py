@@ -0,0 +1,13 @@
+from __future__ import unicode_literals
+
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """ Stand-in HTTP server that handles each request in separate thread """
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # client closes connection on timeout before response is written
+        pass
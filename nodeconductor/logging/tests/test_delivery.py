@@ -0,0 +1,150 @@
+from __future__ import unicode_literals
+
+import json
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler
+
+from django.core.cache import cache
+from django.test import TestCase
+import mock
+
+from nodeconductor.logging import delivery
+from nodeconductor.logging.tests.helpers import ThreadingHTTPServer
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """ Respond with configured status codes and remember received payloads """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.getheader('content-length', 0)))
+        with server.lock:
+            server.payloads.append(json.loads(body))
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            status = server.statuses.pop(0) if server.statuses else 200
+        time.sleep(server.delay)
+        with server.lock:
+            server.active -= 1
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class DeliveryEngineTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.lock = threading.Lock()
+        self.server.payloads = []
+        self.server.statuses = []
+        self.server.delay = 0
+        self.server.active = self.server.max_active = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%s/hook/' % self.server.server_port
+        self.host = '127.0.0.1:%s' % self.server.server_port
+        self.engine = delivery.DeliveryEngine(
+            RETRIES=2, BACKOFF_FACTOR=0, CIRCUIT_BREAKER_THRESHOLD=2, MAX_REQUESTS_PER_HOST=2)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_payloads_are_delivered_via_one_session(self):
+        self.engine.post(self.url, json={'message': 'first'})
+        self.engine.post(self.url, json={'message': 'second'})
+
+        self.assertEqual(self.server.payloads, [{'message': 'first'}, {'message': 'second'}])
+        self.assertEqual(len(self.engine._sessions), 1)
+
+    def test_request_is_retried_on_server_error(self):
+        self.server.statuses = [503, 500]
+
+        self.engine.post(self.url, json={'message': 'test'})
+
+        self.assertEqual(len(self.server.payloads), 3)
+        stats = delivery.get_stats()[0]
+        self.assertEqual((stats['host'], stats['count'], stats['failed'], stats['retries']), (self.host, 1, 0, 2))
+
+    def test_request_is_not_retried_on_client_error(self):
+        self.server.statuses = [400]
+
+        with self.assertRaises(delivery.DeliveryError):
+            self.engine.post(self.url, json={'message': 'test'})
+
+        self.assertEqual(len(self.server.payloads), 1)
+
+    def test_request_fails_on_timeout(self):
+        self.server.delay = 0.5
+        engine = delivery.DeliveryEngine(TIMEOUT=0.1, RETRIES=0)
+
+        with self.assertRaises(delivery.DeliveryError):
+            engine.post(self.url, json={'message': 'test'})
+
+    def test_deliveries_are_rejected_after_consecutive_failures(self):
+        self.server.statuses = [400, 400]
+        for _ in range(2):
+            with self.assertRaises(delivery.DeliveryError):
+                self.engine.post(self.url, key='webhook:1', json={'message': 'test'})
+
+        with self.assertRaises(delivery.CircuitOpenError):
+            self.engine.post(self.url, key='webhook:1', json={'message': 'test'})
+
+        self.assertEqual(len(self.server.payloads), 2)
+        self.assertEqual(delivery.get_stats()[0]['rejected'], 1)
+        # other receivers are not affected
+        self.engine.post(self.url, key='webhook:2', json={'message': 'test'})
+
+    def test_concurrent_requests_to_host_are_limited(self):
+        self.server.delay = 0.05
+        callables = [lambda index=index: self.engine.post(self.url, json={'index': index}) for index in range(6)]
+
+        self.engine.run(callables)
+
+        self.assertEqual(sorted(payload['index'] for payload in self.server.payloads), range(6))
+        self.assertEqual(self.server.max_active, 2)
+
+    def test_failed_delivery_is_logged_and_does_not_affect_others(self):
+        def fail():
+            raise ValueError('Delivery has failed.')
+
+        callables = [fail, lambda: self.engine.post(self.url, json={'message': 'test'})]
+
+        with mock.patch.object(delivery.logger, 'exception') as mocked_exception:
+            self.engine.run(callables)
+
+        self.assertEqual(mocked_exception.call_count, 1)
+        self.assertEqual(len(self.server.payloads), 1)
+
+    def test_database_connections_of_pool_threads_are_closed(self):
+        # in-memory SQLite connections are never closed, so check that pool threads close their connections
+        threads = []
+        closing_threads = []
+
+        def use_database():
+            threads.append(threading.current_thread())
+
+        with mock.patch.object(delivery.connections, 'close_all',
+                               side_effect=lambda: closing_threads.append(threading.current_thread())):
+            self.engine.run([use_database, use_database])
+
+        self.assertEqual(len(closing_threads), 2)
+        self.assertEqual(sorted(closing_threads), sorted(threads))
+        self.assertNotIn(threading.current_thread(), closing_threads)
+
+    def test_hosts_of_window_are_recorded_once(self):
+        delivery.record(self.host, count=1)
+        delivery.record(self.host, count=1)
+
+        stats = delivery.get_stats()
+
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0]['count'], 2)
@@ -1,14 +1,18 @@
 import logging
+import os
 import mock
 import time
+import weakref
 
+from celery.signals import worker_process_shutdown
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.core import mail
 from rest_framework import test
 
-from nodeconductor.logging import models as logging_models
+from nodeconductor.logging import loggers, models as logging_models
 from nodeconductor.logging.log import HookHandler
-from nodeconductor.logging.tasks import process_event
+from nodeconductor.logging.tasks import process_event, process_events_batch
 from nodeconductor.structure import models as structure_models
 from nodeconductor.structure.log import event_logger
 from nodeconductor.structure.tests import factories as structure_factories
@@ -79,7 +83,7 @@ class TestHookService(test.APITransactionTestCase):
         # Verify that destination address of message is correct
         self.assertEqual(mail.outbox[0].to, [email_hook.email])
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post', return_value=mock.Mock(status_code=200))
     def test_webhook_makes_post_request_against_destination_url(self, requests_post):
 
         # Create web hook for customer owner
@@ -92,4 +96,225 @@ class TestHookService(test.APITransactionTestCase):
 
         # Event is captured and POST request is triggererd because event_type and user_uuid match
         requests_post.assert_called_once_with(
-            self.web_hook.destination_url, json=mock.ANY, verify=settings.VERIFY_WEBHOOK_REQUESTS)
+            self.web_hook.destination_url, json=mock.ANY, verify=settings.VERIFY_WEBHOOK_REQUESTS, timeout=mock.ANY)
+
+    def test_event_is_matched_without_queries_after_first_processing(self):
+        logging_models.EmailHook.objects.create(user=self.owner, email=self.owner.email, event_types=[self.event_type])
+        process_event(self.event)
+
+        with self.assertNumQueries(0):
+            process_event(self.event)
+
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_hook_is_not_processed_after_deactivation(self):
+        email_hook = logging_models.EmailHook.objects.create(
+            user=self.owner, email=self.owner.email, event_types=[self.event_type])
+        process_event(self.event)
+
+        email_hook.is_active = False
+        email_hook.save()
+        process_event(self.event)
+
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_hook_receives_event_types_of_system_notification(self):
+        logging_models.EmailHook.objects.create(user=self.owner, email=self.owner.email, event_types=[])
+        process_event(self.event)
+        self.assertEqual(len(mail.outbox), 0)
+
+        logging_models.SystemNotification.objects.create(
+            hook_content_type=ContentType.objects.get_for_model(logging_models.EmailHook),
+            event_types=[self.event_type])
+        process_event(self.event)
+
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_event_is_not_sent_after_role_revoke(self):
+        logging_models.EmailHook.objects.create(user=self.owner, email=self.owner.email, event_types=[self.event_type])
+        process_event(self.event)
+
+        self.customer.remove_user(self.owner, structure_models.CustomerRole.OWNER)
+        process_event(self.event)
+
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_permitted_objects_of_related_users_are_expired_on_object_creation(self):
+        staff = structure_factories.UserFactory(is_staff=True)
+        users = [self.owner, self.other_user, staff]
+        cache_keys = [loggers._get_permitted_objects_uuids_cache_key(user) for user in users]
+
+        structure_factories.ProjectFactory(customer=self.customer)
+
+        owner_key, other_user_key, staff_key = [loggers._get_permitted_objects_uuids_cache_key(user) for user in users]
+        self.assertNotEqual(owner_key, cache_keys[0])
+        self.assertEqual(other_user_key, cache_keys[1])
+        self.assertNotEqual(staff_key, cache_keys[2])
+
+    def test_permitted_objects_are_not_expired_on_creation_of_object_without_permissions(self):
+        cache_key = loggers._get_permitted_objects_uuids_cache_key(self.owner)
+
+        structure_factories.ServiceSettingsFactory()
+
+        self.assertEqual(loggers._get_permitted_objects_uuids_cache_key(self.owner), cache_key)
+
+    def test_permitted_objects_of_all_users_are_expired_if_users_of_object_are_unknown(self):
+        cache_key = loggers._get_permitted_objects_uuids_cache_key(self.other_user)
+
+        with mock.patch.object(structure_models.Project, 'get_permitted_users_uuids', return_value=None):
+            structure_factories.ProjectFactory(customer=self.customer)
+
+        self.assertNotEqual(loggers._get_permitted_objects_uuids_cache_key(self.other_user), cache_key)
+
+
+class TestHookBatching(test.APITransactionTestCase):
+    def setUp(self):
+        self.owner = structure_factories.UserFactory()
+        self.customer = structure_factories.CustomerFactory()
+        self.customer.add_user(self.owner, structure_models.CustomerRole.OWNER)
+        self.event_type = 'customer_update_succeeded'
+        self.events = [{
+            'message': 'Customer %s has been updated.' % index,
+            'type': self.event_type,
+            'context': event_logger.customer.compile_context(customer=self.customer),
+            'timestamp': time.time()
+        } for index in range(3)]
+
+        self.logger = logging.getLogger('nodeconductor')
+        self.logger.setLevel(logging.DEBUG)
+
+    def emit_events(self, count):
+        for _ in range(count):
+            event_logger.customer.warning('Customer {customer_name} has been updated.',
+                                          event_type=self.event_type,
+                                          event_context={'customer': self.customer})
+
+    @mock.patch('celery.app.base.Celery.send_task')
+    def test_events_are_sent_in_one_task_when_batch_is_full(self, mocked_task):
+        handler = HookHandler(batch_size=3, flush_interval=60)
+        self.logger.addHandler(handler)
+        try:
+            self.emit_events(2)
+            self.assertFalse(mocked_task.called)
+            self.emit_events(1)
+        finally:
+            self.logger.removeHandler(handler)
+            handler.close()
+
+        mocked_task.assert_called_once_with('nodeconductor.logging.process_events_batch', mock.ANY, {}, countdown=2)
+        events = mocked_task.call_args[0][1][0]
+        self.assertEqual(len(events), 3)
+
+    @mock.patch('celery.app.base.Celery.send_task')
+    def test_events_are_sent_after_flush_interval(self, mocked_task):
+        handler = HookHandler(batch_size=100, flush_interval=0.01)
+        self.logger.addHandler(handler)
+        try:
+            self.emit_events(2)
+            for _ in range(100):
+                if mocked_task.called:
+                    break
+                time.sleep(0.01)
+        finally:
+            self.logger.removeHandler(handler)
+            handler.close()
+
+        mocked_task.assert_called_once_with('nodeconductor.logging.process_events_batch', mock.ANY, {}, countdown=2)
+        self.assertEqual(len(mocked_task.call_args[0][1][0]), 2)
+
+    @mock.patch('celery.app.base.Celery.send_task')
+    def test_buffered_events_are_sent_on_close(self, mocked_task):
+        handler = HookHandler(batch_size=3, flush_interval=60)
+        self.logger.addHandler(handler)
+        try:
+            self.emit_events(2)
+            timer = handler.timer
+        finally:
+            self.logger.removeHandler(handler)
+            handler.close()
+
+        self.assertIsNone(handler.timer)
+        self.assertTrue(timer.finished.is_set())
+        mocked_task.assert_called_once_with('nodeconductor.logging.process_events_batch', mock.ANY, {}, countdown=2)
+        self.assertEqual(len(mocked_task.call_args[0][1][0]), 2)
+
+    @mock.patch('celery.app.base.Celery.send_task')
+    def test_buffered_events_are_sent_on_worker_process_shutdown(self, mocked_task):
+        handler = HookHandler(batch_size=3, flush_interval=60)
+        self.logger.addHandler(handler)
+        try:
+            self.emit_events(2)
+            # other handlers of test process should not be closed
+            with mock.patch.object(logging, '_handlerList', [weakref.ref(handler)]):
+                worker_process_shutdown.send(sender=None, pid=os.getpid(), exitcode=0)
+        finally:
+            self.logger.removeHandler(handler)
+            handler.close()
+
+        mocked_task.assert_called_once_with('nodeconductor.logging.process_events_batch', mock.ANY, {}, countdown=2)
+
+    @mock.patch('nodeconductor.logging.log.are_threads_enabled', return_value=False)
+    @mock.patch('celery.app.base.Celery.send_task')
+    def test_events_are_sent_one_by_one_if_threads_are_not_enabled(self, mocked_task, mocked_are_threads_enabled):
+        handler = HookHandler(batch_size=3, flush_interval=60)
+        self.logger.addHandler(handler)
+        try:
+            self.emit_events(2)
+            self.assertIsNone(handler.timer)
+        finally:
+            self.logger.removeHandler(handler)
+            handler.close()
+
+        self.assertEqual(mocked_task.call_count, 2)
+        mocked_task.assert_called_with('nodeconductor.logging.process_event', mock.ANY, {}, countdown=2)
+
+    @mock.patch('celery.app.base.Celery.send_task')
+    def test_events_buffered_by_parent_process_are_not_sent_by_child(self, mocked_task):
+        handler = HookHandler(batch_size=3, flush_interval=60)
+        self.logger.addHandler(handler)
+        try:
+            self.emit_events(2)
+            parent_timer = handler.timer
+            # emulate forked process
+            with mock.patch('os.getpid', return_value=os.getpid() + 1):
+                self.emit_events(1)
+                self.assertFalse(mocked_task.called)
+                self.assertIsNot(handler.timer, parent_timer)
+                self.assertEqual(len(handler.buffer), 1)
+                handler.flush()
+        finally:
+            parent_timer.cancel()
+            self.logger.removeHandler(handler)
+            handler.close()
+
+        mocked_task.assert_called_once_with('nodeconductor.logging.process_events_batch', mock.ANY, {}, countdown=2)
+        self.assertEqual(len(mocked_task.call_args[0][1][0]), 1)
+
+    @mock.patch('requests.Session.post', return_value=mock.Mock(status_code=200))
+    def test_webhook_posts_batch_as_json_array(self, requests_post):
+        web_hook = logging_models.WebHook.objects.create(
+            user=self.owner, destination_url='http://example.com/', event_types=[self.event_type], batch_events=True)
+
+        process_events_batch(self.events)
+
+        requests_post.assert_called_once_with(
+            web_hook.destination_url, json=self.events, verify=settings.VERIFY_WEBHOOK_REQUESTS, timeout=mock.ANY)
+
+    @mock.patch('requests.Session.post', return_value=mock.Mock(status_code=200))
+    def test_webhook_posts_events_one_by_one_if_batches_are_not_enabled(self, requests_post):
+        logging_models.WebHook.objects.create(
+            user=self.owner, destination_url='http://example.com/', event_types=[self.event_type])
+
+        process_events_batch(self.events)
+
+        self.assertEqual(requests_post.call_count, 3)
+
+    def test_email_hook_sends_digest(self):
+        logging_models.EmailHook.objects.create(
+            user=self.owner, email=self.owner.email, event_types=[self.event_type], batch_events=True)
+
+        process_events_batch(self.events)
+
+        self.assertEqual(len(mail.outbox), 1)
+        for event in self.events:
+            self.assertIn(event['message'], mail.outbox[0].body)
@@ -0,0 +1,251 @@
+from __future__ import unicode_literals
+
+import datetime
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler
+from SocketServer import StreamRequestHandler, ThreadingTCPServer
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+import mock
+
+from nodeconductor.logging.log import ElasticsearchEventHandler, TCPEventHandler, are_threads_enabled
+from nodeconductor.logging.tests.helpers import ThreadingHTTPServer
+
+
+class LinesHandler(StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            with self.server.lock:
+                self.server.lines.append(json.loads(line))
+
+
+class TCPEventHandlerTest(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingTCPServer(('127.0.0.1', 0), LinesHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.lines = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.port = self.server.server_address[1]
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def make_record(self, message):
+        return logging.LogRecord('nodeconductor', logging.INFO, __file__, 1, message, None, None)
+
+    def wait_for_lines(self, count):
+        for _ in range(100):
+            if len(self.server.lines) >= count:
+                break
+            time.sleep(0.01)
+        return [line['message'] for line in self.server.lines]
+
+    def test_records_are_sent_from_background_thread(self):
+        handler = TCPEventHandler(port=self.port, batch_size=2)
+        for index in range(5):
+            handler.emit(self.make_record('Event %s' % index))
+        handler.close()
+
+        self.assertEqual(self.wait_for_lines(5), ['Event %s' % index for index in range(5)])
+        self.assertEqual(handler.get_stats(), {'sent': 5, 'dropped': 0, 'overflowed': 0, 'queued': 0})
+
+    @mock.patch.object(TCPEventHandler, '_run')
+    def test_records_are_dropped_if_queue_is_full(self, mocked_run):
+        handler = TCPEventHandler(port=self.port, queue_size=2)
+        for index in range(5):
+            handler.emit(self.make_record('Event %s' % index))
+
+        self.assertEqual(handler.get_stats(), {'sent': 0, 'dropped': 3, 'overflowed': 0, 'queued': 2})
+        handler.close()
+
+    @mock.patch.object(TCPEventHandler, '_run')
+    def test_overflowed_records_are_resent_from_disk(self, mocked_run):
+        overflow_file = os.path.join(self.tmp_dir, 'events.overflow')
+        handler = TCPEventHandler(port=self.port, queue_size=1, overflow='disk', overflow_file=overflow_file)
+        for index in range(3):
+            handler.emit(self.make_record('Event %s' % index))
+        self.assertEqual(handler.get_stats()['overflowed'], 2)
+
+        handler._resend_overflow()
+
+        self.assertEqual(self.wait_for_lines(2), ['Event 1', 'Event 2'])
+        self.assertFalse(os.path.exists(overflow_file))
+        self.assertEqual(handler.get_stats()['sent'], 2)
+        handler.close()
+
+    @mock.patch('nodeconductor.logging.log.are_threads_enabled', return_value=False)
+    def test_records_are_sent_directly_if_threads_are_not_enabled(self, mocked_are_threads_enabled):
+        handler = TCPEventHandler(port=self.port)
+        for index in range(2):
+            handler.emit(self.make_record('Event %s' % index))
+
+        self.assertIsNone(handler._thread)
+        self.assertEqual(handler.get_stats(), {'sent': 2, 'dropped': 0, 'overflowed': 0, 'queued': 0})
+        self.assertEqual(self.wait_for_lines(2), ['Event 0', 'Event 1'])
+        handler.close()
+
+    @mock.patch('nodeconductor.logging.log.are_threads_enabled', return_value=False)
+    def test_records_are_overflowed_if_they_cannot_be_sent_directly(self, mocked_are_threads_enabled):
+        overflow_file = os.path.join(self.tmp_dir, 'events.overflow')
+        handler = TCPEventHandler(port=self.port, overflow='disk', overflow_file=overflow_file)
+        with mock.patch.object(handler, 'createSocket'):
+            handler.emit(self.make_record('Event 0'))
+        self.assertEqual(handler.get_stats()['overflowed'], 1)
+
+        handler.emit(self.make_record('Event 1'))
+
+        self.assertEqual(self.wait_for_lines(2), ['Event 1', 'Event 0'])
+        self.assertFalse(os.path.exists(overflow_file))
+        handler.close()
+
+    def test_overflow_file_is_required_for_disk_policy(self):
+        with self.assertRaises(ValueError):
+            TCPEventHandler(overflow='disk')
+
+
+class AreThreadsEnabledTest(TestCase):
+
+    def test_threads_are_enabled_outside_of_uwsgi(self):
+        with mock.patch.dict(sys.modules, {'uwsgi': None}):
+            self.assertTrue(are_threads_enabled())
+
+    def test_threads_are_enabled_by_uwsgi_options(self):
+        for options in ({'enable-threads': True}, {'enable-threads': b'true'}, {'threads': b'4'}):
+            with mock.patch.dict(sys.modules, {'uwsgi': mock.Mock(opt=options)}):
+                self.assertTrue(are_threads_enabled(), options)
+
+    def test_threads_are_not_enabled_by_default_in_uwsgi(self):
+        for options in ({}, {'enable-threads': b'false'}):
+            with mock.patch.dict(sys.modules, {'uwsgi': mock.Mock(opt=options)}):
+                self.assertFalse(are_threads_enabled(), options)
+
+
+class BulkHandler(BaseHTTPRequestHandler):
+    """ Fake Elasticsearch bulk endpoint, responds with configured responses """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        lines = self.rfile.read(int(self.headers.getheader('content-length', 0))).splitlines()
+        documents = [(json.loads(action), json.loads(document)) for action, document in zip(lines[::2], lines[1::2])]
+        server = self.server
+        with server.lock:
+            server.requests.append(documents)
+            status, statuses = server.responses.pop(0) if server.responses else (200, None)
+        if statuses is None:
+            statuses = [201] * len(documents)
+        items = [{'index': {'status': item_status}} for item_status in statuses]
+        body = json.dumps({'errors': any(item_status >= 300 for item_status in statuses), 'items': items})
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ElasticsearchEventHandlerTest(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), BulkHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.responses = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        nodeconductor_settings = settings.NODECONDUCTOR.copy()
+        nodeconductor_settings['ELASTICSEARCH'] = {
+            'host': '127.0.0.1',
+            'port': self.server.server_port,
+            'protocol': 'http',
+        }
+        self.settings_override = override_settings(NODECONDUCTOR=nodeconductor_settings)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def emit_records(self, handler, count, requests_count=None):
+        for index in range(count):
+            handler.emit(logging.LogRecord(
+                'nodeconductor', logging.INFO, __file__, 1, 'Event %s' % index, None, None))
+        # pending batch is not retried after handler is closed
+        for _ in range(100):
+            if requests_count is None or len(self.server.requests) >= requests_count:
+                break
+            time.sleep(0.01)
+        handler.close()
+
+    def get_messages(self):
+        return sorted(document['message'] for request in self.server.requests for _, document in request)
+
+    def test_records_are_indexed_to_daily_index(self):
+        handler = ElasticsearchEventHandler()
+        self.emit_records(handler, 3)
+
+        self.assertEqual(len(self.server.requests), 1)
+        index = 'logstash-' + datetime.datetime.utcnow().strftime('%Y.%m.%d')
+        for action, document in self.server.requests[0]:
+            self.assertEqual(action, {'index': {'_index': index, '_type': 'waldur-event'}})
+        self.assertEqual(self.get_messages(), ['Event 0', 'Event 1', 'Event 2'])
+        self.assertEqual(handler.get_stats()['sent'], 3)
+
+    def test_records_are_batched_by_count(self):
+        handler = ElasticsearchEventHandler(batch_size=2, flush_interval=10)
+        self.emit_records(handler, 5)
+
+        self.assertLessEqual(max(len(request) for request in self.server.requests), 2)
+        self.assertEqual(len(self.get_messages()), 5)
+
+    @mock.patch.object(ElasticsearchEventHandler, 'RETRY_INTERVAL', 0.01)
+    def test_batch_is_retried_if_elasticsearch_is_overloaded(self):
+        self.server.responses = [(503, []), (200, [201, 429, 201])]
+        handler = ElasticsearchEventHandler()
+        self.emit_records(handler, 3, requests_count=3)
+
+        self.assertEqual([len(request) for request in self.server.requests], [3, 3, 1])
+        self.assertEqual(self.server.requests[2][0][1]['message'], 'Event 1')
+        self.assertEqual(handler.get_stats(), {'sent': 3, 'dropped': 0, 'overflowed': 0, 'queued': 0})
+
+    def test_rejected_documents_are_dropped(self):
+        self.server.responses = [(200, [201, 400])]
+        handler = ElasticsearchEventHandler()
+        self.emit_records(handler, 2)
+
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(handler.get_stats()['dropped'], 1)
+
+    def test_truncated_records_in_overflow_file_are_skipped(self):
+        handler = ElasticsearchEventHandler()
+        lines = [handler.format_line(logging.LogRecord(
+            'nodeconductor', logging.INFO, __file__, 1, 'Event %s' % index, None, None)) for index in range(3)]
+        # document of second record is truncated, for example, by partial write
+        content = lines[0] + lines[1][:-10] + b'\n' + lines[2]
+
+        with tempfile.TemporaryFile() as overflow_file:
+            overflow_file.write(content)
+            overflow_file.seek(0)
+            records = handler.split_overflow_file(overflow_file)
+
+        self.assertEqual(records, [lines[0], lines[2]])
+        self.assertEqual(handler.get_stats()['dropped'], 1)
@@ -397,6 +397,9 @@ class WebHookViewSet(BaseHookViewSet):
             }
 
         Note that context depends on event type.
+
+        If hook is created with **"batch_events": true** and JSON content type, events that are
+        processed together are delivered in one **POST** request as a list of objects described above.
         """
         return super(WebHookViewSet, self).create(request, *args, **kwargs)
 
@@ -434,6 +437,9 @@ class EmailHookViewSet(BaseHookViewSet):
             {
                 "is_active": "false"
             }
+
+        If hook is created with **"batch_events": true**, events that are processed together
+        are delivered in one digest email.
         """
         return super(EmailHookViewSet, self).create(request, *args, **kwargs)
 
@@ -4,7 +4,7 @@ from django.contrib.contenttypes.admin import GenericTabularInline
 from django.contrib.contenttypes import models as ct_models
 from django.forms import ModelForm
 
-from nodeconductor.core.admin import ReversionAdmin, ReadonlyTextWidget
+from nodeconductor.core.admin import ReadonlyTextWidget
 from nodeconductor.quotas import models, utils
 
 
@@ -58,7 +58,7 @@ class QuotaForm(ModelForm):
         return field.is_backend
 
 
-class QuotaAdmin(QuotaFieldTypeLimit, ReversionAdmin):
+class QuotaAdmin(QuotaFieldTypeLimit, admin.ModelAdmin):
     list_display = ['scope', 'name', 'limit', 'usage']
     list_filter = ['name', QuotaScopeClassListFilter]
 
@@ -53,6 +53,24 @@ class QuotasConfig(AppConfig):
             for counter_field in model.get_quotas_fields(field_class=fields.CounterQuotaField):
                 self.register_counter_field_signals(model, counter_field)
 
+        signals.post_save.connect(
+            handlers.save_quota_sample,
+            sender=Quota,
+            dispatch_uid='nodeconductor.quotas.handlers.save_quota_sample',
+        )
+
+        signals.post_save.connect(
+            handlers.invalidate_sum_of_quotas_cache,
+            sender=Quota,
+            dispatch_uid='nodeconductor.quotas.handlers.invalidate_sum_of_quotas_cache_post_save',
+        )
+
+        signals.post_delete.connect(
+            handlers.invalidate_sum_of_quotas_cache,
+            sender=Quota,
+            dispatch_uid='nodeconductor.quotas.handlers.invalidate_sum_of_quotas_cache_post_delete',
+        )
+
         # Aggregator quotas signals
         signals.post_save.connect(
             handlers.handle_aggregated_quotas,
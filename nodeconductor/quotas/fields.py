@@ -39,7 +39,7 @@ class QuotaLimitField(models.IntegerField):
             if instance is None:
                 raise AttributeError("Can only be accessed via instance")
             try:
-                return instance.quotas.get(name=quota_field).limit
+                return instance.get_quota(quota_field).limit
             except instance.quotas.model.DoesNotExist:
                 return quota_field.default_limit
         return func
@@ -103,16 +103,20 @@ class QuotaField(object):
         except AttributeError:
             return self.default_limit(scope) if six.callable(self.default_limit) else self.default_limit
 
-    def get_or_create_quota(self, scope):
-        if not self.is_connected_to_scope(scope):
-            raise exceptions.CreationConditionFailedQuotaError(
-                'Wrong scope: Cannot create quota "%s" for scope "%s".' % (self.name, scope))
-        defaults = {
+    def get_defaults(self, scope):
+        """ Return initial limit and usage of scope quota """
+        return {
             'limit': self.scope_default_limit(scope),
             'usage': self.default_usage(scope) if six.callable(self.default_usage) else self.default_usage,
         }
 
-        return scope.quotas.get_or_create(name=self.name, defaults=defaults)
+    def get_or_create_quota(self, scope):
+        if not self.is_connected_to_scope(scope):
+            raise exceptions.CreationConditionFailedQuotaError(
+                'Wrong scope: Cannot create quota "%s" for scope "%s".' % (self.name, scope))
+        quota, created = scope.quotas.get_or_create(name=self.name, defaults=self.get_defaults(scope))
+        scope._add_quota_to_map(quota)
+        return quota, created
 
     def get_aggregator_quotas(self, quota):
         """ Fetch ancestors quotas that have the same name and are registered as aggregator quotas. """
@@ -121,7 +125,7 @@ class QuotaField(object):
         for ancestor in ancestors:
             for ancestor_quota_field in ancestor.get_quotas_fields(field_class=AggregatorQuotaField):
                 if ancestor_quota_field.get_child_quota_name() == quota.name:
-                    aggregator_quotas.append(ancestor.quotas.get(name=ancestor_quota_field))
+                    aggregator_quotas.append(ancestor.get_quota(ancestor_quota_field))
         return aggregator_quotas
 
     def __str__(self):
@@ -175,6 +179,13 @@ class CounterQuotaField(QuotaField):
                                    else self._raw_target_models)
         return self._target_models
 
+    def get_scope_lookup(self, target_model):
+        """ Return ORM lookup from target model to scope id """
+        lookup = self.path_to_scope.replace('.', '__')
+        # structure models allow to use customer and project as a lookup alias
+        get_lookup_path = getattr(target_model.objects.all(), 'get_lookup_path', None)
+        return get_lookup_path(lookup) if get_lookup_path is not None else lookup
+
     def recalculate_usage(self, scope):
         current_usage = self.get_current_usage(self.target_models, scope)
         scope.set_quota_usage(self.name, current_usage)
@@ -198,42 +209,51 @@ class AggregatorQuotaField(QuotaField):
             nc_resource_count = quotas_fields.UsageAggregatorQuotaField(
                 get_children=lambda customer: customer.projects.all(),
             )
+
+        Optional `child_model` (model or function that return model) and `path_to_scope`
+        (path from child model to scope) describe the same relation declaratively.
+        They allow to recalculate quota for all scopes at once, see recalculatequotas command.
     """
     aggregation_field = NotImplemented
 
-    def __init__(self, get_children, child_quota_name=None, **kwargs):
+    def __init__(self, get_children, child_quota_name=None, child_model=None, path_to_scope=None, **kwargs):
         self.get_children = get_children
         self._child_quota_name = child_quota_name
+        self._raw_child_model = child_model
+        self.path_to_scope = path_to_scope
         super(AggregatorQuotaField, self).__init__(**kwargs)
 
     def get_child_quota_name(self):
         return self._child_quota_name if self._child_quota_name is not None else self.name
 
+    @property
+    def child_model(self):
+        if not hasattr(self, '_child_model'):
+            self._child_model = (self._raw_child_model() if six.callable(self._raw_child_model)
+                                 else self._raw_child_model)
+        return self._child_model
+
     def recalculate_usage(self, scope):
         children = self.get_children(scope)
         current_usage = 0
         for child in children:
-            child_quota = child.quotas.get(name=self.get_child_quota_name())
+            child_quota = child.get_quota(self.get_child_quota_name())
             current_usage += getattr(child_quota, self.aggregation_field)
         scope.set_quota_usage(self.name, current_usage)
 
     def post_child_quota_save(self, scope, child_quota, created=False):
-        quota = scope.quotas.get(name=self.name)
         current_value = getattr(child_quota, self.aggregation_field)
         if created:
             diff = current_value
         else:
             diff = current_value - child_quota.tracker.previous(self.aggregation_field)
         if diff:
-            quota.usage += diff
-            quota.save()
+            scope.get_quota(self.name).add_propagated_usage(diff)
 
     def pre_child_quota_delete(self, scope, child_quota):
-        quota = scope.quotas.get(name=self.name)
         diff = getattr(child_quota, self.aggregation_field)
         if diff:
-            quota.usage -= diff
-            quota.save()
+            scope.get_quota(self.name).add_propagated_usage(-diff)
 
 
 class UsageAggregatorQuotaField(AggregatorQuotaField):
@@ -2,7 +2,6 @@ from django.db import transaction
 from django.db.models import signals
 
 from nodeconductor.quotas import models, utils, fields
-from nodeconductor.quotas.exceptions import CreationConditionFailedQuotaError
 
 
 # Deprecated, new style quotas adds them self automatically
@@ -22,33 +21,46 @@ def create_global_quotas(**kwargs):
 
 def increase_global_quota(sender, instance=None, created=False, **kwargs):
     if created and hasattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'):
-        with transaction.atomic():
-            global_quota = models.Quota.objects.select_for_update().get(
-                name=getattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'))
-            global_quota.usage += 1
-            global_quota.save()
+        global_quota = models.Quota.objects.get(name=getattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'))
+        global_quota.add_striped_usage(1)
 
 
 def decrease_global_quota(sender, **kwargs):
     if hasattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'):
-        with transaction.atomic():
-            global_quota = models.Quota.objects.select_for_update().get(
-                name=getattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'))
-            global_quota.usage -= 1
-            global_quota.save()
+        global_quota = models.Quota.objects.get(name=getattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'))
+        global_quota.add_striped_usage(-1)
 
 
 # new quotas
 
 def init_quotas(sender, instance, created=False, **kwargs):
     """ Initialize new instances quotas """
-    if not created:
+    if created:
+        utils.init_quotas_for([instance])
+
+
+def save_quota_sample(sender, instance, created=False, **kwargs):
+    """ Store quota limit and usage in history if they were changed """
+    quota = instance
+    if created or quota.tracker.has_changed('limit') or quota.tracker.has_changed('usage'):
+        quota.save_sample()
+
+
+def invalidate_sum_of_quotas_cache(sender, instance, created=False, **kwargs):
+    """ Expire cached sums of quotas if quota limit or usage was changed """
+    quota = instance
+    if quota.content_type_id is None:
+        return
+    if kwargs['signal'] == signals.post_save and not (
+            created or quota.tracker.has_changed('limit') or quota.tracker.has_changed('usage')):
         return
-    for field in sender.get_quotas_fields():
-        try:
-            field.get_or_create_quota(scope=instance)
-        except CreationConditionFailedQuotaError:
-            pass
+
+    def invalidate():
+        models.invalidate_sum_of_quotas_cache(quota.content_type_id, [quota.object_id], [quota.name])
+
+    invalidate()
+    # concurrent request could cache old values before transaction is committed
+    transaction.on_commit(invalidate)
 
 
 def count_quota_handler_factory(count_quota_field):
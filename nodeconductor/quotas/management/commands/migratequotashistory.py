@@ -0,0 +1,45 @@
+from __future__ import unicode_literals
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from reversion.models import Version
+
+from nodeconductor.quotas.models import Quota, QuotaSample
+
+
+class Command(BaseCommand):
+    help = ('Copy quotas history from django-reversion versions to quota samples. '
+            'Only versions older than the first sample of quota are copied, so command could be run several times.')
+    BATCH_SIZE = 1000
+
+    def handle(self, *args, **options):
+        first_samples = dict(QuotaSample.objects.values('quota').annotate(
+            first=Min('timestamp')).values_list('quota', 'first'))
+        quotas_ids = set(Quota.objects.values_list('pk', flat=True))
+        versions = (Version.objects.filter(content_type=ContentType.objects.get_for_model(Quota))
+                    .select_related('revision').order_by('object_id', 'revision__date_created'))
+
+        samples = []
+        previous = None
+        created_count = 0
+        for version in versions.iterator():
+            quota_id = int(version.object_id)
+            timestamp = version.revision.date_created
+            if quota_id not in quotas_ids or (quota_id in first_samples and timestamp >= first_samples[quota_id]):
+                continue
+            version_object = version._object_version.object
+            values = (quota_id, version_object.limit, version_object.usage)
+            if values == previous:
+                continue
+            previous = values
+            samples.append(QuotaSample(quota_id=quota_id, timestamp=timestamp,
+                                       limit=version_object.limit, usage=version_object.usage))
+            if len(samples) >= self.BATCH_SIZE:
+                QuotaSample.objects.bulk_create(samples)
+                created_count += len(samples)
+                samples = []
+
+        QuotaSample.objects.bulk_create(samples)
+        created_count += len(samples)
+        self.stdout.write('%s quota samples were created.' % created_count)
@@ -1,78 +1,306 @@
 from __future__ import unicode_literals
 
-from django.core.management.base import BaseCommand
-from django.db import transaction
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+import threading
 
-from nodeconductor.quotas import models, fields, exceptions
-from nodeconductor.quotas.utils import get_models_with_quotas
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.db.models.query import QuerySet
+
+from nodeconductor.quotas import models, fields
+from nodeconductor.quotas.utils import get_models_with_quotas, init_quotas_for
 
 
 class Command(BaseCommand):
-    """ Recalculate all quotas """
+    """ Recalculate all quotas.
+
+        Counter quotas are calculated with one grouped COUNT query per target model.
+        Aggregator quotas are calculated bottom-up: aggregators of aggregators are processed
+        after quotas they depend on. If aggregator field defines child_model and path_to_scope
+        children quotas of all scopes are summed using one query, otherwise children are
+        fetched for each scope separately, so hints should be declared for aggregators of big models.
+        Changed quotas are written with bulk updates.
+    """
+    help = 'Recalculate usage of quotas.'
+    UPDATE_CHUNK_SIZE = 500
+    INIT_CHUNK_SIZE = 500
+    # Number of scopes that are checked to find out child model of aggregator field without hints
+    CHILD_MODEL_PROBES_COUNT = 20
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', dest='models', action='append', default=[],
+                            help='Recalculate quotas of given model only, for example: structure.Customer. '
+                                 'Could be defined several times.')
+        parser.add_argument('--quota', dest='quotas', action='append', default=[],
+                            help='Recalculate quota with given name only. Could be defined several times.')
+        parser.add_argument('--dry-run', dest='dry_run', action='store_true', default=False,
+                            help='Report quotas with wrong usage without saving them.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of threads that recalculate quotas of different models in parallel.')
 
     def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.workers = max(options['workers'], 1)
+        self.quota_names = set(options['quotas'])
+        self.models = self.get_models(options['models'])
+        # Calculated usages of quotas: {(model, quota name): {scope id: usage}}.
+        # Aggregators take children usages from here, so dry run reports correct values too.
+        self.usages = {}
+        self.changes_count = 0
+        self.report_lock = threading.Lock()
+
         # TODO: implement other quotas recalculation
         # TODO: implement global stale quotas deletion
-        self.delete_stale_quotas()
-        self.init_missing_quotas()
+        if not self.dry_run:
+            self.delete_stale_quotas()
+            self.init_missing_quotas()
         self.recalculate_global_quotas()
         self.recalculate_counter_quotas()
         self.recalculate_aggregator_quotas()
-        self.stdout.write('XXX: Second time to make sure that aggregators of aggregators where calculated properly.')
-        self.recalculate_aggregator_quotas()
         self.recalculate_customers_user_count()
+        if self.dry_run:
+            self.stdout.write('%s quotas have wrong usage.' % self.changes_count)
+
+    def get_models(self, labels):
+        all_models = get_models_with_quotas()
+        if not labels:
+            return all_models
+        result = []
+        for label in labels:
+            try:
+                model = apps.get_model(label)
+            except (LookupError, ValueError):
+                raise CommandError('Model "%s" does not exist.' % label)
+            if model not in all_models:
+                raise CommandError('Model "%s" does not have quotas.' % label)
+            result.append(model)
+        return result
+
+    def is_selected(self, quota_name):
+        return not self.quota_names or quota_name in self.quota_names
+
+    def run_in_parallel(self, func, items):
+        """ Execute func for each item, use several threads if workers option is defined """
+        if self.workers == 1 or len(items) < 2:
+            return [func(item) for item in items]
+
+        def run(item):
+            try:
+                return func(item)
+            finally:
+                # each thread gets its own database connection
+                connection.close()
+
+        pool = ThreadPool(min(self.workers, len(items)))
+        try:
+            return pool.map(run, items)
+        finally:
+            pool.close()
+            pool.join()
 
     def delete_stale_quotas(self):
         self.stdout.write('Deleting stale quotas')
-        for model in get_models_with_quotas():
-            for obj in model.objects.all():
-                quotas_names = model.QUOTAS_NAMES + [f.name for f in model.get_quotas_fields()]
-                obj.quotas.exclude(name__in=quotas_names).delete()
+        for model in self.models:
+            quotas_names = model.QUOTAS_NAMES + [f.name for f in model.get_quotas_fields()]
+            content_type = ContentType.objects.get_for_model(model)
+            models.Quota.objects.filter(content_type=content_type).exclude(name__in=quotas_names).delete()
         self.stdout.write('...done')
 
     def init_missing_quotas(self):
         self.stdout.write('Initializing missing quotas')
-        for model in get_models_with_quotas():
-            for obj in model.objects.all():
-                for field in obj.get_quotas_fields():
-                    try:
-                        field.get_or_create_quota(scope=obj)
-                    except exceptions.CreationConditionFailedQuotaError:
-                        pass
+        quota_names = self.quota_names or None
+        for model in self.models:
+            if not any(self.is_selected(field.name) for field in model.get_quotas_fields()):
+                continue
+            scopes_ids = list(model.objects.order_by('pk').values_list('pk', flat=True))
+            for index in range(0, len(scopes_ids), self.INIT_CHUNK_SIZE):
+                chunk = scopes_ids[index:index + self.INIT_CHUNK_SIZE]
+                init_quotas_for(model.objects.filter(pk__in=chunk), quota_names=quota_names)
         self.stdout.write('...done')
 
     def recalculate_global_quotas(self):
         self.stdout.write('Recalculating global quotas')
-        for model in get_models_with_quotas():
-            if hasattr(model, 'GLOBAL_COUNT_QUOTA_NAME'):
-                with transaction.atomic():
-                    quota, _ = models.Quota.objects.get_or_create(name=model.GLOBAL_COUNT_QUOTA_NAME)
-                    quota.usage = model.objects.count()
-                    quota.save()
+        for model in self.models:
+            quota_name = getattr(model, 'GLOBAL_COUNT_QUOTA_NAME', None)
+            if quota_name is None or not self.is_selected(quota_name):
+                continue
+            with transaction.atomic():
+                quota, _ = models.Quota.objects.get_or_create(name=quota_name)
+                usage = model.objects.count()
+                current_usage = quota.get_usage()
+                if current_usage != usage:
+                    self.report_change(model, quota_name, None, current_usage, usage)
+                    if not self.dry_run:
+                        quota.reset_usage(usage)
         self.stdout.write('...done')
 
     def recalculate_counter_quotas(self):
         self.stdout.write('Recalculating counter quotas')
-        for model in get_models_with_quotas():
-            for counter_field in model.get_quotas_fields(field_class=fields.CounterQuotaField):
-                for instance in model.objects.all():
-                    counter_field.recalculate(scope=instance)
+        items = [(model, field) for model in self.models
+                 for field in model.get_quotas_fields(field_class=fields.CounterQuotaField)
+                 if self.is_selected(field.name)]
+        self.run_in_parallel(self.recalculate_counter_quota, items)
         self.stdout.write('...done')
 
+    def recalculate_counter_quota(self, item):
+        model, field = item
+        if field._raw_get_current_usage is not None:
+            # custom usage calculation is defined for one scope only
+            scopes = model.objects.filter(pk__in=self.get_current_usages(model, field.name).keys())
+            usages = {scope.pk: field.get_current_usage(field.target_models, scope) for scope in scopes}
+        else:
+            usages = defaultdict(int)
+            for target_model in field.target_models:
+                path_to_scope = field.get_scope_lookup(target_model)
+                rows = (target_model.objects.order_by().values(path_to_scope)
+                        .annotate(count=Count('pk')).values_list(path_to_scope, 'count'))
+                for scope_id, count in rows:
+                    usages[scope_id] += count
+        self.save_usages(model, field.name, usages)
+
     def recalculate_aggregator_quotas(self):
-        # TODO: recalculate child quotas first
         self.stdout.write('Recalculating aggregator quotas')
-        for model in get_models_with_quotas():
-            for aggregator_field in model.get_quotas_fields(field_class=fields.AggregatorQuotaField):
-                for instance in model.objects.all():
-                    aggregator_field.recalculate(scope=instance)
+        for level in self.get_aggregator_levels():
+            self.run_in_parallel(self.recalculate_aggregator_quota, level)
         self.stdout.write('...done')
 
+    def get_aggregator_levels(self):
+        """ Split selected aggregator fields to levels, fields of each level depend only on fields of previous levels.
+
+            Child model is taken from child_model hint of field. If hint is not defined child model is
+            derived from children of existing scopes. Fields with unknown child model are recalculated
+            last, twice, so aggregators of such aggregators get actual children usages.
+        """
+        items = [(model, field) for model in self.models
+                 for field in model.get_quotas_fields(field_class=fields.AggregatorQuotaField)
+                 if self.is_selected(field.name)]
+        fields_map = {(model, field.name): field for model, field in items}
+
+        dependencies = {}
+        unknown = set()
+        for model, field in items:
+            child_model = field.child_model or self.get_child_model(model, field)
+            if child_model is None:
+                unknown.add((model, field.name))
+                dependencies[(model, field.name)] = set()
+            else:
+                # aggregators of not selected models or quotas are used as children only
+                dependencies[(model, field.name)] = {(child_model, field.get_child_quota_name())} & set(fields_map)
+
+        levels = []
+        processed = set()
+        remaining = set(fields_map) - unknown
+        while remaining:
+            level = {key for key in remaining if dependencies[key] <= processed | unknown}
+            if not level:
+                raise CommandError('Aggregator quotas have cyclic dependencies: %s' % ', '.join(
+                    '%s.%s' % (model.__name__, name) for model, name in remaining))
+            levels.append(level)
+            processed |= level
+            remaining -= level
+
+        levels = [[(key[0], fields_map[key]) for key in level] for level in levels]
+        if unknown:
+            unknown_level = [(key[0], fields_map[key]) for key in sorted(unknown, key=lambda key: key[1])]
+            # levels of unknown fields are processed one field at a time in the same order
+            levels = [[item] for item in unknown_level] + levels + [[item] for item in unknown_level]
+        return levels
+
+    def get_child_model(self, model, field):
+        """ Derive child model of aggregator field without child_model hint from children of existing scopes """
+        for scope in model.objects.all()[:self.CHILD_MODEL_PROBES_COUNT]:
+            children = field.get_children(scope)
+            if isinstance(children, QuerySet):
+                return children.model
+            children = list(children)
+            if children:
+                return type(children[0])
+        return None
+
+    def recalculate_aggregator_quota(self, item):
+        model, field = item
+        child_quota_name = field.get_child_quota_name()
+        aggregation_field = 'quotas__' + field.aggregation_field
+        usages = defaultdict(int)
+
+        if field.child_model is not None and field.path_to_scope is not None:
+            child_model = field.child_model
+            calculated = self.usages.get((child_model, child_quota_name), {})
+            path_to_scope = field.path_to_scope.replace('.', '__')
+            rows = (child_model.objects.filter(quotas__name=child_quota_name)
+                    .values_list('pk', path_to_scope, aggregation_field))
+            for child_id, scope_id, value in rows:
+                if field.aggregation_field == 'usage':
+                    value = calculated.get(child_id, value)
+                usages[scope_id] += value
+        else:
+            scopes = model.objects.filter(pk__in=self.get_current_usages(model, field.name).keys())
+            for scope in scopes:
+                children = field.get_children(scope)
+                if not isinstance(children, QuerySet):
+                    children = [(child.pk, getattr(child.get_quota(child_quota_name), field.aggregation_field))
+                                for child in children]
+                    usages[scope.pk] = sum(value for _, value in children)
+                    continue
+                rows = children.filter(quotas__name=child_quota_name).values_list('pk', aggregation_field)
+                calculated = self.usages.get((children.model, child_quota_name), {})
+                for child_id, value in rows:
+                    if field.aggregation_field == 'usage':
+                        value = calculated.get(child_id, value)
+                    usages[scope.pk] += value
+
+        self.save_usages(model, field.name, usages)
+
+    def get_current_usages(self, model, quota_name):
+        """ Return {scope id: (quota id, usage)} for all quotas of model with given name """
+        content_type = ContentType.objects.get_for_model(model)
+        rows = (models.Quota.objects.filter(content_type=content_type, name=quota_name)
+                .values_list('object_id', 'pk', 'usage'))
+        return {object_id: (pk, usage) for object_id, pk, usage in rows}
+
+    def save_usages(self, model, quota_name, usages):
+        """ Update usage of quotas that differ from calculated ones.
+
+            Quotas are updated with one query per unique usage value.
+        """
+        quotas_by_usage = defaultdict(list)
+        changed_scopes_ids = []
+        calculated = {}
+        for scope_id, (quota_id, current_usage) in self.get_current_usages(model, quota_name).items():
+            usage = usages.get(scope_id, 0)
+            calculated[scope_id] = usage
+            if current_usage != usage:
+                self.report_change(model, quota_name, scope_id, current_usage, usage)
+                quotas_by_usage[usage].append(quota_id)
+                changed_scopes_ids.append(scope_id)
+        self.usages[(model, quota_name)] = calculated
+
+        if self.dry_run or not quotas_by_usage:
+            return
+        for usage, quota_ids in quotas_by_usage.items():
+            for index in range(0, len(quota_ids), self.UPDATE_CHUNK_SIZE):
+                models.Quota.objects.filter(pk__in=quota_ids[index:index + self.UPDATE_CHUNK_SIZE]).update(usage=usage)
+        models.invalidate_sum_of_quotas_cache(
+            ContentType.objects.get_for_model(model).id, changed_scopes_ids, [quota_name])
+
+    def report_change(self, model, quota_name, scope_id, current_usage, usage):
+        with self.report_lock:
+            self.changes_count += 1
+            if self.dry_run:
+                scope = '%s #%s' % (model._meta.label, scope_id) if scope_id is not None else 'global'
+                self.stdout.write('%s quota of %s: %s -> %s' % (quota_name, scope, current_usage, usage))
+
     # XXX: With current permissions structure it easier to handle customer quota separately.
     def recalculate_customers_user_count(self):
-        self.stdout.write('Recalculating customers user count')
         from nodeconductor.structure.models import Customer
-        for customer in Customer.objects.all():
-            usage = len(set(customer.get_users()))
-            customer.set_quota_usage(Customer.Quotas.nc_user_count, usage)
+        if Customer not in self.models or not self.is_selected(Customer.Quotas.nc_user_count.name):
+            return
+        self.stdout.write('Recalculating customers user count')
+        quota_name = Customer.Quotas.nc_user_count.name
+        usages = {customer.pk: len(set(customer.get_users())) for customer in Customer.objects.all()}
+        self.save_usages(Customer, quota_name, usages)
         self.stdout.write('...done')
@@ -1,6 +1,9 @@
-from django.contrib.contenttypes import models as ct_models
+import itertools
+from operator import or_
+
 from django.db import models
-from django.db.models import Q
+from django.db.models import FloatField, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 
 from nodeconductor.core.managers import GenericKeyMixin
 
@@ -14,16 +17,61 @@ class QuotaManager(GenericKeyMixin, models.Manager):
             queryset = self.get_queryset()
         # XXX: This circular dependency will be removed then filter_queryset_for_user
         # will be moved to model manager method
-        from nodeconductor.structure.managers import filter_queryset_for_user
+        from nodeconductor.structure.managers import get_generic_query_for_user
 
         if user.is_staff or user.is_support:
             return queryset
 
-        quota_scope_models = utils.get_models_with_quotas()
-        query = Q()
-        for model in quota_scope_models:
-            user_object_ids = filter_queryset_for_user(model.objects.all(), user).values_list('id', flat=True)
-            content_type_id = ct_models.ContentType.objects.get_for_model(model).id
-            query |= Q(object_id__in=user_object_ids, content_type_id=content_type_id)
+        return queryset.filter(get_generic_query_for_user(user, utils.get_models_with_quotas()))
+
+    def with_stripes_usage(self, queryset=None):
+        """ Annotate quotas with sum of their usage stripes, so get_usage does not query stripes """
+        from nodeconductor.quotas.models import QuotaUsageStripe
+
+        if queryset is None:
+            queryset = self.get_queryset()
+        stripes_usage = (QuotaUsageStripe.objects.filter(quota=OuterRef('pk'))
+                         .order_by().values('quota').annotate(total=Sum('usage')).values('total'))
+        return queryset.annotate(
+            stripes_usage=Coalesce(Subquery(stripes_usage, output_field=FloatField()), 0.0))
+
+
+class QuotaSampleQuerySet(models.QuerySet):
+
+    def get_values_at(self, quota, points):
+        """ Return list of (limit, usage) of quota at given points, None if quota did not have values at point """
+        return self.get_timelines([quota.pk], points).get(quota.pk, [None] * len(points))
+
+    def get_timelines(self, quotas_ids, points):
+        """ Return {<quota id>: list of (limit, usage) at given points} for quotas that have history.
+
+            Samples of all quotas are fetched with two queries: grouped query finds time of
+            the last sample before the first point of each quota, then these samples are fetched
+            together with samples between the first and the last points.
+            Values at points are resolved in a single sweep over samples ordered by time.
+        """
+        if not points:
+            return {}
+        first_point, last_point = min(points), max(points)
+        initial_timestamps = (self.filter(quota__in=quotas_ids, timestamp__lte=first_point)
+                              .order_by().values('quota').annotate(last_timestamp=Max('timestamp'))
+                              .values_list('quota', 'last_timestamp'))
+        query = reduce(or_, [Q(quota=quota_id, timestamp=timestamp) for quota_id, timestamp in initial_timestamps],
+                       Q(timestamp__gt=first_point, timestamp__lte=last_point))
+        samples = (self.filter(quota__in=quotas_ids)
+                   .filter(query)
+                   .order_by('quota', 'timestamp')
+                   .values_list('quota', 'timestamp', 'limit', 'usage'))
 
-        return queryset.filter(query)
+        sorted_points = sorted(enumerate(points), key=lambda indexed_point: indexed_point[1])
+        timelines = {}
+        for quota_id, quota_samples in itertools.groupby(samples.iterator(), key=lambda sample: sample[0]):
+            timeline = timelines[quota_id] = [None] * len(points)
+            values = None
+            sample = next(quota_samples, None)
+            for index, point in sorted_points:
+                while sample is not None and sample[1] <= point:
+                    values = sample[2:]
+                    sample = next(quota_samples, None)
+                timeline[index] = values
+        return timelines
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 08:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotas', '0004_quota_threshold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotaSample',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('limit', models.FloatField()),
+                ('usage', models.FloatField()),
+                ('quota', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='samples', to='quotas.Quota')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='quotasample',
+            index_together=set([('quota', 'timestamp')]),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotas', '0005_quotasample'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotaUsageStripe',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('usage', models.FloatField(default=0)),
+                ('quota', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stripes', to='quotas.Quota')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='quotausagestripe',
+            unique_together=set([('quota', 'index')]),
+        ),
+    ]
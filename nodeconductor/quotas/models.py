@@ -1,28 +1,32 @@
 from __future__ import unicode_literals
 
 import functools
+import hashlib
 import inspect
+import random
+import uuid
 from collections import defaultdict
 
+from django.conf import settings
 from django.contrib.contenttypes import fields as ct_fields
 from django.contrib.contenttypes import models as ct_models
-from django.db import models
-from django.db.models import Sum
-from django.utils import six
-from django.utils.encoding import python_2_unicode_compatible
+from django.core.cache import cache
+from django.db import models, router, transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, When, signals
+from django.utils import six, timezone
+from django.utils.encoding import force_text, python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 from model_utils import FieldTracker
-from reversion import revisions as reversion
 
 from nodeconductor.logging.loggers import LoggableMixin
 from nodeconductor.logging.models import AlertThresholdMixin
 from nodeconductor.quotas import exceptions, managers, fields
-from nodeconductor.core.models import UuidMixin, ReversionMixin, DescendantMixin
+from nodeconductor.core import utils as core_utils
+from nodeconductor.core.models import UuidMixin, DescendantMixin
 
 
 @python_2_unicode_compatible
-@reversion.register(fields=['usage', 'limit'])
-class Quota(UuidMixin, AlertThresholdMixin, LoggableMixin, ReversionMixin, models.Model):
+class Quota(UuidMixin, AlertThresholdMixin, LoggableMixin, models.Model):
     """
     Abstract quota for any resource.
 
@@ -80,6 +84,234 @@ class Quota(UuidMixin, AlertThresholdMixin, LoggableMixin, ReversionMixin, model
     def is_over_threshold(self):
         return self.usage >= self.threshold
 
+    def add_usage(self, delta, validate=False):
+        """ Add delta to quota usage with atomic UPDATE query: usage = usage + delta.
+
+            Deltas added in the outermost atomic block of transaction are merged and written once on commit.
+            If validate is True - quota is checked and changed by single conditional query,
+            False is returned if quota would be exceeded.
+        """
+        if not delta:
+            return True
+        if validate:
+            # pending deltas are kept until commit, but they are taken into account
+            pending_delta = _get_pending_usage_delta(self.pk)
+            updated = Quota.objects.filter(pk=self.pk).filter(
+                Q(limit=-1) | Q(limit__gte=F('usage') + pending_delta + delta)).update(usage=F('usage') + delta)
+            if not updated:
+                self.refresh_from_db(fields=['usage', 'limit'])
+                return False
+            _notify_usage_changes({self.pk: delta})
+        elif _is_in_coalescing_transaction():
+            _get_pending_usage_deltas()[self.pk] += delta
+        else:
+            apply_usage_deltas({self.pk: delta})
+        self.usage += delta
+        return True
+
+    def add_propagated_usage(self, delta):
+        """ Add delta of child quota to aggregator quota usage.
+
+            Deltas of all children changed inside one transaction are merged, so each aggregator
+            quota is updated once on commit. If ASYNC_QUOTA_PROPAGATION setting is enabled
+            deltas are written by Celery task.
+        """
+        if not delta:
+            return
+        if _is_in_coalescing_transaction():
+            _get_pending_usage_deltas(_propagate_usage_deltas)[self.pk] += delta
+        else:
+            _propagate_usage_deltas({self.pk: delta})
+        self.usage += delta
+
+    def add_striped_usage(self, delta):
+        """ Add delta to one of randomly chosen usage stripes of quota.
+
+            Stripes are used for frequently updated global quotas to avoid lock
+            of one quota row by concurrent transactions. Use get_usage to read usage.
+        """
+        index = random.randrange(QuotaUsageStripe.COUNT)
+        updated = QuotaUsageStripe.objects.filter(quota=self, index=index).update(usage=F('usage') + delta)
+        if not updated:
+            QuotaUsageStripe.objects.get_or_create(quota=self, index=index)
+            QuotaUsageStripe.objects.filter(quota=self, index=index).update(usage=F('usage') + delta)
+
+    def get_usage(self):
+        """ Return quota usage together with its not compacted usage stripes.
+
+            Only global quotas have stripes. Their sum is taken from stripes_usage annotation
+            (see QuotaManager.with_stripes_usage) or prefetched stripes if available.
+        """
+        if self.object_id is not None:
+            return self.usage
+        if hasattr(self, 'stripes_usage'):
+            return self.usage + self.stripes_usage
+        stripes = getattr(self, '_prefetched_objects_cache', {}).get('stripes')
+        if stripes is None:
+            stripes = self.stripes.all()
+        return self.usage + sum(stripe.usage for stripe in stripes)
+
+    def compact_usage_stripes(self):
+        """ Move usage of stripes to quota usage """
+        with transaction.atomic():
+            stripes = QuotaUsageStripe.objects.select_for_update().filter(quota=self).exclude(usage=0)
+            delta = sum(stripe.usage for stripe in stripes)
+            if not delta:
+                return
+            stripes.update(usage=0)
+            quota = Quota.objects.select_for_update().get(pk=self.pk)
+            quota.usage += delta
+            quota.save(update_fields=['usage'])
+            self.usage = quota.usage
+
+    def reset_usage(self, usage):
+        """ Set quota usage and clear its usage stripes """
+        with transaction.atomic():
+            QuotaUsageStripe.objects.select_for_update().filter(quota=self).update(usage=0)
+            self.usage = usage
+            self.save(update_fields=['usage'])
+
+    def save_sample(self):
+        """ Store current limit and usage in quota history if they differ from the last stored ones """
+        values = (self.limit, self.usage)
+        if getattr(self, '_sample_values', None) == values:
+            return
+        QuotaSample.objects.create(quota=self, limit=self.limit, usage=self.usage)
+        self._sample_values = values
+
+    def _notify_usage_change(self, previous_usage):
+        """ Send post_save signal as if quota usage was saved """
+        tracker = self.tracker
+        tracker.saved_data['usage'] = previous_usage
+        signals.post_save.send(
+            sender=Quota, instance=self, created=False, update_fields=frozenset(['usage']),
+            raw=False, using=router.db_for_write(Quota, instance=self))
+        tracker.set_saved_fields(fields=['usage'])
+
+
+class QuotaUsageStripe(models.Model):
+    """ Part of quota usage that is not written to quota row yet.
+
+        Usage of quota is a sum of quota usage and its stripes usages.
+        Stripes are moved to quota by compact_usage_stripes task periodically.
+    """
+    COUNT = 16
+
+    class Meta:
+        unique_together = (('quota', 'index'),)
+
+    quota = models.ForeignKey(Quota, related_name='stripes')
+    index = models.PositiveSmallIntegerField()
+    usage = models.FloatField(default=0)
+
+
+@python_2_unicode_compatible
+class QuotaSample(models.Model):
+    """ Historical value of quota limit and usage.
+
+        Append-only: new sample is stored only if quota limit or usage was changed,
+        so quota values at any moment are defined by the latest sample before it.
+    """
+    class Meta:
+        index_together = (('quota', 'timestamp'),)
+
+    quota = models.ForeignKey(Quota, related_name='samples', db_index=False)
+    timestamp = models.DateTimeField(default=timezone.now)
+    limit = models.FloatField()
+    usage = models.FloatField()
+
+    objects = managers.QuotaSampleQuerySet.as_manager()
+
+    def __str__(self):
+        return '%s at %s' % (self.quota_id, self.timestamp)
+
+
+def _is_in_coalescing_transaction():
+    """ Deltas are merged in the outermost atomic block only, inside savepoints they are written
+        immediately, so they are rolled back together with savepoint by database.
+    """
+    return (settings.NODECONDUCTOR.get('COALESCE_QUOTA_USAGE_DELTAS', True) and
+            core_utils.is_in_outermost_atomic_block())
+
+
+def _get_pending_usage_deltas(write=None, create=True):
+    """ Return deltas that are written by given function on commit of current transaction """
+    write = write or apply_usage_deltas
+    return core_utils.get_commit_hook_data(
+        (__name__, write.__name__), write, factory=lambda: defaultdict(float), create=create)
+
+
+def _get_pending_usage_delta(quota_id):
+    return sum((_get_pending_usage_deltas(write, create=False) or {}).get(quota_id, 0)
+               for write in (apply_usage_deltas, _propagate_usage_deltas))
+
+
+def _discard_pending_usage_deltas(quota_id):
+    for write in (apply_usage_deltas, _propagate_usage_deltas):
+        (_get_pending_usage_deltas(write, create=False) or {}).pop(quota_id, None)
+
+
+def apply_usage_deltas(deltas):
+    """ Write quotas usage deltas with one UPDATE query per quota: usage = usage + delta.
+
+        Deltas propagated from these quotas to aggregator quotas are merged and written
+        on commit of the same transaction, so propagation up to the scopes hierarchy
+        is performed level by level.
+    """
+    deltas = {quota_id: delta for quota_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    with transaction.atomic():
+        for quota_id, delta in deltas.items():
+            Quota.objects.filter(pk=quota_id).update(usage=F('usage') + delta)
+        _notify_usage_changes(deltas)
+
+
+def _propagate_usage_deltas(deltas):
+    if not settings.NODECONDUCTOR.get('ASYNC_QUOTA_PROPAGATION', False):
+        apply_usage_deltas(deltas)
+        return
+    from nodeconductor.quotas import tasks
+    deltas = {str(quota_id): delta for quota_id, delta in deltas.items() if delta}
+    if deltas:
+        transaction.on_commit(lambda: tasks.apply_usage_deltas.delay(deltas))
+
+
+def _notify_usage_changes(deltas):
+    for quota in Quota.objects.filter(pk__in=deltas.keys()):
+        quota._notify_usage_change(previous_usage=quota.usage - deltas[quota.pk])
+
+
+SUM_OF_QUOTAS_CACHE_TIMEOUT = 60 * 60
+
+
+def _get_sum_of_quotas_version_key(content_type_id, scope_id, quota_name):
+    return 'quotas:sum_version:%s:%s:%s' % (content_type_id, scope_id, quota_name)
+
+
+def _get_sum_of_quotas_cache_key(content_type_id, scopes_ids, quota_names, fields):
+    """ Cache key depends on versions of summarized quotas, so key changes after update of any of them """
+    version_keys = [_get_sum_of_quotas_version_key(content_type_id, scope_id, name)
+                    for scope_id in sorted(scopes_ids) for name in sorted(set(quota_names))]
+    versions = cache.get_many(version_keys)
+    missing_versions = {key: uuid.uuid4().hex for key in version_keys if key not in versions}
+    if missing_versions:
+        cache.set_many(missing_versions, timeout=None)
+        versions.update(missing_versions)
+
+    params = '%s|%s|%s' % (
+        ','.join(str(scope_id) for scope_id in sorted(scopes_ids)),
+        ','.join(versions[key] for key in version_keys),
+        ','.join(sorted(fields)),
+    )
+    return 'quotas:sum:%s:%s' % (content_type_id, hashlib.md5(params.encode('utf-8')).hexdigest())
+
+
+def invalidate_sum_of_quotas_cache(content_type_id, scopes_ids, quota_names):
+    """ Expire cached sums that include quotas with given names of given scopes """
+    cache.set_many({_get_sum_of_quotas_version_key(content_type_id, scope_id, name): uuid.uuid4().hex
+                    for scope_id in set(scopes_ids) for name in set(quota_names)}, timeout=None)
+
 
 def _fail_silently(method):
 
@@ -139,29 +371,76 @@ class QuotaModelMixin(models.Model):
 
     quotas = ct_fields.GenericRelation('quotas.Quota', related_query_name='quotas')
 
+    def get_quota(self, quota_name):
+        """ Return object quota by name.
+
+            All object quotas are loaded with one query on first access (or taken from
+            prefetch_related('quotas') cache) and served from memory afterwards.
+            Quotas changed via this object methods stay up to date, use refresh_from_db
+            to reload quotas changed elsewhere.
+        """
+        quota_name = force_text(quota_name)
+        quotas_map = self._get_quotas_map()
+        try:
+            return quotas_map[quota_name]
+        except KeyError:
+            # quota could be created after map initialization
+            quota = self.quotas.get(name=quota_name)
+            self._add_quota_to_map(quota)
+            return quota
+
+    def _get_quotas_map(self):
+        if self.pk is None:
+            return {}
+        if not hasattr(self, '_quotas_map'):
+            prefetched_quotas = getattr(self, '_prefetched_objects_cache', {}).get('quotas')
+            quotas = prefetched_quotas if prefetched_quotas is not None else self.quotas.all()
+            self._quotas_map = {}
+            for quota in quotas:
+                self._add_quota_to_map(quota)
+        return self._quotas_map
+
+    def _init_quotas_map(self, quotas):
+        """ Replace identity map with given quotas, they should be all quotas of the object """
+        self._quotas_map = {}
+        for quota in quotas:
+            self._add_quota_to_map(quota)
+
+    def _add_quota_to_map(self, quota):
+        if self.pk is None:
+            return
+        # avoid extra query on quota scope access
+        setattr(quota, Quota.scope.cache_attr, self)
+        self._get_quotas_map()[quota.name] = quota
+
+    def refresh_from_db(self, *args, **kwargs):
+        if hasattr(self, '_quotas_map'):
+            del self._quotas_map
+        return super(QuotaModelMixin, self).refresh_from_db(*args, **kwargs)
+
     @_fail_silently
     def set_quota_limit(self, quota_name, limit, fail_silently=False):
-        quota = self.quotas.get(name=quota_name)
+        quota = self.get_quota(quota_name)
         if quota.limit != limit:
             quota.limit = limit
             quota.save(update_fields=['limit'])
 
     @_fail_silently
     def set_quota_usage(self, quota_name, usage, fail_silently=False):
-        quota = self.quotas.get(name=quota_name)
+        quota = self.get_quota(quota_name)
+        # usage is overridden, so pending deltas are not relevant anymore
+        _discard_pending_usage_deltas(quota.pk)
         if quota.usage != usage:
             quota.usage = usage
             quota.save(update_fields=['usage'])
 
     @_fail_silently
     def add_quota_usage(self, quota_name, usage_delta, fail_silently=False, validate=False):
-        quota = self.quotas.get(name=quota_name)
-        if validate and quota.is_exceeded(usage_delta):
+        quota = self.get_quota(quota_name)
+        if not quota.add_usage(usage_delta, validate=validate):
             raise exceptions.QuotaValidationError(
                 _('%(quota)s "%(name)s" quota is over limit. Required: %(usage)s, limit: %(limit)s.') % dict(
                     quota=self, name=quota_name, usage=quota.usage + usage_delta, limit=quota.limit))
-        quota.usage += usage_delta
-        quota.save(update_fields=['usage'])
 
     def get_quota_ancestors(self):
         if isinstance(self, DescendantMixin):
@@ -185,7 +464,7 @@ class QuotaModelMixin(models.Model):
         """
         errors = []
         for name, delta in quota_deltas.iteritems():
-            quota = self.quotas.get(name=name)
+            quota = self.get_quota(name)
             if quota.is_exceeded(delta):
                 errors.append('%s quota limit: %s, requires %s (%s)\n' % (
                     quota.name, quota.limit, quota.usage + delta, quota.scope))
@@ -212,46 +491,51 @@ class QuotaModelMixin(models.Model):
             'quota_name1_usage': 'sum of usages for quotas with such quota_name1',
             ...
         }
-        All `scopes` have to be instances of the same model.
+        All `scopes` have to be instances of the same model, queryset of scopes is accepted too.
         `fields` keyword argument defines sum of which fields of quotas will present in result.
+
+        Result is cached until any of summarized quotas is changed.
         """
-        if not scopes:
+        if isinstance(scopes, models.QuerySet):
+            scope_model = scopes.model
+            scopes_ids = list(scopes.values_list('pk', flat=True))
+        else:
+            scope_models = set([scope._meta.model for scope in scopes])
+            if len(scope_models) > 1:
+                raise exceptions.QuotaError(_('All scopes have to be instances of the same model.'))
+            scope_model = scope_models.pop() if scope_models else None
+            scopes_ids = [scope.pk for scope in scopes]
+
+        if not scopes_ids:
             return {}
 
         if quota_names is None:
             quota_names = cls.get_quotas_names()
 
-        scope_models = set([scope._meta.model for scope in scopes])
-        if len(scope_models) > 1:
-            raise exceptions.QuotaError(_('All scopes have to be instances of the same model.'))
+        content_type = ct_models.ContentType.objects.get_for_model(scope_model)
+        cache_key = _get_sum_of_quotas_cache_key(content_type.id, scopes_ids, quota_names, fields)
+        result = cache.get(cache_key)
+        if result is None:
+            result = cls._calculate_sum_of_quotas(content_type, scopes_ids, quota_names, fields)
+            cache.set(cache_key, result, SUM_OF_QUOTAS_CACHE_TIMEOUT)
+        return result
 
-        filter_kwargs = {
-            'content_type': ct_models.ContentType.objects.get_for_model(scopes[0]),
-            'object_id__in': [scope.id for scope in scopes],
-            'name__in': quota_names
-        }
+    @classmethod
+    def _calculate_sum_of_quotas(cls, content_type, scopes_ids, quota_names, fields):
+        """ Sum usages and limits with one query, sum of limits is -1 if any of quotas is unlimited """
+        items = (Quota.objects
+                 .filter(content_type=content_type, object_id__in=scopes_ids, name__in=quota_names)
+                 .order_by()
+                 .values('name')
+                 .annotate(usage=Sum('usage'), limit=Sum('limit'), unlimited_count=Sum(
+                     Case(When(limit=-1, then=1), default=0, output_field=IntegerField()))))
 
         result = {}
-        if 'usage' in fields:
-            items = Quota.objects.filter(**filter_kwargs)\
-                         .values('name').annotate(usage=Sum('usage'))
-            for item in items:
+        for item in items:
+            if 'usage' in fields:
                 result[item['name'] + '_usage'] = item['usage']
-
-        if 'limit' in fields:
-            unlimited_quotas = Quota.objects.filter(limit=-1, **filter_kwargs)
-            unlimited_quotas = list(unlimited_quotas.values_list('name', flat=True))
-            for quota_name in unlimited_quotas:
-                result[quota_name] = -1
-
-            items = Quota.objects\
-                         .filter(**filter_kwargs)\
-                         .exclude(name__in=unlimited_quotas)\
-                         .values('name')\
-                         .annotate(limit=Sum('limit'))
-            for item in items:
-                result[item['name']] = item['limit']
-
+            if 'limit' in fields:
+                result[item['name']] = -1 if item['unlimited_count'] else item['limit']
         return result
 
     @classmethod
@@ -6,6 +6,7 @@ from nodeconductor.core.serializers import GenericRelatedField
 
 class QuotaSerializer(serializers.HyperlinkedModelSerializer):
     scope = GenericRelatedField(related_models=utils.get_models_with_quotas(), read_only=True)
+    usage = serializers.ReadOnlyField(source='get_usage')
 
     class Meta(object):
         model = models.Quota
@@ -0,0 +1,22 @@
+from __future__ import unicode_literals
+
+from celery import shared_task
+
+from nodeconductor.quotas import models
+
+
+@shared_task(name='nodeconductor.quotas.apply_usage_deltas')
+def apply_usage_deltas(deltas):
+    """ Write usage deltas propagated from children quotas to aggregator quotas.
+
+        deltas - dictionary {<quota id>: <usage delta>}.
+    """
+    models.apply_usage_deltas({int(quota_id): delta for quota_id, delta in deltas.items()})
+
+
+@shared_task(name='nodeconductor.quotas.compact_usage_stripes')
+def compact_usage_stripes():
+    """ Move usage of stripes to global quotas """
+    quotas_ids = models.QuotaUsageStripe.objects.exclude(usage=0).values_list('quota', flat=True).distinct()
+    for quota in models.Quota.objects.filter(pk__in=list(quotas_ids)):
+        quota.compact_usage_stripes()
@@ -10,9 +10,20 @@ class GrandparentModel(core_models.UuidMixin, quotas_models.QuotaModelMixin, cor
         quota_with_default_limit = fields.QuotaField(default_limit=100)
         usage_aggregator_quota = fields.UsageAggregatorQuotaField(
             get_children=lambda scope: ChildModel.objects.filter(parent__parent=scope),
+            child_model=lambda: ChildModel,
+            path_to_scope='parent.parent',
         )
         limit_aggregator_quota = fields.LimitAggregatorQuotaField(
             get_children=lambda scope: ChildModel.objects.filter(parent__parent=scope),
+            child_model=lambda: ChildModel,
+            path_to_scope='parent.parent',
+        )
+        # aggregates parents quota that does not have hints
+        parents_usage_aggregator_quota = fields.UsageAggregatorQuotaField(
+            get_children=lambda scope: scope.children.all(),
+            child_quota_name='second_usage_aggregator_quota',
+            child_model=lambda: ParentModel,
+            path_to_scope='parent',
         )
 
     regular_quota = fields.QuotaLimitField(quota_field=Quotas.regular_quota)
@@ -32,11 +43,16 @@ class ParentModel(core_models.UuidMixin, quotas_models.QuotaModelMixin, core_mod
         )
         usage_aggregator_quota = fields.UsageAggregatorQuotaField(
             get_children=lambda scope: scope.children.all(),
+            child_model=lambda: ChildModel,
+            path_to_scope='parent',
         )
         limit_aggregator_quota = fields.LimitAggregatorQuotaField(
             get_children=lambda scope: scope.children.all(),
+            child_model=lambda: ChildModel,
+            path_to_scope='parent',
             default_limit=0,
         )
+        # child model of this quota is derived from scope children
         second_usage_aggregator_quota = fields.UsageAggregatorQuotaField(
             get_children=lambda scope: scope.children.all(),
             child_quota_name='usage_aggregator_quota',
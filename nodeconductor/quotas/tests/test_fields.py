@@ -1,5 +1,4 @@
 from django.test import TransactionTestCase
-from reversion.models import Version
 
 from nodeconductor.core.utils import silent_call
 from . import models as test_models
@@ -21,21 +20,28 @@ class TestQuotaField(TransactionTestCase):
         child.save()
         self.assertEqual(child.quotas.get(name='regular_quota').limit, 9)
 
-    # XXX: Ideally this method should belong to ReversionMixin tests and
-    #      should be separated into several smaller tests.
-    def test_quota_versions(self):
+    def test_quota_sample_is_stored_on_quota_change(self):
         scope = test_models.GrandparentModel.objects.create()
         quota = scope.quotas.get(name=test_models.GrandparentModel.Quotas.regular_quota)
         quota.usage = 13.0
         quota.save()
-        # make sure that new version was created after quota usage change.
-        latest_version = Version.objects.get_for_object(quota).latest('revision__date_created')
-        self.assertEqual(latest_version._object_version.object.usage, quota.usage)
-        # make sure that new version was not created if object was saved without data change.
+
+        latest_sample = quota.samples.latest('timestamp')
+        self.assertEqual(latest_sample.usage, quota.usage)
+
+    def test_quota_sample_is_not_stored_if_values_are_not_changed(self):
+        scope = test_models.GrandparentModel.objects.create()
+        quota = scope.quotas.get(name=test_models.GrandparentModel.Quotas.regular_quota)
+        quota.usage = 13.0
+        quota.save()
+        samples_count = quota.samples.count()
+
         quota.usage = 13
         quota.save()
-        new_latest_version = Version.objects.get_for_object(quota).latest('revision__date_created')
-        self.assertEqual(new_latest_version, latest_version)
+        quota.threshold = 10
+        quota.save(update_fields=['threshold'])
+
+        self.assertEqual(quota.samples.count(), samples_count)
 
 
 class TestCounterQuotaField(TransactionTestCase):
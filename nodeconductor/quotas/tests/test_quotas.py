@@ -1,11 +1,13 @@
 from datetime import timedelta
 
 from ddt import ddt, data
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from rest_framework import test, status
-from reversion.models import Version
 
 from nodeconductor.core import utils as core_utils
+from nodeconductor.quotas import models
 from nodeconductor.quotas.tests import factories
 from nodeconductor.structure import models as structure_models
 from nodeconductor.structure.tests import (factories as structure_factories,
@@ -41,6 +43,34 @@ class QuotaUpdateTest(test.APITransactionTestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
+class QuotaListTest(test.APITransactionTestCase):
+
+    def setUp(self):
+        self.staff = structure_factories.UserFactory(is_staff=True)
+        self.client.force_authenticate(self.staff)
+
+    def test_usage_stripes_are_not_queried_for_each_quota(self):
+        structure_factories.CustomerFactory.create_batch(3)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(factories.QuotaFactory.get_list_url())
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stripes_table = models.QuotaUsageStripe._meta.db_table
+        stripes_queries = [query for query in context.captured_queries if stripes_table in query['sql']]
+        # stripes usage is annotated by the quotas query
+        self.assertEqual(len(stripes_queries), 1)
+
+    def test_usage_of_global_quota_includes_stripes(self):
+        quota = models.Quota.objects.get(name=structure_models.Customer.GLOBAL_COUNT_QUOTA_NAME)
+        usage = quota.get_usage()
+        structure_factories.CustomerFactory.create_batch(2)
+
+        response = self.client.get(factories.QuotaFactory.get_url(quota))
+
+        self.assertEqual(response.data['usage'], usage + 2)
+
+
 class QuotaHistoryTest(test.APITransactionTestCase):
 
     def setUp(self):
@@ -50,10 +80,8 @@ class QuotaHistoryTest(test.APITransactionTestCase):
 
         self.quota = factories.QuotaFactory(scope=self.customer)
         self.url = factories.QuotaFactory.get_url(self.quota, 'history')
-        # Hook for test: lets say that revision was created one hour ago
-        version = Version.objects.get_for_object(self.quota).filter(revision__date_created__lte=timezone.now()).first()
-        version.revision.date_created = timezone.now() - timedelta(hours=1)
-        version.revision.save()
+        # Hook for test: lets say that quota was created one hour ago
+        self.quota.samples.update(timestamp=timezone.now() - timedelta(hours=1))
 
     def test_old_version_of_quota_is_available(self):
         old_usage = self.quota.usage
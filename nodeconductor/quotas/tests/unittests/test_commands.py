@@ -1,6 +1,16 @@
+from datetime import timedelta
+
+from django.contrib.contenttypes.models import ContentType
+from django.core import serializers
 from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+from reversion.models import Revision, Version
 
+from nodeconductor.quotas.management.commands import recalculatequotas
+from nodeconductor.quotas.models import Quota
+from nodeconductor.quotas.tests import models as test_models
 from nodeconductor.structure.tests import factories as structure_factories
 
 
@@ -23,3 +33,125 @@ class RecalculateCommandTest(TestCase):
 
         call_command('recalculatequotas')
         self.assertEqual(customer.quotas.get(name='nc_resource_count').usage, 0)
+
+    def test_usage_is_not_changed_in_dry_run_mode(self):
+        customer = structure_factories.CustomerFactory()
+        structure_factories.ProjectFactory(customer=customer)
+        customer.quotas.filter(name='nc_project_count').update(usage=10)
+
+        out = StringIO()
+        call_command('recalculatequotas', dry_run=True, stdout=out)
+
+        self.assertEqual(customer.quotas.get(name='nc_project_count').usage, 10)
+        self.assertIn('nc_project_count quota of structure.Customer #%s: 10.0 -> 1' % customer.pk, out.getvalue())
+
+    def test_only_selected_quotas_are_recalculated(self):
+        customer = structure_factories.CustomerFactory()
+        structure_factories.ProjectFactory(customer=customer)
+        customer.quotas.filter(name__in=['nc_project_count', 'nc_app_count']).update(usage=10)
+
+        call_command('recalculatequotas', models=['structure.Customer'], quotas=['nc_project_count'])
+
+        self.assertEqual(customer.quotas.get(name='nc_project_count').usage, 1)
+        self.assertEqual(customer.quotas.get(name='nc_app_count').usage, 10)
+
+    def test_only_selected_missing_quotas_are_initialized(self):
+        customer = structure_factories.CustomerFactory()
+        customer.quotas.filter(name__in=['nc_project_count', 'nc_app_count']).delete()
+
+        call_command('recalculatequotas', models=['structure.Customer'], quotas=['nc_project_count'])
+
+        self.assertTrue(customer.quotas.filter(name='nc_project_count').exists())
+        self.assertFalse(customer.quotas.filter(name='nc_app_count').exists())
+
+
+class RecalculateAggregatorQuotasTest(TestCase):
+
+    def setUp(self):
+        self.grandparent = test_models.GrandparentModel.objects.create()
+        self.parents = [test_models.ParentModel.objects.create(parent=self.grandparent) for _ in range(2)]
+        for parent in self.parents:
+            for usage in (1, 2):
+                child = test_models.ChildModel.objects.create(parent=parent)
+                child.set_quota_usage('usage_aggregator_quota', usage)
+                child.set_quota_limit('limit_aggregator_quota', usage)
+        for scope in self.parents + [self.grandparent]:
+            scope.quotas.exclude(name='regular_quota').update(usage=100)
+
+    def get_usage(self, scope, name):
+        return scope.quotas.get(name=name).usage
+
+    def test_aggregators_are_calculated_for_all_scopes(self):
+        call_command('recalculatequotas')
+
+        for parent in self.parents:
+            self.assertEqual(self.get_usage(parent, 'counter_quota'), 2)
+            self.assertEqual(self.get_usage(parent, 'usage_aggregator_quota'), 3)
+            self.assertEqual(self.get_usage(parent, 'second_usage_aggregator_quota'), 3)
+            self.assertEqual(self.get_usage(parent, 'limit_aggregator_quota'), 3)
+        self.assertEqual(self.get_usage(self.grandparent, 'usage_aggregator_quota'), 6)
+        self.assertEqual(self.get_usage(self.grandparent, 'limit_aggregator_quota'), 6)
+
+    def test_aggregator_is_calculated_after_child_aggregator_without_hints(self):
+        call_command('recalculatequotas', models=[test_models.GrandparentModel._meta.label,
+                                                  test_models.ParentModel._meta.label])
+
+        self.assertEqual(self.get_usage(self.grandparent, 'parents_usage_aggregator_quota'), 6)
+
+    def test_child_model_of_aggregator_without_hints_is_derived_from_children(self):
+        field = test_models.ParentModel.Quotas.second_usage_aggregator_quota
+
+        child_model = recalculatequotas.Command().get_child_model(test_models.ParentModel, field)
+
+        self.assertEqual(child_model, test_models.ChildModel)
+
+    def test_number_of_queries_does_not_depend_on_number_of_scopes(self):
+        label = test_models.ParentModel._meta.label
+        call_command('recalculatequotas', models=[label], quotas=['usage_aggregator_quota'], dry_run=True)
+
+        with self.assertNumQueries(2):
+            call_command('recalculatequotas', models=[label], quotas=['usage_aggregator_quota'], dry_run=True)
+
+        test_models.ParentModel.objects.create(parent=self.grandparent)
+        with self.assertNumQueries(2):
+            call_command('recalculatequotas', models=[label], quotas=['usage_aggregator_quota'], dry_run=True)
+
+
+class MigrateQuotasHistoryTest(TestCase):
+
+    def setUp(self):
+        self.scope = test_models.GrandparentModel.objects.create()
+        self.quota = self.scope.quotas.get(name='regular_quota')
+        self.now = timezone.now()
+
+    def create_version(self, usage, date_created):
+        self.quota.usage = usage
+        revision = Revision.objects.create(date_created=date_created)
+        Version.objects.create(
+            revision=revision,
+            object_id=str(self.quota.pk),
+            content_type=ContentType.objects.get_for_model(Quota),
+            db='default',
+            format='json',
+            serialized_data=serializers.serialize('json', [self.quota]),
+            object_repr=str(self.quota),
+        )
+
+    def test_versions_older_than_first_sample_are_copied(self):
+        self.quota.samples.update(timestamp=self.now)
+        self.create_version(1, self.now - timedelta(days=2))
+        self.create_version(2, self.now - timedelta(days=1))
+        self.create_version(3, self.now + timedelta(days=1))
+
+        call_command('migratequotashistory', stdout=StringIO())
+
+        self.assertEqual(list(self.quota.samples.order_by('timestamp').values_list('usage', flat=True)), [1, 2, 0])
+
+    def test_command_does_not_duplicate_samples(self):
+        self.quota.samples.update(timestamp=self.now)
+        self.create_version(1, self.now - timedelta(days=2))
+
+        call_command('migratequotashistory', stdout=StringIO())
+        call_command('migratequotashistory', stdout=StringIO())
+
+        self.assertEqual(self.quota.samples.count(), 2)
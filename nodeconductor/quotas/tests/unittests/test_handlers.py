@@ -1,6 +1,8 @@
 from django.test import TestCase
+import mock
 
-from nodeconductor.quotas import models
+from nodeconductor.quotas import models, utils
+from nodeconductor.quotas.tests import models as test_models
 from nodeconductor.structure import models as structure_models
 from nodeconductor.structure.tests import factories as structure_factories
 
@@ -9,17 +11,71 @@ class GlobalQuotasHandlersTestCase(TestCase):
 
     def test_project_global_quota_increased_after_project_creation(self):
         quota = models.Quota.objects.get(name=structure_models.Project.GLOBAL_COUNT_QUOTA_NAME)
+        usage = quota.get_usage()
 
         structure_factories.ProjectFactory()
 
         reread_quota = models.Quota.objects.get(pk=quota.pk)
-        self.assertEqual(reread_quota.usage, quota.usage + 1)
+        self.assertEqual(reread_quota.get_usage(), usage + 1)
 
     def test_project_global_quota_decreased_after_project_deletion(self):
         project = structure_factories.ProjectFactory()
         quota = models.Quota.objects.get(name=structure_models.Project.GLOBAL_COUNT_QUOTA_NAME)
+        usage = quota.get_usage()
 
         project.delete()
 
         reread_quota = models.Quota.objects.get(pk=quota.pk)
-        self.assertEqual(reread_quota.usage, quota.usage - 1)
+        self.assertEqual(reread_quota.get_usage(), usage - 1)
+
+    def test_global_quota_row_is_not_updated_on_project_creation(self):
+        quota = models.Quota.objects.get(name=structure_models.Project.GLOBAL_COUNT_QUOTA_NAME)
+
+        structure_factories.ProjectFactory()
+
+        reread_quota = models.Quota.objects.get(pk=quota.pk)
+        self.assertEqual(reread_quota.usage, quota.usage)
+        self.assertEqual(reread_quota.stripes.count(), 1)
+
+
+class InitQuotasTest(TestCase):
+
+    def test_quotas_are_created_with_one_insert(self):
+        test_models.GrandparentModel.objects.bulk_create([test_models.GrandparentModel() for _ in range(3)])
+        scopes = list(test_models.GrandparentModel.objects.all())
+
+        # savepoint, select of existing quotas, insert, select of inserted quotas ids (sqlite only),
+        # insert of history samples, release
+        with self.assertNumQueries(6):
+            utils.init_quotas_for(scopes)
+
+    def test_quotas_are_created_for_bulk_created_scopes(self):
+        test_models.GrandparentModel.objects.bulk_create([test_models.GrandparentModel() for _ in range(3)])
+        scopes = test_models.GrandparentModel.objects.all()
+
+        utils.init_quotas_for(scopes)
+
+        quotas_names = {field.name for field in test_models.GrandparentModel.get_quotas_fields()}
+        for scope in scopes:
+            self.assertEqual(set(scope.quotas.values_list('name', flat=True)), quotas_names)
+            self.assertEqual(scope.quotas.get(name='quota_with_default_limit').limit, 100)
+
+    def test_existing_quotas_are_not_duplicated(self):
+        scope = test_models.GrandparentModel.objects.create()
+        scope.quotas.filter(name='regular_quota').delete()
+
+        created_quotas = utils.init_quotas_for([scope])
+
+        self.assertEqual([quota.name for quota in created_quotas], ['regular_quota'])
+        self.assertEqual(scope.quotas.filter(name='quota_with_default_limit').count(), 1)
+
+    def test_aggregator_quotas_take_initial_values_into_account(self):
+        grandparent = test_models.GrandparentModel.objects.create()
+        parent = test_models.ParentModel.objects.create(parent=grandparent)
+        test_models.ChildModel.objects.bulk_create([test_models.ChildModel(parent=parent)])
+        models.Quota.objects.filter(name='limit_aggregator_quota').update(limit=0)
+
+        with mock.patch.object(test_models.ChildModel.Quotas.limit_aggregator_quota, 'default_limit', 5):
+            utils.init_quotas_for(test_models.ChildModel.objects.all())
+
+        self.assertEqual(parent.quotas.get(name='limit_aggregator_quota').usage, 5)
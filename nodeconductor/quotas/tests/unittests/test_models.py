@@ -1,9 +1,14 @@
 import random
+from datetime import timedelta
 
-from django.test import TestCase
+from django.conf import settings
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+import mock
 
-from ..models import GrandparentModel
-from ... import exceptions
+from ..models import GrandparentModel, ParentModel, ChildModel
+from ... import exceptions, models, tasks
 
 
 class QuotaModelMixinTest(TestCase):
@@ -31,6 +36,30 @@ class QuotaModelMixinTest(TestCase):
                           usage_delta=200,
                           validate=True)
 
+    def test_quotas_are_loaded_with_one_query(self):
+        instance = GrandparentModel.objects.get(pk=GrandparentModel.objects.create().pk)
+
+        with self.assertNumQueries(1):
+            for quota_name in instance.get_quotas_names():
+                instance.get_quota(quota_name)
+            self.assertEqual(instance.regular_quota, -1)
+
+    def test_prefetched_quotas_are_used(self):
+        GrandparentModel.objects.create()
+        instance = GrandparentModel.objects.prefetch_related('quotas').first()
+
+        with self.assertNumQueries(0):
+            instance.get_quota('regular_quota')
+
+    def test_quota_map_stays_coherent_after_write(self):
+        instance = GrandparentModel.objects.create()
+        instance.set_quota_limit('regular_quota', 10)
+        instance.add_quota_usage('regular_quota', 5)
+
+        self.assertEqual(instance.get_quota('regular_quota').limit, 10)
+        self.assertEqual(instance.get_quota('regular_quota').usage, 5)
+        self.assertEqual(instance.quotas.get(name='regular_quota').usage, 5)
+
     def test_quotas_sum_calculation_if_all_values_are_positive(self):
         # we have 3 memberships:
         instances = [GrandparentModel.objects.create() for _ in range(3)]
@@ -72,3 +101,227 @@ class QuotaModelMixinTest(TestCase):
         sum_of_quotas = GrandparentModel.get_sum_of_quotas_as_dict(
             instances, quota_names=['regular_quota'], fields=['limit'])
         self.assertEqual({'regular_quota': -1}, sum_of_quotas)
+
+    def test_quotas_sum_is_calculated_with_one_query(self):
+        instances = [GrandparentModel.objects.create() for _ in range(3)]
+        for instance in instances:
+            instance.set_quota_limit('regular_quota', 10)
+            instance.set_quota_usage('regular_quota', 5)
+        scopes = GrandparentModel.objects.filter(pk__in=[instance.pk for instance in instances])
+
+        # select of scopes ids and aggregation of quotas
+        with self.assertNumQueries(2):
+            sum_of_quotas = GrandparentModel.get_sum_of_quotas_as_dict(scopes, quota_names=['regular_quota'])
+        self.assertEqual({'regular_quota': 30, 'regular_quota_usage': 15}, sum_of_quotas)
+
+    def test_cached_quotas_sum_is_returned_without_quotas_query(self):
+        instances = [GrandparentModel.objects.create() for _ in range(2)]
+        GrandparentModel.get_sum_of_quotas_as_dict(instances, quota_names=['regular_quota'])
+
+        with self.assertNumQueries(0):
+            GrandparentModel.get_sum_of_quotas_as_dict(instances, quota_names=['regular_quota'])
+
+    def test_cached_quotas_sum_is_expired_after_quota_update(self):
+        instances = [GrandparentModel.objects.create() for _ in range(2)]
+        instances[0].set_quota_usage('regular_quota', 5)
+        GrandparentModel.get_sum_of_quotas_as_dict(instances, quota_names=['regular_quota'])
+
+        instances[1].set_quota_usage('regular_quota', 3)
+
+        sum_of_quotas = GrandparentModel.get_sum_of_quotas_as_dict(instances, quota_names=['regular_quota'])
+        self.assertEqual(sum_of_quotas['regular_quota_usage'], 8)
+
+    def test_cached_quotas_sum_of_other_scopes_is_not_expired_after_quota_update(self):
+        instances = [GrandparentModel.objects.create() for _ in range(3)]
+        GrandparentModel.get_sum_of_quotas_as_dict(instances[:2], quota_names=['regular_quota'])
+
+        instances[2].set_quota_usage('regular_quota', 3)
+
+        with self.assertNumQueries(0):
+            GrandparentModel.get_sum_of_quotas_as_dict(instances[:2], quota_names=['regular_quota'])
+
+
+class QuotaUsageDeltasTest(TransactionTestCase):
+
+    def setUp(self):
+        nodeconductor_settings = settings.NODECONDUCTOR.copy()
+        nodeconductor_settings['COALESCE_QUOTA_USAGE_DELTAS'] = True
+        self.settings_override = self.settings(NODECONDUCTOR=nodeconductor_settings)
+        self.settings_override.enable()
+        self.instance = GrandparentModel.objects.create()
+
+    def tearDown(self):
+        self.settings_override.disable()
+
+    def get_usage(self, quota_name='regular_quota'):
+        return self.instance.quotas.get(name=quota_name).usage
+
+    def test_deltas_are_written_on_commit(self):
+        with transaction.atomic():
+            self.instance.add_quota_usage('regular_quota', 1)
+            self.instance.add_quota_usage('regular_quota', 2)
+            self.assertEqual(self.get_usage(), 0)
+
+        self.assertEqual(self.get_usage(), 3)
+
+    def test_deltas_are_discarded_on_rollback(self):
+        try:
+            with transaction.atomic():
+                self.instance.add_quota_usage('regular_quota', 1)
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(self.get_usage(), 0)
+
+    def test_validation_takes_pending_deltas_into_account(self):
+        with transaction.atomic():
+            self.instance.add_quota_usage('quota_with_default_limit', 60)
+            with self.assertRaises(exceptions.QuotaValidationError):
+                self.instance.add_quota_usage('quota_with_default_limit', 60, validate=True)
+            self.instance.add_quota_usage('quota_with_default_limit', 40, validate=True)
+
+        self.assertEqual(self.get_usage('quota_with_default_limit'), 100)
+
+    def test_deltas_of_rolled_back_savepoint_are_discarded(self):
+        with transaction.atomic():
+            self.instance.add_quota_usage('regular_quota', 1)
+            try:
+                with transaction.atomic():
+                    self.instance.add_quota_usage('regular_quota', 2)
+                    raise ValueError()
+            except ValueError:
+                pass
+            self.instance.add_quota_usage('regular_quota', 4)
+
+        self.assertEqual(self.get_usage(), 5)
+
+    def test_validated_usage_of_rolled_back_savepoint_is_not_written(self):
+        with transaction.atomic():
+            self.instance.add_quota_usage('quota_with_default_limit', 10)
+            try:
+                with transaction.atomic():
+                    self.instance.add_quota_usage('quota_with_default_limit', 20)
+                    self.instance.add_quota_usage('quota_with_default_limit', 30, validate=True)
+                    raise ValueError()
+            except ValueError:
+                pass
+
+        self.assertEqual(self.get_usage('quota_with_default_limit'), 10)
+
+
+class AggregatorQuotasPropagationTest(TransactionTestCase):
+
+    def setUp(self):
+        self.nodeconductor_settings = settings.NODECONDUCTOR.copy()
+        self.nodeconductor_settings['COALESCE_QUOTA_USAGE_DELTAS'] = True
+        self.settings_override = self.settings(NODECONDUCTOR=self.nodeconductor_settings)
+        self.settings_override.enable()
+        self.grandparent = GrandparentModel.objects.create()
+        self.parent = ParentModel.objects.create(parent=self.grandparent)
+        self.children = [ChildModel.objects.create(parent=self.parent) for _ in range(3)]
+
+    def tearDown(self):
+        self.settings_override.disable()
+
+    def get_usage(self, scope, quota_name='usage_aggregator_quota'):
+        return scope.quotas.get(name=quota_name).usage
+
+    def test_children_deltas_are_propagated_on_commit(self):
+        with transaction.atomic():
+            for child in self.children:
+                child.set_quota_usage('usage_aggregator_quota', 2)
+            self.assertEqual(self.get_usage(self.parent), 0)
+
+        self.assertEqual(self.get_usage(self.parent), 6)
+        self.assertEqual(self.get_usage(self.grandparent), 6)
+
+    def test_aggregator_quota_is_updated_once_per_transaction(self):
+        parent_quota = self.parent.quotas.get(name='usage_aggregator_quota')
+
+        with mock.patch('nodeconductor.quotas.models._notify_usage_changes') as notify:
+            with transaction.atomic():
+                for child in self.children:
+                    child.set_quota_usage('usage_aggregator_quota', 1)
+
+        notified_quotas = [quota_id for call in notify.call_args_list for quota_id in call[0][0]]
+        self.assertEqual(notified_quotas.count(parent_quota.pk), 1)
+
+    def test_deltas_are_propagated_by_celery_task_in_async_mode(self):
+        self.nodeconductor_settings['ASYNC_QUOTA_PROPAGATION'] = True
+
+        with mock.patch('nodeconductor.quotas.tasks.apply_usage_deltas') as task:
+            with transaction.atomic():
+                for child in self.children:
+                    child.set_quota_usage('usage_aggregator_quota', 2)
+
+        parent_quota = self.parent.quotas.get(name='usage_aggregator_quota')
+        self.assertEqual(task.delay.call_count, 1)
+        self.assertEqual(task.delay.call_args[0][0][str(parent_quota.pk)], 6)
+        self.assertEqual(parent_quota.usage, 0)
+
+
+class QuotaUsageStripesTest(TestCase):
+
+    def setUp(self):
+        self.quota = models.Quota.objects.create(name='test_global_quota')
+
+    def test_striped_usage_is_not_written_to_quota_row(self):
+        for _ in range(20):
+            self.quota.add_striped_usage(1)
+
+        quota = models.Quota.objects.get(pk=self.quota.pk)
+        self.assertEqual(quota.usage, 0)
+        self.assertEqual(quota.get_usage(), 20)
+        self.assertLessEqual(quota.stripes.count(), models.QuotaUsageStripe.COUNT)
+
+    def test_compaction_moves_stripes_usage_to_quota(self):
+        for _ in range(5):
+            self.quota.add_striped_usage(1)
+        self.quota.add_striped_usage(-2)
+
+        tasks.compact_usage_stripes()
+
+        quota = models.Quota.objects.get(pk=self.quota.pk)
+        self.assertEqual(quota.usage, 3)
+        self.assertEqual(quota.get_usage(), 3)
+        self.assertFalse(quota.stripes.exclude(usage=0).exists())
+
+    def test_reset_usage_clears_stripes(self):
+        self.quota.add_striped_usage(5)
+
+        self.quota.reset_usage(2)
+
+        self.assertEqual(models.Quota.objects.get(pk=self.quota.pk).get_usage(), 2)
+
+
+class QuotaSampleTimelinesTest(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.quotas = [models.Quota.objects.create(name='test_quota_%s' % index) for index in range(2)]
+        models.QuotaSample.objects.all().delete()
+
+    def create_sample(self, quota, days_ago, usage):
+        models.QuotaSample.objects.create(
+            quota=quota, timestamp=self.now - timedelta(days=days_ago), limit=-1, usage=usage)
+
+    def test_values_are_taken_from_last_sample_before_each_point(self):
+        first_quota, second_quota = self.quotas
+        for days_ago, usage in ((10, 1), (5, 2), (1, 3)):
+            self.create_sample(first_quota, days_ago, usage)
+        self.create_sample(second_quota, 20, 4)
+        points = [self.now - timedelta(days=days_ago) for days_ago in (6, 3, 0)]
+
+        with self.assertNumQueries(2):
+            timelines = models.QuotaSample.objects.get_timelines([quota.pk for quota in self.quotas], points)
+
+        self.assertEqual(timelines[first_quota.pk], [(-1, 1), (-1, 2), (-1, 3)])
+        self.assertEqual(timelines[second_quota.pk], [(-1, 4)] * 3)
+
+    def test_values_are_empty_before_first_sample(self):
+        self.create_sample(self.quotas[0], 2, 1)
+        points = [self.now - timedelta(days=days_ago) for days_ago in (3, 1)]
+
+        self.assertEqual(models.QuotaSample.objects.get_values_at(self.quotas[0], points), [None, (-1, 1)])
+        self.assertEqual(models.QuotaSample.objects.get_values_at(self.quotas[1], points), [None, None])
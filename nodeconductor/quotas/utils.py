@@ -1,6 +1,72 @@
+from collections import defaultdict
+
 from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import signals
+
 from nodeconductor.quotas import models
 
 
 def get_models_with_quotas():
     return [m for m in apps.get_models() if issubclass(m, models.QuotaModelMixin)]
+
+
+def init_quotas_for(scopes, quota_names=None):
+    """ Create missing quotas of given scopes with one bulk insert per model.
+
+        Use it for scopes created via bulk_create, post_save signals are not sent for them.
+        Accepts queryset or list of model instances. post_save signal is sent for each created
+        quota, so aggregator quotas and other quotas handlers work as usual.
+        Initial quotas values are stored in history with one bulk insert too.
+        If quota_names is defined only quotas with given names are created.
+        Return list of created quotas.
+    """
+    scopes_by_model = defaultdict(list)
+    for scope in scopes:
+        scopes_by_model[type(scope)].append(scope)
+
+    created_quotas = []
+    with transaction.atomic():
+        for model, model_scopes in scopes_by_model.items():
+            created_quotas.extend(_init_model_quotas(model, model_scopes, quota_names))
+        models.QuotaSample.objects.bulk_create(
+            [models.QuotaSample(quota=quota, limit=quota.limit, usage=quota.usage) for quota in created_quotas])
+
+    for quota in created_quotas:
+        quota._sample_values = (quota.limit, quota.usage)
+        signals.post_save.send(sender=models.Quota, instance=quota, created=True, update_fields=None, raw=False,
+                               using=quota._state.db)
+    return created_quotas
+
+
+def _init_model_quotas(model, scopes, quota_names=None):
+    content_type = ContentType.objects.get_for_model(model)
+    scopes_map = {scope.pk: scope for scope in scopes}
+    existing_quotas = defaultdict(list)
+    for quota in models.Quota.objects.filter(content_type=content_type, object_id__in=scopes_map.keys()):
+        existing_quotas[quota.object_id].append(quota)
+
+    new_quotas = []
+    quotas_fields = [field for field in model.get_quotas_fields() if quota_names is None or field.name in quota_names]
+    for scope in scopes:
+        existing_names = {quota.name for quota in existing_quotas[scope.pk]}
+        for field in quotas_fields:
+            if field.name not in existing_names and field.is_connected_to_scope(scope):
+                new_quotas.append(models.Quota(
+                    content_type=content_type, object_id=scope.pk, name=field.name, **field.get_defaults(scope)))
+    if not new_quotas:
+        return []
+
+    models.Quota.objects.bulk_create(new_quotas)
+    if any(quota.pk is None for quota in new_quotas):
+        # not all databases return ids of inserted rows
+        new_quotas = list(models.Quota.objects.filter(
+            content_type=content_type, object_id__in=scopes_map.keys(), name__in={q.name for q in new_quotas})
+            .exclude(pk__in=[q.pk for quotas in existing_quotas.values() for q in quotas]))
+
+    for quota in new_quotas:
+        existing_quotas[quota.object_id].append(quota)
+    for scope in scopes:
+        scope._init_quotas_map(existing_quotas[scope.pk])
+    return new_quotas
@@ -4,8 +4,6 @@ from django.utils.translation import ugettext_lazy as _
 from rest_framework import exceptions as rf_exceptions, decorators, response, status
 from rest_framework import mixins
 from rest_framework import viewsets
-from reversion import revisions as reversion
-from reversion.models import Version
 
 from nodeconductor.core.pagination import UnlimitedLinkHeaderPagination
 from nodeconductor.core.serializers import HistorySerializer
@@ -23,7 +21,8 @@ class QuotaViewSet(mixins.UpdateModelMixin,
     filter_class = filters.QuotaFilterSet
 
     def get_queryset(self):
-        return models.Quota.objects.filtered_for_user(self.request.user)
+        queryset = models.Quota.objects.filtered_for_user(self.request.user)
+        return models.Quota.objects.with_stripes_usage(queryset)
 
     def list(self, request, *args, **kwargs):
         """
@@ -82,7 +81,7 @@ class QuotaViewSet(mixins.UpdateModelMixin,
 
         if 'limit' in serializer.validated_data:
             limit = serializer.validated_data['limit']
-            if limit != -1 and quota.usage > limit:
+            if limit != -1 and quota.get_usage() > limit:
                 raise rf_exceptions.ValidationError(_('Current quota usage exceeds new limit.'))
             quota.scope.set_quota_limit(quota.name, limit)
             serializer.instance.refresh_from_db()
@@ -137,16 +136,13 @@ class QuotaViewSet(mixins.UpdateModelMixin,
 
         quota = self.get_object()
         serializer = self.get_serializer(quota)
+        points = history_serializer.get_filter_data()
         serialized_versions = []
-        for point_date in history_serializer.get_filter_data():
+        for point_date, values in zip(points, models.QuotaSample.objects.get_values_at(quota, points)):
             serialized = {'point': datetime_to_timestamp(point_date)}
-            version = Version.objects.get_for_object(quota).filter(revision__date_created__lte=point_date)
-            if version.exists():
-                # make copy of serialized data and update field that are stored in version
-                version_object = version.first()._object_version.object
+            if values is not None:
+                # make copy of serialized data and update field that are stored in history
                 serialized['object'] = serializer.data.copy()
-                serialized['object'].update({
-                    f: getattr(version_object, f) for f in quota.get_version_fields()
-                })
+                serialized['object']['limit'], serialized['object']['usage'] = values
             serialized_versions.append(serialized)
         return response.Response(serialized_versions, status=status.HTTP_200_OK)
@@ -240,6 +240,11 @@ CELERYBEAT_SCHEDULE = {
         'schedule': timedelta(hours=24),
         'args': (),
     },
+    'compact-quotas-usage-stripes': {
+        'task': 'nodeconductor.quotas.compact_usage_stripes',
+        'schedule': timedelta(minutes=5),
+        'args': (),
+    },
 }
 
 # Logging
@@ -261,6 +266,19 @@ NODECONDUCTOR = {
     'BACKEND_FIELDS_EDITABLE': True,
     'VALIDATE_INVITATION_EMAIL': False,
     'INITIAL_CUSTOMER_AGREEMENT_NUMBER': 4000,
+    'TASK_STATS_ENABLED': False,
+    'COALESCE_QUOTA_USAGE_DELTAS': True,
+    'ASYNC_QUOTA_PROPAGATION': False,
+    'COALESCE_PRICE_ESTIMATES_UPDATES': True,
+    'HOOK_DELIVERY': {
+        'TIMEOUT': 10,
+        'RETRIES': 3,
+        'BACKOFF_FACTOR': 0.5,
+        'MAX_WORKERS': 10,
+        'MAX_REQUESTS_PER_HOST': 4,
+        'CIRCUIT_BREAKER_THRESHOLD': 5,
+        'CIRCUIT_BREAKER_TIMEOUT': 5 * 60,
+    },
 }
 
 
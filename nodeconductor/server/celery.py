@@ -1,11 +1,14 @@
 from __future__ import absolute_import
 
+import logging
 import os
+import time
 
 from celery import Celery
 from celery import signals
 from django.conf import settings
 
+from nodeconductor.core import task_stats
 from nodeconductor.logging.middleware import get_event_context, set_event_context, reset_event_context
 
 # set the default Django settings module for the 'celery' program.
@@ -57,3 +60,37 @@ def bind_event_context(sender=None, **kwargs):
 @signals.task_postrun.connect
 def unbind_event_context(sender=None, **kwargs):
     reset_event_context()
+
+
+# Worker pool processes exit without running atexit functions,
+# so buffered log records are flushed by closing handlers explicitly.
+@signals.worker_process_shutdown.connect
+def flush_log_handlers(**kwargs):
+    logging.shutdown()
+
+
+# Task performance telemetry: publishing time is passed to worker in message headers,
+# worker measures task execution and aggregates measurements in cache.
+@signals.before_task_publish.connect
+def pass_publish_time(sender=None, headers=None, **kwargs):
+    if headers is None or not task_stats.is_enabled():
+        return
+
+    headers[task_stats.PUBLISHED_AT_HEADER] = time.time()
+
+
+@signals.task_prerun.connect
+def start_task_stats(sender=None, task_id=None, task=None, **kwargs):
+    if task_stats.is_enabled():
+        headers = getattr(task.request, 'headers', None) or {}
+        task_stats.start(task_id, headers.get(task_stats.PUBLISHED_AT_HEADER))
+
+
+@signals.task_postrun.connect
+def finish_task_stats(sender=None, task_id=None, task=None, args=None, kwargs=None, **extra):
+    if not task_stats.is_enabled():
+        return
+
+    from nodeconductor.core.tasks import get_task_description
+    description = get_task_description(task, args or (), kwargs or {})
+    task_stats.finish(task_id, task.name, description)
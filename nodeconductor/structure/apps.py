@@ -61,6 +61,21 @@ class StructureConfig(AppConfig):
                 dispatch_uid='nodeconductor.structure.handlers.%s' % name,
             )
 
+        for model in structure_models_with_roles:
+            structure_signals.structure_role_granted.connect(
+                handlers.invalidate_permitted_objects_uuids_on_role_change,
+                sender=model,
+                dispatch_uid='nodeconductor.structure.handlers.'
+                             'invalidate_permitted_objects_uuids_on_%s_role_granted' % model.__name__,
+            )
+
+            structure_signals.structure_role_revoked.connect(
+                handlers.invalidate_permitted_objects_uuids_on_role_change,
+                sender=model,
+                dispatch_uid='nodeconductor.structure.handlers.'
+                             'invalidate_permitted_objects_uuids_on_%s_role_revoked' % model.__name__,
+            )
+
         structure_signals.structure_role_granted.connect(
             handlers.log_customer_role_granted,
             sender=Customer,
@@ -3,11 +3,13 @@ from __future__ import unicode_literals
 import logging
 
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 
 from nodeconductor.core import utils
 from nodeconductor.core.tasks import send_task
 from nodeconductor.core.models import StateMixin
+from nodeconductor.logging.loggers import invalidate_permitted_objects_uuids
 from nodeconductor.structure import SupportedServices, signals
 from nodeconductor.structure.log import event_logger
 from nodeconductor.structure.models import (Customer, CustomerPermission, Project, ProjectPermission,
@@ -136,6 +138,13 @@ def log_project_role_revoked(sender, structure, user, role, **kwargs):
         })
 
 
+def invalidate_permitted_objects_uuids_on_role_change(sender, structure, user, role, **kwargs):
+    """ Expire cached objects that are visible to user in events on role grant or revoke """
+    user_uuid = user.uuid.hex
+    invalidate_permitted_objects_uuids(user_uuid)
+    transaction.on_commit(lambda: invalidate_permitted_objects_uuids(user_uuid))
+
+
 def change_customer_nc_users_quota(sender, structure, user, role, signal, **kwargs):
     """ Modify nc_user_count quota usage on structure role grant or revoke """
     assert signal in (signals.structure_role_granted, signals.structure_role_revoked), \
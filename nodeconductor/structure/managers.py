@@ -1,5 +1,7 @@
 from operator import or_
 
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 from django.db import models
 
 from nodeconductor.core.managers import GenericKeyMixin, SummaryQuerySet
@@ -64,6 +66,55 @@ def filter_queryset_for_user(queryset, user):
         return queryset
 
 
+def get_permitted_users(instance):
+    """ Return users that can see instance or None if it is visible to all users.
+
+        Users are selected by the same rules as in filter_queryset_for_user.
+    """
+    try:
+        permissions = instance.Permissions
+    except AttributeError:
+        return None
+
+    model = type(instance)
+    extra_query = getattr(permissions, 'extra_query', None)
+    if extra_query and model.objects.filter(pk=instance.pk, **extra_query).exists():
+        return None
+
+    query = models.Q(is_staff=True) | models.Q(is_support=True)
+    for entity in ('customer', 'project'):
+        try:
+            path = getattr(permissions, '%s_path' % entity)
+        except AttributeError:
+            continue
+
+        prefix = '' if path == 'self' else path + '__'
+        kwargs = {prefix + 'permissions__is_active': True}
+        role = getattr(permissions, '%s_role' % entity, None)
+        if role:
+            kwargs[prefix + 'permissions__role'] = role
+        users_ids = model.objects.filter(pk=instance.pk, **kwargs).values_list(prefix + 'permissions__user', flat=True)
+        query |= models.Q(pk__in=users_ids)
+
+    return get_user_model().objects.filter(query)
+
+
+def get_generic_query_for_user(user, scope_models, content_type_field='content_type', object_id_field='object_id'):
+    """ Return Q object that selects objects with generic foreign key to scopes visible to user.
+
+        Visible scopes of each model are selected by subquery, so their ids are never loaded
+        to Python and size of SQL query does not depend on number of scopes.
+    """
+    query = models.Q()
+    for model in scope_models:
+        user_scopes = filter_queryset_for_user(model.objects.all(), user)
+        query |= models.Q(**{
+            content_type_field + '_id': ContentType.objects.get_for_model(model).id,
+            object_id_field + '__in': user_scopes.order_by().values('pk'),
+        })
+    return query
+
+
 class StructureQueryset(models.QuerySet):
     """ Provides additional filtering by customer or project (based on permission definition).
 
@@ -90,6 +141,13 @@ class StructureQueryset(models.QuerySet):
             *[self._patch_query_argument(a) for a in args],
             **self._filter_by_custom_fields(**kwargs))
 
+    def get_lookup_path(self, lookup):
+        """ Return lookup with customer or project path replaced by real relations path.
+
+            Useful for methods that do not support custom fields, for example values().
+        """
+        return list(self._filter_by_custom_fields(**{lookup: None}).keys())[0]
+
     def _patch_query_argument(self, arg):
         # patch Q() objects if passed and add support of custom fields
         if isinstance(arg, models.Q):
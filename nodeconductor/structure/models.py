@@ -31,7 +31,7 @@ from nodeconductor.core.validators import validate_name, validate_cidr_list
 from nodeconductor.monitoring.models import MonitoringModelMixin
 from nodeconductor.quotas import models as quotas_models, fields as quotas_fields
 from nodeconductor.logging.loggers import LoggableMixin
-from nodeconductor.structure.managers import StructureManager, filter_queryset_for_user, \
+from nodeconductor.structure.managers import StructureManager, filter_queryset_for_user, get_permitted_users, \
     ServiceSettingsManager, PrivateServiceSettingsManager, SharedServiceSettingsManager
 from nodeconductor.structure.signals import structure_role_granted, structure_role_revoked
 from nodeconductor.structure.images import ImageModelMixin
@@ -82,6 +82,10 @@ class StructureLoggableMixin(LoggableMixin):
         key = core_utils.camel_case_to_underscore(cls.__name__) + '_uuid'
         return {key: uuids}
 
+    def get_permitted_users_uuids(self):
+        users = get_permitted_users(self)
+        return users.values_list('uuid', flat=True) if users is not None else None
+
 
 class TagMixin(models.Model):
     """
@@ -84,9 +84,6 @@ class BackgroundPullTask(core_tasks.BackgroundTask):
         else:
             self.on_pull_success(instance)
 
-    def is_equal(self, other_task, serialized_instance):
-        return self.name == other_task.get('name') and serialized_instance in other_task.get('args', [])
-
     def pull(self, instance):
         """ Pull instance from backend.
 
@@ -128,9 +125,6 @@ class BackgroundListPullTask(core_tasks.BackgroundTask):
     model = NotImplemented
     pull_task = NotImplemented
 
-    def is_equal(self, other_task):
-        return self.name == other_task.get('name')
-
     def get_pulled_objects(self):
         States = self.model.States
         return self.model.objects.filter(state__in=[States.ERRED, States.OK]).exclude(backend_id='')
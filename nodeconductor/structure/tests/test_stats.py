@@ -2,11 +2,14 @@ from __future__ import unicode_literals
 
 from datetime import timedelta
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import test, status
 
 from nodeconductor.core import utils as core_utils
+from nodeconductor.quotas.models import QuotaSample
 from nodeconductor.structure import models
 from nodeconductor.structure.tests import factories
 
@@ -114,6 +117,33 @@ class StatsQuotaTimelineTest(BaseQuotaAggregationTest):
         self.assertEqual(110, response.data[0]['vcpu_limit'])
         self.assertEqual(12, response.data[0]['vcpu_usage'])
 
+    def test_values_are_taken_from_history(self):
+        self.create_links(limit1=10, usage1=2, limit2=100, usage2=10)
+        QuotaSample.objects.filter(quota__name='vcpu').update(timestamp=timezone.now() - timedelta(days=2))
+
+        response = self.client.get(reverse('stats_quota_timeline'), data={
+            'aggregate': 'project',
+            'uuid': self.project.uuid.hex,
+            'item': 'vcpu',
+            'interval': 'day',
+            'from': core_utils.datetime_to_timestamp(timezone.now() - timedelta(days=3)),
+            'to': core_utils.datetime_to_timestamp(timezone.now()),
+        })
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['vcpu_usage'] for row in response.data], [12, 12, 12])
+
+    def test_number_of_queries_does_not_depend_on_number_of_links(self):
+        self.create_links(limit1=10, usage1=2, limit2=100, usage2=10)
+        with CaptureQueriesContext(connection) as context:
+            self.get_response()
+        queries_count = len(context)
+
+        self.create_links(limit1=10, usage1=2, limit2=100, usage2=10)
+        with self.assertNumQueries(queries_count):
+            response = self.get_response()
+        self.assertEqual(24, response.data[0]['vcpu_usage'])
+
     def get_response(self):
         response = self.client.get(reverse('stats_quota_timeline'), data={
             'aggregate': 'project',
@@ -7,6 +7,7 @@ from functools import partial
 
 from django.conf import settings as django_settings
 from django.contrib import auth
+from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
 from django.db.models import Q
 from django.http import Http404
@@ -24,7 +25,6 @@ from rest_framework import generics
 from rest_framework.decorators import detail_route, list_route
 from rest_framework.exceptions import PermissionDenied, MethodNotAllowed, NotFound, APIException, ValidationError
 from rest_framework.response import Response
-from reversion.models import Version
 
 from nodeconductor.core import (
     filters as core_filters, mixins as core_mixins, models as core_models,
@@ -32,7 +32,7 @@ from nodeconductor.core import (
 from nodeconductor.core.utils import datetime_to_timestamp, sort_dict
 from nodeconductor.logging import models as logging_models
 from nodeconductor.logging.loggers import expand_alert_groups
-from nodeconductor.quotas.models import QuotaModelMixin, Quota
+from nodeconductor.quotas.models import QuotaModelMixin, Quota, QuotaSample
 from nodeconductor.structure import (
     SupportedServices, ServiceBackendError, ServiceBackendNotImplemented, filters, permissions, models, serializers,
     managers)
@@ -1741,32 +1741,36 @@ class QuotaTimelineStatsView(views.APIView):
     """
 
     def get(self, request, format=None):
-        scopes = self.get_quota_scopes(request)
         ranges = self.get_ranges(request)
         items = request.query_params.getlist('item') or self.get_all_spls_quotas()
+        quotas = Quota.objects.filter(self.get_quota_scopes_query(request), name__in=items)
+        quotas_names = dict(quotas.values_list('pk', 'name'))
 
+        # ranges are sorted from the newest to the oldest, values of each range are taken at its end.
+        timelines = QuotaSample.objects.get_timelines(quotas_names.keys(), [end for end, start in ranges])
         collector = QuotaTimelineCollector()
-        for item in items:
-            for scope in scopes:
-                values = self.get_stats_for_scope(item, scope, ranges)
-                for (end, start), (limit, usage) in zip(ranges, values):
-                    collector.add_quota(start, end, item, limit, usage)
+        for quota_id, values in timelines.items():
+            for (end, start), value in zip(ranges, values):
+                if value is not None:
+                    limit, usage = value
+                    collector.add_quota(start, end, quotas_names[quota_id], limit, usage)
 
         stats = map(sort_dict, collector.to_dict())[::-1]
         return Response(stats, status=status.HTTP_200_OK)
 
-    def get_quota_scopes(self, request):
+    def get_quota_scopes_query(self, request):
+        """ Return query that filters quotas of all available service project links """
         serializer = serializers.AggregateSerializer(data=request.query_params)
         serializer.is_valid(raise_exception=True)
-        scopes = sum([list(qs) for qs in serializer.get_service_project_links(request.user)], [])
-        # XXX: quick and dirty hack for OpenStack: use tenants instead of SPLs as quotas scope.
-        new_scopes = []
-        for index, scope in enumerate(scopes):
-            if scope.service.settings.type == 'OpenStack':
-                new_scopes += list(scope.tenants.all())
-            else:
-                new_scopes.append(scope)
-        return new_scopes
+        query = Q(pk__in=[])
+        for queryset in serializer.get_service_project_links(request.user):
+            # XXX: quick and dirty hack for OpenStack: use tenants instead of SPLs as quotas scope.
+            if queryset.model.__name__ == 'OpenStackServiceProjectLink':
+                spl_field = queryset.model.tenants.field
+                queryset = spl_field.model.objects.filter(**{spl_field.name + '__in': queryset})
+            content_type = ContentType.objects.get_for_model(queryset.model)
+            query |= Q(content_type=content_type, object_id__in=queryset.values('pk'))
+        return query
 
     def get_all_spls_quotas(self):
         # XXX: quick and dirty hack for OpenStack: use tenants instead of SPLs as quotas scope.
@@ -1774,26 +1778,6 @@ class QuotaTimelineStatsView(views.APIView):
                       for m in models.ServiceProjectLink.get_all_models()]
         return sum([spl_model.get_quotas_names() for spl_model in spl_models], [])
 
-    def get_stats_for_scope(self, quota_name, scope, dates):
-        stats_data = []
-        try:
-            quota = scope.quotas.get(name=quota_name)
-        except Quota.DoesNotExist:
-            return stats_data
-        versions = Version.objects.get_for_object(quota).select_related('revision').filter(
-            revision__date_created__lte=dates[0][0]).iterator()
-        version = None
-        for end, start in dates:
-            try:
-                while version is None or version.revision.date_created > end:
-                    version = versions.next()
-                stats_data.append((version._object_version.object.limit,
-                                   version._object_version.object.usage))
-            except StopIteration:
-                break
-
-        return stats_data
-
     def get_ranges(self, request):
         mapped = {
             'start_time': request.query_params.get('from'),
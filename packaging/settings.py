@@ -41,6 +41,7 @@ config_defaults = {
         'verify_certs': 'true',  # only has effect if protocol is 'https'
     },
     'events': {
+        'elasticsearch': 'false',
         'hook': 'false',
         'log_file': '',  # empty to disable logging events to file
         'log_level': 'INFO',
@@ -217,7 +218,9 @@ LOGGING = {
             'level': config.get('events', 'log_level').upper(),
         },
         # Send logs to log server
-        # Note that nodeconductor.logging.log.TCPEventHandler does not support exernal formatters
+        # Note that nodeconductor.logging.log.TCPEventHandler does not support exernal formatters.
+        # Records are sent from background thread, up to 'queue_size' records are kept in memory
+        # while log server is not available, other records are dropped.
         'tcp': {
             'class': 'nodeconductor.logging.log.TCPEventHandler',
             'filters': ['is-not-event'],
@@ -231,9 +234,22 @@ LOGGING = {
             'port': config.getint('events', 'logserver_port'),
         },
 
+        # Index events directly to Elasticsearch configured in [elasticsearch] section
+        # Events are indexed in batches to daily indexes, the same way as they are indexed by logstash.
+        'elasticsearch-event': {
+            'class': 'nodeconductor.logging.log.ElasticsearchEventHandler',
+            'filters': ['is-event'],
+            'level': config.get('events', 'log_level').upper(),
+        },
+
         # Send logs to web hook
         'hook-event': {
             'class': 'nodeconductor.logging.log.HookHandler',
+            # Events are sent to hooks processing in batches of up to 100 events
+            # or each 2 seconds whichever comes first. Timer thread requires enable-threads
+            # option of uWSGI, see uwsgi.ini, otherwise events are sent one by one.
+            'batch_size': 100,
+            'flush_interval': 2,
             'filters': ['is-event'],
             'level': config.get('events', 'log_level').upper(),
         },
@@ -307,6 +323,10 @@ if config.getboolean('events', 'syslog'):
     LOGGING['handlers']['syslog-event']['address'] = '/dev/log'
     LOGGING['loggers']['nodeconductor']['handlers'].append('syslog-event')
 
+if config.getboolean('events', 'elasticsearch'):
+    LOGGING['loggers']['nodeconductor']['handlers'].remove('tcp-event')
+    LOGGING['loggers']['nodeconductor']['handlers'].append('elasticsearch-event')
+
 if config.getboolean('events', 'hook'):
     LOGGING['loggers']['nodeconductor']['handlers'].append('hook-event')
 